@@ -170,4 +170,35 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 # (Опционально) медиафайлы, если нужны
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / "media"
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Кэш на диске: общий для всех процессов веб-сервера и переживает перезапуск
+# (готовые фрагменты карт поездок и т.п.)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',  # как по умолчанию в Django
+    },
+    # Готовые HTML-карты поездок (vehicle/modules/route_map.py): крупные и долгоживущие, на диске
+    'route_maps': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('ROUTE_MAP_CACHE_DIR', str(BASE_DIR / "cache" / "route_maps")),
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+ROUTE_MAP_CACHE_TIMEOUT = 30 * 24 * 3600  # карта закончившейся поездки не меняется, пока не добавят точки
+MANAGER_SCOPE_CACHE_TIMEOUT = 3600  # предприятия менеджера; сбрасывается сигналами при изменении
+
+# Потоки для фоновых задач (выгрузки и т.п.) внутри процесса веб-сервера
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+
+# Обратное геокодирование адресов поездок (vehicle/modules/geocoding.py)
+# Для тестов/разработки без сети: GEOCODER=vehicle.modules.geocoding.StubGeocoder
+GEOCODER = os.environ.get('GEOCODER', 'vehicle.modules.geocoding.ORSGeocoder')
+ORS_API_KEY = os.environ.get('ORS_API_KEY', '')
+GEOCODING_PRECISION = int(os.environ.get('GEOCODING_PRECISION', 4))  # знаков после запятой, 4 ≈ 11 м
+GEOCODING_TTL_DAYS = int(os.environ.get('GEOCODING_TTL_DAYS', 180))
+GEOCODING_LRU_SIZE = 4096
+GEOCODING_WORKERS = int(os.environ.get('GEOCODING_WORKERS', 8))  # параллельных запросов к провайдеру
+GEOCODING_RATE_LIMIT = None  # запросов в секунду; None — лимит самого провайдера (ORS: 100/мин)
+GEOCODING_DEADLINE = 10  # секунд на геокодирование одной страницы, дальше адреса — null
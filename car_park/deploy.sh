@@ -77,6 +77,7 @@ docker-compose -p "${COMPOSE_PROJECT}" up -d --build
 # Миграции и статика (Django)
 echo "==> Запускаем миграции и сбор статики"
 docker-compose -p "${COMPOSE_PROJECT}" run --rm web python manage.py migrate --noinput
+docker-compose -p "${COMPOSE_PROJECT}" run --rm web python manage.py gps_partitions --ahead=3
 docker-compose -p "${COMPOSE_PROJECT}" run --rm web python manage.py collectstatic --noinput
 
 # Чистка dangling-ресурсов
@@ -3,7 +3,7 @@ from django.contrib import admin
 # Register your models here.
 
 from .models import Vehicle, Brand, Model, Configuration, Enterprise, Driver, VehicleDriverAssignment, Manager, \
-    VehicleGPSPoint, Route
+    VehicleGPSPoint, Route, ExportJob, VehicleDailyMileage
 from django.contrib.gis import admin as gis_admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
@@ -26,6 +26,16 @@ class VehicleGPSPointAdmin(gis_admin.GISModelAdmin):
 class VehicleRouteAdmin(gis_admin.GISModelAdmin):
     list_display = ('vehicle', 'start_time', 'end_time', 'start_location', 'end_location')
 
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'enterprise', 'format', 'start_time', 'end_time', 'status', 'progress', 'created_at')
+    list_filter = ('status', 'format')
+
+@admin.register(VehicleDailyMileage)
+class VehicleDailyMileageAdmin(admin.ModelAdmin):
+    list_display = ('vehicle', 'day', 'distance_km', 'points_count', 'updated_at')
+    list_filter = ('day',)
+
 @admin.register(Configuration)
 class ConfigurationAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'model', 'tank_capacity', 'payload', 'seats_number')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from ...models import Route
+from ...modules import geocoding
+from ...modules.enterprise_import import ROUTE_ENDPOINTS_SQL
+
+
+class Command(BaseCommand):
+    """
+    Пример:
+      python manage.py backfill_route_addresses
+      python manage.py backfill_route_addresses --enterprise=3 --batch=200
+
+    Заполняет Route.start_address/end_address у существующих поездок.
+    Поездкам без координат начала/конца (старые импорты) они сначала берутся из их GPS-точек.
+    Можно запускать повторно: обрабатываются только поездки с незаполненными адресами.
+    """
+    help = "Заполняет сохранённые адреса начала/конца поездок."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enterprise', type=int, default=None, help="Только поездки машин предприятия")
+        parser.add_argument('--batch', type=int, default=geocoding.ROUTE_BATCH_SIZE,
+                            help="Сколько поездок обрабатывать за раз")
+
+    def handle(self, *args, **options):
+        routes = Route.objects.all()
+        if options['enterprise']:
+            routes = routes.filter(vehicle__enterprise_id=options['enterprise'])
+
+        missing_endpoints = list(routes.filter(
+            Q(start_location__isnull=True) | Q(end_location__isnull=True)
+        ).values_list('id', flat=True))
+        with connection.cursor() as cursor:
+            for i in range(0, len(missing_endpoints), options['batch']):
+                cursor.execute(ROUTE_ENDPOINTS_SQL, [missing_endpoints[i:i + options['batch']]])
+
+        route_ids = list(routes.filter(
+            Q(start_address__isnull=True, start_location__isnull=False)
+            | Q(end_address__isnull=True, end_location__isnull=False)
+        ).order_by('id').values_list('id', flat=True))
+
+        updated = 0
+        for i in range(0, len(route_ids), options['batch']):
+            updated += geocoding.fill_route_addresses(route_ids[i:i + options['batch']])
+            self.stdout.write(f"Обработано {min(i + options['batch'], len(route_ids))} из {len(route_ids)}")
+
+        self.stdout.write(self.style.SUCCESS(f"Адреса заполнены у {updated} поездок"))
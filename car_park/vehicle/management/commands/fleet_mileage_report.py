@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import Enterprise, EnterpriseMileageReport, Report
+from ...modules import mileage, report_jobs
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"Некорректная дата {value!r}, нужен формат YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    """
+    Пример:
+      python manage.py fleet_mileage_report --enterprise=3 --start=2025-01-01 --end=2025-12-31 --period=month
+      python manage.py fleet_mileage_report --enterprise=3 --start=2025-01-01 --end=2025-01-31 --workers=8
+
+    Считает отчёт о пробеге парка движком python (NumPy в пуле процессов) в этом процессе.
+    Веб-сервер такой отчёт не считает: пул процессов не запускается из веб-процессов.
+    Готовый отчёт сохраняется и виден в списке отчётов (/reports/<id>/).
+    """
+    help = "Считает отчёт о пробеге парка движком python в пуле процессов."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enterprise', type=int, required=True, help="ID предприятия")
+        parser.add_argument('--start', type=_date, required=True, help="Первый день, YYYY-MM-DD")
+        parser.add_argument('--end', type=_date, required=True, help="Последний день, YYYY-MM-DD")
+        parser.add_argument('--period', default='day', choices=[key for key, _ in Report.PERIOD_CHOICES])
+        parser.add_argument('--workers', type=int, default=None, help="Процессов в пуле (по умолчанию — по числу CPU)")
+
+    def handle(self, *args, **options):
+        enterprise = Enterprise.objects.filter(pk=options['enterprise']).first()
+        if enterprise is None:
+            raise CommandError(f"Предприятие #{options['enterprise']} не найдено")
+
+        now = timezone.now()
+        report = EnterpriseMileageReport.objects.create(
+            name=f"Пробег парка {enterprise.name}", enterprise=enterprise, engine=mileage.ENGINE_PYTHON,
+            start_date=options['start'], end_date=options['end'], period=options['period'],
+            status=Report.RUNNING, started_at=now, updated_at=now,
+        )
+        fingerprint = report_jobs.rollup_fingerprint(report)
+        try:
+            report.calculate_report(workers=options['workers'])
+        except Exception as e:
+            now = timezone.now()
+            Report.objects.filter(pk=report.pk).update(
+                status=Report.FAILED, error=str(e), updated_at=now, finished_at=now
+            )
+            raise CommandError(f"Отчёт #{report.pk} завершился ошибкой: {e}")
+
+        now = timezone.now()
+        Report.objects.filter(pk=report.pk).update(
+            result=report.result, rollup_fingerprint=fingerprint, status=Report.DONE, progress=100,
+            updated_at=now, finished_at=now,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Отчёт #{report.pk}: периодов {len(report.result)}"))
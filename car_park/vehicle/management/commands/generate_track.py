@@ -5,7 +5,9 @@ from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django.contrib.gis.geos import Point
-from ...models import Vehicle, VehicleGPSPoint, Route
+from django.db import transaction
+from ...models import Vehicle, Route
+from ...modules.gps_ingest import copy_gps_points
 
 
 class Command(BaseCommand):
@@ -78,18 +80,15 @@ class Command(BaseCommand):
         start_time = current_time  # начало поездки.  Для записи Route
 
         start_location, end_location = None, None
+        rows = []
 
         for idx, (lng, lat) in enumerate(route_coords):
             # случайно варьируем приращение времени:
             random_delay = random.uniform(delay_sec * 0.5, delay_sec * 1.5)
             current_time += timezone.timedelta(seconds=random_delay)
             point = Point(lng, lat, srid=4326)
-            # Сохраняем точку
-            VehicleGPSPoint.objects.create(
-                vehicle=vehicle,
-                timestamp=current_time,
-                location=point
-            )
+            # Копим точку, в базу пишем одной пачкой в конце
+            rows.append((vehicle.id, current_time, lng, lat))
             self.stdout.write(
                 f"[{idx + 1}/{len(route_coords)}] [lat, lng] => {lat:.5f}, {lng:.5f}, time={current_time}")
 
@@ -98,16 +97,18 @@ class Command(BaseCommand):
             if idx == len(route_coords) - 1:
                 end_location = point
 
-        self.stdout.write(self.style.SUCCESS("Трек успешно сгенерирован!"))
-
         end_time = current_time  # конец поездки.  Для записи Route
-        Route.objects.create(
-            vehicle=vehicle,
-            start_time=start_time,
-            end_time=end_time,
-            start_location=start_location,
-            end_location=end_location
-        )  # Записываем Route
+        with transaction.atomic():
+            copy_gps_points(rows)
+            Route.objects.create(
+                vehicle=vehicle,
+                start_time=start_time,
+                end_time=end_time,
+                start_location=start_location,
+                end_location=end_location
+            )  # Записываем Route
+
+        self.stdout.write(self.style.SUCCESS("Трек успешно сгенерирован!"))
 
     def __calculate_end_point(self, distance_km, start_lat, start_lng) -> list[float]:
         """Вычисляем конечную точку (end_lat, end_lng).
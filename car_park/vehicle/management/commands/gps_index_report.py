@@ -0,0 +1,130 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...models import Vehicle, VehicleGPSPoint, Route
+from ...modules.partitions import PARENT_TABLE
+
+
+class Command(BaseCommand):
+    """
+    Пример:
+      python manage.py gps_index_report
+      python manage.py gps_index_report --explain=42
+
+    Печатает по каждому индексу GPS-точек (суммарно по всем секциям):
+    число сканирований, прочитанные строки, размер и оценку раздутия.
+    --explain: EXPLAIN (ANALYZE, BUFFERS) типичной выборки точек поездки для машины —
+    в плане должен быть Index Only Scan по gps_vehicle_ts_uniq, а не Seq Scan.
+    """
+    help = "Отчёт по использованию и раздутию индексов GPS-точек."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--explain', type=int, default=None, metavar='VEHICLE_ID',
+                            help="Показать план запроса точек последней поездки машины")
+
+    def handle(self, *args, **options):
+        self._print_table_stats()
+        self._print_index_stats()
+        if options['explain'] is not None:
+            self._print_explain(options['explain'])
+
+    def _print_table_stats(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT sum(seq_scan), sum(idx_scan), sum(n_live_tup), sum(n_dead_tup)
+                FROM pg_stat_user_tables
+                WHERE relid = %s::regclass
+                   OR relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+                """,
+                [PARENT_TABLE, PARENT_TABLE],
+            )
+            seq_scan, idx_scan, live, dead = cursor.fetchone()
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Таблица {PARENT_TABLE} (все секции)"))
+        self.stdout.write(f"  seq_scan={seq_scan or 0} idx_scan={idx_scan or 0} "
+                          f"live={live or 0} dead={dead or 0}")
+
+    def _print_index_stats(self):
+        has_pgstattuple = self._has_extension('pgstattuple')
+        with connection.cursor() as cursor:
+            # Индексы секций сводим к родительскому индексу через pg_inherits
+            cursor.execute(
+                """
+                SELECT COALESCE(parent.relname, s.indexrelname) AS index_name,
+                       am.amname,
+                       sum(s.idx_scan), sum(s.idx_tup_read), sum(s.idx_tup_fetch),
+                       sum(pg_relation_size(s.indexrelid)),
+                       array_agg(s.indexrelid::regclass::text)
+                FROM pg_stat_user_indexes s
+                JOIN pg_class ic ON ic.oid = s.indexrelid
+                JOIN pg_am am ON am.oid = ic.relam
+                LEFT JOIN pg_inherits ih ON ih.inhrelid = s.indexrelid
+                LEFT JOIN pg_class parent ON parent.oid = ih.inhparent
+                WHERE s.relid = %s::regclass
+                   OR s.relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+                GROUP BY 1, 2
+                ORDER BY 1
+                """,
+                [PARENT_TABLE, PARENT_TABLE],
+            )
+            rows = cursor.fetchall()
+
+            self.stdout.write(self.style.MIGRATE_HEADING("Индексы"))
+            for name, method, scans, tup_read, tup_fetch, size, members in rows:
+                bloat = self._btree_bloat(cursor, members) if method == 'btree' and has_pgstattuple else None
+                bloat_str = f"{bloat:.1f}%" if bloat is not None else "n/a"
+                self.stdout.write(
+                    f"  {name} [{method}] scans={scans or 0} tup_read={tup_read or 0} "
+                    f"tup_fetch={tup_fetch or 0} size={self._human(size or 0)} bloat={bloat_str}"
+                )
+        if not has_pgstattuple:
+            self.stdout.write("  (для оценки раздутия установите расширение pgstattuple)")
+
+    def _btree_bloat(self, cursor, members):
+        """Доля «пустого» места в листьях B-tree (100 - avg_leaf_density), средняя по секциям."""
+        densities = []
+        for index_name in members:
+            cursor.execute("SELECT avg_leaf_density FROM pgstatindex(%s)", [index_name])
+            density = cursor.fetchone()[0]
+            if density == density:  # NaN у пустых индексов
+                densities.append(density)
+        if not densities:
+            return None
+        return 100 - sum(densities) / len(densities)
+
+    def _print_explain(self, vehicle_id):
+        try:
+            vehicle = Vehicle.objects.get(pk=vehicle_id)
+        except Vehicle.DoesNotExist:
+            raise CommandError(f"Vehicle with id={vehicle_id} not found.")
+
+        route = Route.objects.filter(vehicle=vehicle).order_by('-start_time').first()
+        if route:
+            start, end = route.start_time, route.end_time
+        else:
+            last = VehicleGPSPoint.objects.filter(vehicle=vehicle).order_by('-timestamp').first()
+            if not last:
+                raise CommandError("У машины нет ни поездок, ни GPS-точек.")
+            start, end = last.timestamp - timedelta(days=1), last.timestamp
+
+        qs = VehicleGPSPoint.objects.filter(
+            vehicle=vehicle, timestamp__gte=start, timestamp__lte=end
+        ).order_by('timestamp').values_list('timestamp', 'location')
+        self.stdout.write(self.style.MIGRATE_HEADING(f"План выборки точек {start} — {end}"))
+        self.stdout.write(qs.explain(analyze=True, buffers=True))
+
+    @staticmethod
+    def _has_extension(name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = %s", [name])
+            return cursor.fetchone() is not None
+
+    @staticmethod
+    def _human(size):
+        for unit in ('B', 'kB', 'MB', 'GB'):
+            if size < 1024:
+                return f"{size:.0f}{unit}"
+            size /= 1024
+        return f"{size:.1f}TB"
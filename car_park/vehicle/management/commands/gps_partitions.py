@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ...modules import partitions
+
+
+class Command(BaseCommand):
+    """
+    Пример (запускать по cron раз в сутки/неделю):
+      python manage.py gps_partitions --ahead=3
+      python manage.py gps_partitions --retain-months=24 --archive-schema=gps_archive
+      python manage.py gps_partitions --retain-months=36 --drop
+
+    --ahead: сколько месяцев вперёд держать готовые секции
+    --retain-months: сколько месяцев истории оставлять присоединёнными (0 — не трогать)
+    --archive-schema: куда переносить отсоединённые секции
+    --drop: удалять отсоединённые секции вместо архивации
+    """
+    help = "Создаёт будущие месячные секции GPS-точек и отсоединяет/архивирует старые."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help="Сколько месяцев вперёд создать секции")
+        parser.add_argument('--retain-months', type=int, default=0,
+                            help="Сколько месяцев истории оставить (0 — без ретеншна)")
+        parser.add_argument('--archive-schema', type=str, default=None,
+                            help="Схема для отсоединённых секций")
+        parser.add_argument('--drop', action='store_true', help="Удалять отсоединённые секции")
+
+    def handle(self, *args, **options):
+        if options['drop'] and options['archive_schema']:
+            raise CommandError("--drop и --archive-schema взаимоисключающие.")
+
+        today = timezone.now().date()
+
+        with transaction.atomic():
+            created = partitions.ensure_partitions(today, options['ahead'])
+        for name in created:
+            self.stdout.write(self.style.SUCCESS(f"Создана секция {name}"))
+
+        retain = options['retain_months']
+        if retain > 0:
+            cutoff = partitions.add_months(partitions.month_start(today), -retain)
+            with transaction.atomic():
+                detached = partitions.detach_partitions_before(
+                    cutoff, archive_schema=options['archive_schema'], drop=options['drop']
+                )
+            for name in detached:
+                self.stdout.write(self.style.WARNING(f"Отсоединена секция {name}"))
+
+        leftovers = partitions.default_partition_rows()
+        if leftovers:
+            self.stdout.write(self.style.WARNING(
+                f"В DEFAULT-секции {leftovers} точек вне месячных секций (слишком старые или из будущего)."
+            ))
+        self.stdout.write(self.style.SUCCESS("Секции GPS-точек в порядке."))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Vehicle
+from ...modules import mileage
+
+
+class Command(BaseCommand):
+    """
+    Пример:
+      python manage.py rebuild_daily_mileage
+      python manage.py rebuild_daily_mileage --enterprise=3
+      python manage.py rebuild_daily_mileage --vehicle=17 --vehicle=18
+
+    Пересчитывает суточные итоги пробега с нуля по сырым GPS-точкам.
+    Нужен после смены таймзоны предприятия или правки точек в обход copy_gps_points;
+    при обычной записи точек итоги обновляются сами (начальное заполнение делает миграция 0021).
+    """
+    help = "Пересчитывает таблицу суточного пробега (VehicleDailyMileage) по GPS-точкам."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, action='append', default=[], help="ID машины (можно несколько)")
+        parser.add_argument('--enterprise', type=int, default=None, help="Только машины предприятия")
+
+    def handle(self, *args, **options):
+        vehicles = Vehicle.objects.order_by('id')
+        if options['vehicle']:
+            vehicles = vehicles.filter(pk__in=options['vehicle'])
+        if options['enterprise']:
+            vehicles = vehicles.filter(enterprise_id=options['enterprise'])
+
+        total = 0
+        for vehicle_id in vehicles.values_list('id', flat=True):
+            # Каждая машина в своей транзакции: долгий пересчёт парка не держит одну огромную
+            with transaction.atomic():
+                days = mileage.rebuild_daily_mileage(vehicle_id)
+            total += days
+            self.stdout.write(f"Машина #{vehicle_id}: {days} дн.")
+
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано суточных итогов: {total}"))
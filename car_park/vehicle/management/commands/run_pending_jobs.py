@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import ExportJob, Report
+from ...modules import export_jobs, report_jobs
+
+
+class Command(BaseCommand):
+    """
+    Пример:
+      python manage.py run_pending_jobs
+      python manage.py run_pending_jobs --requeue-stale=30
+
+    Выполняет фоновые задачи (выгрузки и отчёты), оставшиеся в очереди (например, после перезапуска веб-сервера).
+    --requeue-stale: вернуть в очередь задачи, которые «выполняются» дольше N минут без прогресса.
+    """
+    help = "Выполняет задачи выгрузки и расчёта отчётов, ожидающие в очереди."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue-stale', type=int, default=None, metavar='MINUTES',
+                            help="Перезапустить задачи без прогресса дольше N минут")
+
+    def handle(self, *args, **options):
+        if options['requeue_stale'] is not None:
+            older_than = timezone.now() - timedelta(minutes=options['requeue_stale'])
+            requeued = export_jobs.requeue_stale_jobs(older_than)
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Возвращено в очередь выгрузок: {requeued}"))
+            requeued = report_jobs.requeue_stale_reports(older_than)
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Возвращено в очередь отчётов: {requeued}"))
+
+        pending = list(ExportJob.objects.filter(status=ExportJob.PENDING).order_by('created_at')
+                       .values_list('id', flat=True))
+        for job_id in pending:
+            self.stdout.write(f"Выгрузка #{job_id}...")
+            try:
+                export_jobs.run_export_job(job_id)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Выгрузка #{job_id} завершилась ошибкой: {e}"))
+
+        reports = list(Report.objects.filter(status=Report.PENDING).order_by('created_at')
+                       .values_list('id', flat=True))
+        for report_id in reports:
+            self.stdout.write(f"Отчёт #{report_id}...")
+            try:
+                report_jobs.run_report(report_id)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Отчёт #{report_id} завершился ошибкой: {e}"))
+
+        self.stdout.write(self.style.SUCCESS(f"Обработано задач: {len(pending) + len(reports)}"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Route
+from ...modules import geocoding
+
+
+class Command(BaseCommand):
+    """
+    Пример:
+      python manage.py warm_geocoding
+      python manage.py warm_geocoding --enterprise=3 --batch=200
+
+    Заранее заполняет кэш адресов для начальных и конечных точек поездок,
+    чтобы страницы поездок не ждали провайдера геокодирования.
+    """
+    help = "Прогревает кэш обратного геокодирования для всех поездок."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enterprise', type=int, default=None, help="Только поездки машин предприятия")
+        parser.add_argument('--batch', type=int, default=500, help="Сколько поездок обрабатывать за раз")
+
+    def handle(self, *args, **options):
+        routes = Route.objects.order_by('id')
+        if options['enterprise']:
+            routes = routes.filter(vehicle__enterprise_id=options['enterprise'])
+
+        batch, total, resolved = [], 0, 0
+        for start, end in routes.values_list('start_location', 'end_location').iterator(chunk_size=options['batch']):
+            batch.extend((point.y, point.x) for point in (start, end) if point)
+            if len(batch) >= options['batch'] * 2:
+                addresses = geocoding.reverse_geocode_many(batch)
+                total += len(addresses)
+                resolved += sum(1 for address in addresses.values() if address)
+                batch = []
+        if batch:
+            addresses = geocoding.reverse_geocode_many(batch)
+            total += len(addresses)
+            resolved += sum(1 for address in addresses.values() if address)
+
+        self.stdout.write(self.style.SUCCESS(f"Мест: {total}, с адресом: {resolved}"))
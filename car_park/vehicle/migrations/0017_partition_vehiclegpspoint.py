@@ -0,0 +1,122 @@
+# Перевод vehicle_vehiclegpspoint на декларативное секционирование по месяцам (RANGE по timestamp).
+# Состояние моделей Django не меняется: id остаётся уникальным за счёт общей последовательности,
+# но первичный ключ в БД составной (id, timestamp) — этого требует PostgreSQL для секционированных таблиц.
+
+from django.db import migrations
+
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION vehicle_gps_create_partition(month_start date) RETURNS text AS $$
+DECLARE
+    m_start date := date_trunc('month', month_start)::date;
+    lo timestamptz := m_start::timestamp AT TIME ZONE 'UTC';
+    hi timestamptz := (m_start + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+    part_name text := format('vehicle_vehiclegpspoint_p%s', to_char(m_start, 'YYYY_MM'));
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN part_name;
+    END IF;
+    -- Создаём таблицу отдельно, переносим в неё строки этого месяца из DEFAULT-секции
+    -- и только потом присоединяем: иначе ATTACH упадёт на проверке DEFAULT.
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE vehicle_vehiclegpspoint INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        part_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM vehicle_vehiclegpspoint_default '
+        'WHERE "timestamp" >= %L AND "timestamp" < %L RETURNING *) '
+        'INSERT INTO %I (id, "timestamp", location, vehicle_id) '
+        'SELECT id, "timestamp", location, vehicle_id FROM moved',
+        lo, hi, part_name);
+    EXECUTE format(
+        'ALTER TABLE vehicle_vehiclegpspoint ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        part_name, lo, hi);
+    RETURN part_name;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+FORWARD_SQL = [
+    "ALTER TABLE vehicle_vehiclegpspoint RENAME TO vehicle_vehiclegpspoint_old;",
+    "CREATE SEQUENCE vehicle_vehiclegpspoint_part_id_seq AS bigint;",
+    """
+    CREATE TABLE vehicle_vehiclegpspoint (
+        id bigint NOT NULL DEFAULT nextval('vehicle_vehiclegpspoint_part_id_seq'),
+        "timestamp" timestamp with time zone NOT NULL,
+        location geometry(POINT, 4326) NOT NULL,
+        vehicle_id integer NOT NULL
+    ) PARTITION BY RANGE ("timestamp");
+    """,
+    "ALTER SEQUENCE vehicle_vehiclegpspoint_part_id_seq OWNED BY vehicle_vehiclegpspoint.id;",
+    "CREATE TABLE vehicle_vehiclegpspoint_default PARTITION OF vehicle_vehiclegpspoint DEFAULT;",
+    CREATE_PARTITION_FUNCTION,
+    # Секции под всю существующую историю и пару месяцев вперёд
+    """
+    SELECT vehicle_gps_create_partition(m::date)
+    FROM generate_series(
+        date_trunc('month', COALESCE((SELECT min("timestamp") FROM vehicle_vehiclegpspoint_old), now())),
+        date_trunc('month', now()) + interval '2 month',
+        interval '1 month'
+    ) AS m;
+    """,
+    """
+    INSERT INTO vehicle_vehiclegpspoint (id, "timestamp", location, vehicle_id)
+    SELECT id, "timestamp", location, vehicle_id FROM vehicle_vehiclegpspoint_old;
+    """,
+    """
+    SELECT setval('vehicle_vehiclegpspoint_part_id_seq',
+                  COALESCE((SELECT max(id) FROM vehicle_vehiclegpspoint), 0) + 1, false);
+    """,
+    "DROP TABLE vehicle_vehiclegpspoint_old;",
+    # Ограничения и индексы с прежними именами, чтобы последующие миграции Django их находили
+    """
+    ALTER TABLE vehicle_vehiclegpspoint
+        ADD CONSTRAINT vehicle_vehiclegpspoint_pkey PRIMARY KEY (id, "timestamp");
+    """,
+    """
+    ALTER TABLE vehicle_vehiclegpspoint
+        ADD CONSTRAINT vehicle_vehiclegpspoint_vehicle_id_b24e1bbf_fk_vehicle_vehicle_id
+        FOREIGN KEY (vehicle_id) REFERENCES vehicle_vehicle (id) DEFERRABLE INITIALLY DEFERRED;
+    """,
+    "CREATE INDEX vehicle_vehiclegpspoint_vehicle_id_b24e1bbf ON vehicle_vehiclegpspoint (vehicle_id);",
+    "CREATE INDEX vehicle_vehiclegpspoint_location_id ON vehicle_vehiclegpspoint USING gist (location);",
+]
+
+REVERSE_SQL = [
+    "ALTER TABLE vehicle_vehiclegpspoint RENAME TO vehicle_vehiclegpspoint_part;",
+    "ALTER INDEX vehicle_vehiclegpspoint_pkey RENAME TO vehicle_vehiclegpspoint_part_pkey;",
+    "ALTER INDEX vehicle_vehiclegpspoint_vehicle_id_b24e1bbf RENAME TO vehicle_vehiclegpspoint_part_vehicle_id;",
+    "ALTER INDEX vehicle_vehiclegpspoint_location_id RENAME TO vehicle_vehiclegpspoint_part_location;",
+    """
+    CREATE TABLE vehicle_vehiclegpspoint (
+        id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+        "timestamp" timestamp with time zone NOT NULL,
+        location geometry(POINT, 4326) NOT NULL,
+        vehicle_id integer NOT NULL
+            CONSTRAINT vehicle_vehiclegpspoint_vehicle_id_b24e1bbf_fk_vehicle_vehicle_id
+            REFERENCES vehicle_vehicle (id) DEFERRABLE INITIALLY DEFERRED
+    );
+    """,
+    """
+    INSERT INTO vehicle_vehiclegpspoint (id, "timestamp", location, vehicle_id)
+    SELECT id, "timestamp", location, vehicle_id FROM vehicle_vehiclegpspoint_part;
+    """,
+    """
+    SELECT setval(pg_get_serial_sequence('vehicle_vehiclegpspoint', 'id'),
+                  COALESCE((SELECT max(id) FROM vehicle_vehiclegpspoint), 0) + 1, false);
+    """,
+    "DROP TABLE vehicle_vehiclegpspoint_part CASCADE;",
+    "DROP FUNCTION vehicle_gps_create_partition(date);",
+    "CREATE INDEX vehicle_vehiclegpspoint_vehicle_id_b24e1bbf ON vehicle_vehiclegpspoint (vehicle_id);",
+    "CREATE INDEX vehicle_vehiclegpspoint_location_id ON vehicle_vehiclegpspoint USING gist (location);",
+]
+
+
+class Migration(migrations.Migration):
+    atomic = True
+
+    dependencies = [
+        ('vehicle', '0016_report_vehiclemileagereport'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FORWARD_SQL, reverse_sql=REVERSE_SQL),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:00
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0017_partition_vehiclegpspoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vehiclegpspoint',
+            name='vehicle',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='gps_points', to='vehicle.vehicle'),
+        ),
+        migrations.AlterField(
+            model_name='vehiclegpspoint',
+            name='location',
+            field=django.contrib.gis.db.models.fields.PointField(spatial_index=False, srid=4326),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclegpspoint',
+            index=models.Index(fields=['vehicle', 'timestamp'], include=('location',), name='gps_vehicle_ts_cover_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclegpspoint',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['timestamp'], name='gps_timestamp_brin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclegpspoint',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['location'], fillfactor=90, name='gps_location_gist_idx'),
+        ),
+    ]
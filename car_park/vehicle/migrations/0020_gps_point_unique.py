@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+# Оставляем самую раннюю загруженную копию каждой точки
+DELETE_DUPLICATES_SQL = """
+    DELETE FROM vehicle_vehiclegpspoint a
+    USING vehicle_vehiclegpspoint b
+    WHERE a.vehicle_id = b.vehicle_id
+      AND a."timestamp" = b."timestamp"
+      AND a.id > b.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0019_exportjob'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATES_SQL, migrations.RunSQL.noop),
+        migrations.RemoveIndex(
+            model_name='vehiclegpspoint',
+            name='gps_vehicle_ts_cover_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='vehiclegpspoint',
+            constraint=models.UniqueConstraint(fields=('vehicle', 'timestamp'), include=('location',), name='gps_vehicle_ts_uniq'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# Начальное заполнение по всей истории одним проходом (как mileage.REFRESH_ROLLUP_SQL, но по всем машинам)
+FILL_ROLLUPS_SQL = """
+    INSERT INTO vehicle_vehicledailymileage
+        (vehicle_id, day, distance_km, points_count, first_timestamp, last_timestamp, updated_at)
+    SELECT vehicle_id, day, COALESCE(SUM(dist), 0) / 1000.0, COUNT(*), MIN(ts), MAX(ts), now()
+    FROM (
+        SELECT p.vehicle_id,
+               p."timestamp" AS ts,
+               (p."timestamp" AT TIME ZONE e.local_timezone)::date AS day,
+               ST_DistanceSphere(
+                   p.location,
+                   LAG(p.location) OVER (PARTITION BY p.vehicle_id ORDER BY p."timestamp")
+               ) AS dist
+        FROM vehicle_vehiclegpspoint p
+        JOIN vehicle_vehicle v ON v.id = p.vehicle_id
+        JOIN vehicle_enterprise e ON e.id = v.enterprise_id
+    ) segments
+    GROUP BY vehicle_id, day;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0020_gps_point_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleDailyMileage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('distance_km', models.FloatField(default=0)),
+                ('points_count', models.PositiveIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_mileage', to='vehicle.vehicle')),
+            ],
+            options={
+                'verbose_name': 'Суточный пробег',
+                'verbose_name_plural': 'Суточные пробеги',
+                'ordering': ['day'],
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'day'), name='daily_mileage_vehicle_day_uniq')],
+            },
+        ),
+        migrations.RunSQL(FILL_ROLLUPS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0021_vehicledailymileage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnterpriseMileageReport',
+            fields=[
+                ('report_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='vehicle.report')),
+                ('enterprise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mileage_reports', to='vehicle.enterprise')),
+            ],
+            bases=('vehicle.report',),
+        ),
+        migrations.CreateModel(
+            name='EnterpriseMileageReportRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_key', models.CharField(max_length=10)),
+                ('mileage', models.FloatField()),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='vehicle.enterprisemileagereport')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='vehicle.vehicle')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['report', 'vehicle'], name='fleet_report_row_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0024_geocodecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='start_address',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='end_address',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
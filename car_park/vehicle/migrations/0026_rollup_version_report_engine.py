@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicle', '0025_route_addresses'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE SEQUENCE IF NOT EXISTS vehicle_dailymileage_version_seq',
+            'DROP SEQUENCE IF EXISTS vehicle_dailymileage_version_seq',
+        ),
+        migrations.AddField(
+            model_name='vehicledailymileage',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='rollup_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='enterprisemileagereport',
+            name='engine',
+            field=models.CharField(default='rollup', max_length=10),
+        ),
+    ]
@@ -6,11 +6,11 @@ from django.core.validators import MinValueValidator
 from django.db import models
 from django.utils import timezone
 from django.contrib.gis.db import models as gis_models
-from haversine import haversine
+from django.contrib.postgres.indexes import BrinIndex, GistIndex
 
 from timezone_field import TimeZoneField
 
-from .modules.gps_math import get_period_key
+from .modules import gps_math, mileage
 
 
 # Create your models here.
@@ -179,12 +179,26 @@ class Manager(models.Model):
 
 
 class VehicleGPSPoint(gis_models.Model):
-    vehicle = models.ForeignKey('Vehicle', on_delete=models.CASCADE, related_name='gps_points')
+    # В БД таблица секционирована по месяцам поля timestamp (миграция 0017),
+    # секции обслуживает команда gps_partitions.
+    # Отдельный индекс по vehicle_id не нужен: его покрывает уникальный (vehicle, timestamp).
+    vehicle = models.ForeignKey('Vehicle', on_delete=models.CASCADE, related_name='gps_points', db_index=False)
     timestamp = models.DateTimeField(default=timezone.now)
-    location = gis_models.PointField()  # хранит точку (ш/д)
+    location = gis_models.PointField(spatial_index=False)  # хранит точку (ш/д); GiST-индекс задан в Meta
 
     class Meta:
         ordering = ['timestamp']
+        constraints = [
+            # У машины одна точка на момент времени: повторный импорт не удваивает треки.
+            # Индекс ограничения заодно покрывающий — выборки трека за интервал идут index-only scan.
+            models.UniqueConstraint(fields=['vehicle', 'timestamp'], include=['location'], name='gps_vehicle_ts_uniq'),
+        ]
+        indexes = [
+            # Дешёвый индекс по времени для append-only истории (диапазоны по всему парку)
+            BrinIndex(fields=['timestamp'], autosummarize=True, name='gps_timestamp_brin_idx'),
+            # Поиск по bbox (&&, ST_Intersects); данные дописываются, поэтому оставляем запас в страницах
+            GistIndex(fields=['location'], fillfactor=90, name='gps_location_gist_idx'),
+        ]
         verbose_name = "GPS точка автомобиля"
         verbose_name_plural = "GPS точки автомобилей"
 
@@ -192,6 +206,49 @@ class VehicleGPSPoint(gis_models.Model):
         return f"{self.vehicle} @ {self.timestamp} ({self.location})"
 
 
+class VehicleDailyMileage(models.Model):
+    """
+    Пробег машины за локальный день (таймзона предприятия), посчитанный по GPS-точкам.
+    При каждой записи точек (gps_ingest.copy_gps_points) к строкам прибавляется вклад новых точек,
+    целиком пересчитывается командой rebuild_daily_mileage. Отрезок между точками относится ко дню конечной точки.
+    """
+    vehicle = models.ForeignKey('Vehicle', on_delete=models.CASCADE, related_name='daily_mileage')
+    day = models.DateField()
+    distance_km = models.FloatField(default=0)
+    points_count = models.PositiveIntegerField(default=0)
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Номер последней записи строки из последовательности ROLLUP_VERSION_SEQUENCE (modules/mileage.py):
+    # растёт при каждом изменении, по нему report_jobs.is_fresh узнаёт устаревшие отчёты
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'day'], name='daily_mileage_vehicle_day_uniq'),
+        ]
+        verbose_name = "Суточный пробег"
+        verbose_name_plural = "Суточные пробеги"
+
+    def __str__(self):
+        return f"{self.vehicle} {self.day}: {self.distance_km:.1f} км"
+
+
+class GeocodeCache(models.Model):
+    """
+    Кэш обратного геокодирования (см. modules/geocoding.py).
+    key — округлённые координаты "lat,lon", запись действительна settings.GEOCODING_TTL_DAYS дней.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    address = models.TextField()
+    provider = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.key}: {self.address}"
+
+
 class Route(models.Model):
     vehicle = models.ForeignKey('Vehicle', on_delete=models.CASCADE, related_name='routes')
     start_time = models.DateTimeField()  # UTC
@@ -203,6 +260,11 @@ class Route(models.Model):
     start_location = gis_models.PointField( null=True, blank=True)
     end_location = gis_models.PointField(null=True, blank=True)
 
+    # Адреса точек начала/конца: заполняются в фоне после создания поездки
+    # (geocoding.fill_route_addresses), NULL — ещё не определён
+    start_address = models.TextField(null=True, blank=True)
+    end_address = models.TextField(null=True, blank=True)
+
     external_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
     def save(self, *args, **kwargs):
@@ -214,6 +276,51 @@ class Route(models.Model):
         return f"Route for {self.vehicle} ({self.start_time} - {self.end_time})"
 
 
+class ExportJob(models.Model):
+    """
+    Фоновая выгрузка данных предприятия в файл (см. modules/export_jobs.py).
+    fingerprint описывает параметры и состояние данных: одинаковый отпечаток — тот же файл.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+    FORMAT_CHOICES = [
+        ('json', 'JSON'),
+        ('ndjson', 'NDJSON'),
+        ('csv', 'CSV (zip)'),
+    ]
+
+    enterprise = models.ForeignKey(Enterprise, on_delete=models.CASCADE, related_name='export_jobs')
+    start_time = models.DateTimeField()  # UTC
+    end_time = models.DateTimeField()  # UTC
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='json')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)  # проценты
+    error = models.TextField(blank=True)
+
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    file = models.FileField(upload_to='exports/', blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Export {self.enterprise_id} [{self.start_time} - {self.end_time}] {self.format} {self.status}"
+
+
 class Report(models.Model):
     """
     Базовая модель отчёта.
@@ -235,7 +342,27 @@ class Report(models.Model):
     # Можно хранить [{"date": "...", "value": ...}, ...] или более сложную структуру
     result = models.JSONField(null=True, blank=True)
 
+    # Отчёты считаются в фоне (см. modules/report_jobs.py)
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)  # проценты
+    error = models.TextField(blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Состояние суточных итогов в диапазоне отчёта перед расчётом (report_jobs.rollup_fingerprint)
+    rollup_fingerprint = models.CharField(max_length=64, blank=True)
 
     # Если хотим привязать к пользователю-автору
     # user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -256,39 +383,99 @@ class VehicleMileageReport(Report):
     # Дополнительные поля?
     # total_mileage = models.PositiveIntegerField(default=0)
 
-    def calculate_report(self):
+    def calculate_report(self, engine=None):
         """
-        Здесь можно сделать вычисление пробега по GPS-точкам / маршрутам.
-        По итогу записать self.result = [...], self.save()
+        Пробег по GPS-точкам с разбивкой по периодам (day/month/year) в таймзоне предприятия.
+        По итогу self.result = [{"date": "2025-01-01", "mileage": 123.4}, ...] (км), сохраняет вызывающий код.
+        engine: 'rollup' (по умолчанию, сумма суточных итогов VehicleDailyMileage),
+        'sql' (по сырым точкам в PostGIS) или 'python' (NumPy по массивам трека, для сверки).
         """
-        # Логика: берем start_date, end_date, period => делаем агрегацию.
-        # Считаем, например, суммарный километраж по дням/месяцам.
-        # self.result = [{"date": "2025-01-01", "mileage": 123}, ...]
-
-        # Пример.
-        points = VehicleGPSPoint.objects.filter(
-            vehicle=self.vehicle,
-            timestamp__date__gte=self.start_date,
-            timestamp__date__lte=self.end_date
-        ).order_by('timestamp')
-        # Считаем накопительный пробег
-        total = 0.0
-        prev = None
-        daily_data = {}
-        for p in points:
-            if prev:
-                dist = haversine((prev.location.y, prev.location.x), (p.location.y, p.location.x))
-                # dist в км
-                # dayKey = p.timestamp.date() (если period='day')
-                dayKey = get_period_key(p.timestamp, self.period)  # day/month/year
-                daily_data[dayKey] = daily_data.get(dayKey, 0) + dist
-            prev = p
-        # Превращаем dict -> list
-        self.result = [{"date": k, "mileage": v} for k, v in daily_data.items()]
-        # self.save()
-
-
-
-
+        engine = engine or mileage.DEFAULT_ENGINE
+        tz = self.vehicle.enterprise.local_timezone
+        if engine == mileage.ENGINE_ROLLUP:
+            self.result = mileage.vehicle_mileage_rollup(
+                self.vehicle_id, self.start_date, self.end_date, self.period
+            )
+        elif engine == mileage.ENGINE_PYTHON:
+            # Даты отчёта — локальные дни предприятия; фильтр по моментам UTC идёт по индексу,
+            # с последней точки до начала диапазона (первый отрезок, как в остальных движках)
+            since, end_utc = mileage.track_window(self.vehicle_id, self.start_date, self.end_date, tz)
+            points = VehicleGPSPoint.objects.filter(
+                vehicle=self.vehicle,
+                timestamp__gte=since,
+                timestamp__lt=end_utc
+            ).order_by('timestamp')
+            ts, lon, lat = gps_math.load_track(points)
+            self.result = mileage.vehicle_mileage_python(ts, lon, lat, self.period, tz)
+        else:
+            self.result = mileage.vehicle_mileage_sql(
+                self.vehicle_id, self.start_date, self.end_date, self.period, tz
+            )
+
+
+class EnterpriseMileageReport(Report):
+    """
+    Пробег всего парка предприятия по периодам.
+    result — только итоги по периодам [{"date": ..., "mileage": ...}], разбивка по машинам
+    хранится строками EnterpriseMileageReportRow.
+    """
+    enterprise = models.ForeignKey('Enterprise', on_delete=models.CASCADE, related_name='mileage_reports')
+    engine = models.CharField(max_length=10, default=mileage.DEFAULT_ENGINE)
 
+    def calculate_report(self, engine=None, workers=None, on_vehicle=None):
+        """
+        Считает пробег всех машин предприятия за один проход и перезаписывает строки отчёта.
+        Отчёт должен быть уже сохранён (строки ссылаются на него).
+        engine: 'rollup' (по умолчанию) и 'sql' считаются одним INSERT ... SELECT в БД,
+        'python' — NumPy в пуле из workers процессов (только вне веб-сервера, команда fleet_mileage_report),
+        on_vehicle вызывается после каждой машины (для прогресса). Без engine — self.engine.
+        """
+        engine = engine or self.engine
+        tz = self.enterprise.local_timezone
+        self.rows.all().delete()
+        if engine == mileage.ENGINE_PYTHON:
+            vehicle_ids = list(self.enterprise.vehicles.values_list('id', flat=True))
+            rows = mileage.fleet_mileage_python(
+                vehicle_ids, self.start_date, self.end_date, self.period, tz,
+                workers=workers, on_vehicle=on_vehicle,
+            )
+            EnterpriseMileageReportRow.objects.bulk_create(
+                (EnterpriseMileageReportRow(report=self, vehicle_id=vehicle_id, period_key=key, mileage=km)
+                 for vehicle_id, key, km in rows),
+                batch_size=5000,
+            )
+        else:
+            mileage.fleet_mileage_into(
+                self.pk, self.enterprise_id, self.start_date, self.end_date, self.period, tz, engine
+            )
+
+        totals = self.rows.values('period_key').annotate(total=models.Sum('mileage')).order_by('period_key')
+        self.result = [{"date": row['period_key'], "mileage": row['total']} for row in totals]
+
+    def vehicle_table(self):
+        """
+        Компактная разбивка по машинам: ключи периодов один раз и значения по машинам в том же порядке.
+        {"periods": [...], "vehicles": [{"vehicle_id": 1, "mileage": [...]}, ...]}
+        """
+        periods = [row["date"] for row in self.result or []]
+        position = {key: i for i, key in enumerate(periods)}
+        table = {}
+        for vehicle_id, key, km in self.rows.order_by('vehicle_id').values_list('vehicle_id', 'period_key', 'mileage'):
+            table.setdefault(vehicle_id, [0.0] * len(periods))[position[key]] = km
+        return {
+            "periods": periods,
+            "vehicles": [{"vehicle_id": vehicle_id, "mileage": values} for vehicle_id, values in table.items()],
+        }
+
+
+class EnterpriseMileageReportRow(models.Model):
+    """Пробег одной машины за один период в отчёте по парку."""
+    report = models.ForeignKey(EnterpriseMileageReport, on_delete=models.CASCADE, related_name='rows')
+    vehicle = models.ForeignKey('Vehicle', on_delete=models.CASCADE, related_name='+')
+    period_key = models.CharField(max_length=10)
+    mileage = models.FloatField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['report', 'vehicle'], name='fleet_report_row_idx'),
+        ]
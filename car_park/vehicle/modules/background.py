@@ -0,0 +1,41 @@
+"""
+Фоновое выполнение долгих задач внутри процесса веб-сервера, без внешних брокеров.
+Сами задачи хранятся в БД (статус pending/running/...), поэтому после перезапуска
+их подхватывает команда run_pending_jobs.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'BACKGROUND_WORKERS', 2),
+            thread_name_prefix='car-park-bg',
+        )
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Фоновая задача %s упала", getattr(fn, '__name__', fn))
+        raise
+    finally:
+        # У каждого потока своё соединение — закрываем, чтобы не копить их в пуле
+        connections.close_all()
+
+
+def submit(fn, *args, **kwargs):
+    """Запускает fn в фоне сразу после коммита текущей транзакции (строка задачи уже видна)."""
+    transaction.on_commit(lambda: _get_executor().submit(_run, fn, args, kwargs))
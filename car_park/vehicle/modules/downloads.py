@@ -0,0 +1,76 @@
+import os
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_file_range(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            data = fh.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _parse_range(header, size):
+    """
+    Разбирает один диапазон "bytes=a-b" / "bytes=a-" / "bytes=-n".
+    Возвращает (start, end) включительно, None — заголовок не поддерживается
+    (например, несколько диапазонов: отдадим файл целиком), False — диапазон вне файла.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            return False
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+def ranged_file_response(request, path, content_type, filename, etag=None):
+    """
+    Отдаёт файл с поддержкой докачки (Range / If-Range, один диапазон).
+    """
+    size = os.path.getsize(path)
+    quoted_etag = f'"{etag}"' if etag else None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and if_range and if_range != quoted_etag:
+        range_header = None  # файл поменялся — докачка невозможна, отдаём целиком
+
+    byte_range = _parse_range(range_header, size) if range_header else None
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range is None:
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename,
+                                content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_file_range(path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    response['Accept-Ranges'] = 'bytes'
+    if quoted_etag:
+        response['ETag'] = quoted_etag
+    return response
@@ -0,0 +1,261 @@
+"""
+Потоковый экспорт данных предприятия.
+Все генераторы отдают bytes и держат в памяти только текущий кусок:
+машины, поездки и точки читаются серверными курсорами, упорядоченными по машине.
+"""
+import csv
+import io
+import json
+import zipfile
+
+from ..models import Vehicle, Route
+from . import streaming
+
+EXPORT_POINTS_SQL = """
+    SELECT r.id, r.external_id, p."timestamp", ST_X(p.location), ST_Y(p.location), r.vehicle_id
+    FROM vehicle_route r
+    JOIN vehicle_vehicle v ON v.id = r.vehicle_id
+    JOIN vehicle_vehiclegpspoint p
+      ON p.vehicle_id = r.vehicle_id
+     AND p."timestamp" >= r.start_time
+     AND p."timestamp" <= r.end_time
+    WHERE v.enterprise_id = %s
+      AND r.start_time >= %s
+      AND r.end_time <= %s
+      AND p."timestamp" >= %s
+      AND p."timestamp" <= %s
+    ORDER BY r.vehicle_id, r.start_time, r.id, p."timestamp"
+"""
+
+
+class _Peekable:
+    def __init__(self, iterable):
+        self._it = iter(iterable)
+        self._head = next(self._it, None)
+
+    def peek(self):
+        return self._head
+
+    def take_while(self, key_index, key):
+        """Отдаёт подряд идущие строки, у которых row[key_index] == key."""
+        while self._head is not None and self._head[key_index] == key:
+            row, self._head = self._head, next(self._it, None)
+            yield row
+
+
+def _vehicles(enterprise):
+    return Vehicle.objects.filter(enterprise=enterprise).order_by('id').values_list(
+        'id', 'external_id', 'vin', 'price', 'release_year', 'mileage'
+    ).iterator(chunk_size=streaming.FETCH_SIZE)
+
+
+def _routes(enterprise, start_utc, end_utc):
+    return Route.objects.filter(
+        vehicle__enterprise=enterprise,
+        start_time__gte=start_utc,
+        end_time__lte=end_utc,
+    ).order_by('vehicle_id', 'start_time', 'id').values_list(
+        'vehicle_id', 'id', 'external_id', 'start_time', 'end_time', 'duration'
+    ).iterator(chunk_size=streaming.FETCH_SIZE)
+
+
+def _points(enterprise, start_utc, end_utc):
+    return streaming.iter_rows(EXPORT_POINTS_SQL, [enterprise.id, start_utc, end_utc, start_utc, end_utc])
+
+
+def iter_export_tree(enterprise, start_utc, end_utc):
+    """
+    Дерево экспорта без материализации: (vehicle_row, routes), где routes отдаёт (route_row, points).
+    Вложенные итераторы нужно дочитывать по порядку — они делят общие курсоры.
+    """
+    routes = _Peekable(_routes(enterprise, start_utc, end_utc))
+    points = _Peekable(_points(enterprise, start_utc, end_utc))
+
+    def vehicle_routes(vehicle_id):
+        for route in routes.take_while(0, vehicle_id):
+            yield route, points.take_while(0, route[1])
+
+    for vehicle in _vehicles(enterprise):
+        yield vehicle, vehicle_routes(vehicle[0])
+
+
+def _enterprise_dict(enterprise):
+    return {
+        "external_id": str(enterprise.external_id),
+        "name": enterprise.name,
+        "city": enterprise.city,
+        "local_timezone": str(enterprise.local_timezone),
+    }
+
+
+def _vehicle_dict(vehicle):
+    _, external_id, vin, price, release_year, mileage = vehicle
+    return {
+        "external_id": str(external_id),
+        "vin": vin,
+        "price": str(price),
+        "release_year": release_year,
+        "mileage": mileage,
+    }
+
+
+def _route_dict(route):
+    _, _, external_id, start_time, end_time, duration = route
+    return {
+        "external_id": str(external_id),
+        "start_time": start_time.isoformat(),
+        "end_time": end_time.isoformat(),
+        "duration": str(duration),
+    }
+
+
+def _iter_json(enterprise, start_utc, end_utc, on_vehicle=None):
+    """Та же структура, что и раньше отдавал _export_json, но записанная по кускам."""
+    dumps = json.dumps
+    yield '{"enterprise":' + dumps(_enterprise_dict(enterprise)) + ',"vehicles":['
+    for v_index, (vehicle, routes) in enumerate(iter_export_tree(enterprise, start_utc, end_utc)):
+        # Открываем объект машины и дописываем в него "routes"
+        yield ('' if v_index == 0 else ',') + dumps(_vehicle_dict(vehicle))[:-1] + ',"routes":['
+        for r_index, (route, points) in enumerate(routes):
+            yield ('' if r_index == 0 else ',') + dumps(_route_dict(route))[:-1] + ',"gps_points":['
+            for p_index, (_, _, ts, lon, lat, _) in enumerate(points):
+                yield (f'{"" if p_index == 0 else ","}'
+                       f'{{"timestamp":"{ts.isoformat()}","location":[{lon!r},{lat!r}]}}')
+            yield ']}'
+        yield ']}'
+        if on_vehicle:
+            on_vehicle()
+    yield ']}'
+
+
+def _iter_ndjson(enterprise, start_utc, end_utc, on_vehicle=None):
+    """
+    Одна запись на строку, вложенность передаётся ссылками на external_id:
+    {"type": "enterprise"...}, {"type": "vehicle"...}, {"type": "route"...}, {"type": "gps_point"...}
+    """
+    dumps = json.dumps
+    yield dumps({"type": "enterprise", **_enterprise_dict(enterprise)}) + '\n'
+    for vehicle, routes in iter_export_tree(enterprise, start_utc, end_utc):
+        vehicle_dict = _vehicle_dict(vehicle)
+        yield dumps({"type": "vehicle", **vehicle_dict}) + '\n'
+        for route, points in routes:
+            route_dict = _route_dict(route)
+            yield dumps({"type": "route", "vehicle_external_id": vehicle_dict["external_id"], **route_dict}) + '\n'
+            prefix = f'{{"type":"gps_point","route_external_id":"{route_dict["external_id"]}",'
+            for _, _, ts, lon, lat, _ in points:
+                yield f'{prefix}"timestamp":"{ts.isoformat()}","location":[{lon!r},{lat!r}]}}\n'
+        if on_vehicle:
+            on_vehicle()
+
+
+# on_vehicle — необязательный колбэк, вызывается по мере обработки машин (для прогресса фоновых выгрузок)
+
+def iter_export_json(enterprise, start_utc, end_utc, on_vehicle=None):
+    return streaming.buffered(_iter_json(enterprise, start_utc, end_utc, on_vehicle))
+
+
+def iter_export_ndjson(enterprise, start_utc, end_utc, on_vehicle=None):
+    return streaming.buffered(_iter_ndjson(enterprise, start_utc, end_utc, on_vehicle))
+
+
+class _ZipSink(io.RawIOBase):
+    """
+    Неперематываемый приёмник для zipfile: копит записанные байты до следующего drain().
+    zipfile сам переходит в режим data descriptor, когда поток не поддерживает seek/tell.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.pending += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def _write_csv_member(zf, sink, name, header, rows):
+    with zf.open(name, 'w', force_zip64=True) as member:
+        text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            if sink.pending >= streaming.FLUSH_SIZE:
+                yield sink.drain()
+        text.flush()
+        text.detach()
+    if sink.pending:
+        yield sink.drain()
+
+
+def iter_export_csv_zip(enterprise, start_utc, end_utc, on_vehicle=None):
+    """
+    Zip с enterprise.csv, vehicles.csv, routes.csv, gps_points.csv (формат прежний),
+    собираемый на лету: каждый файл пишется отдельным проходом своего курсора.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        yield from _write_csv_member(
+            zf, sink, "enterprise.csv",
+            ["external_id", "name", "city", "local_timezone"],
+            [[str(enterprise.external_id), enterprise.name, enterprise.city, enterprise.local_timezone]],
+        )
+
+        yield from _write_csv_member(
+            zf, sink, "vehicles.csv",
+            ["vehicle_external_id", "vin", "price", "release_year", "mileage"],
+            ([str(external_id), vin, str(price), release_year, mileage]
+             for _, external_id, vin, price, release_year, mileage in _vehicles(enterprise)),
+        )
+
+        routes = Route.objects.filter(
+            vehicle__enterprise=enterprise,
+            start_time__gte=start_utc,
+            end_time__lte=end_utc,
+        ).order_by('vehicle_id', 'start_time', 'id').values_list(
+            'external_id', 'vehicle__external_id', 'start_time', 'end_time', 'duration'
+        ).iterator(chunk_size=streaming.FETCH_SIZE)
+
+        yield from _write_csv_member(
+            zf, sink, "routes.csv",
+            ["route_external_id", "vehicle_external_id", "start_time", "end_time", "duration"],
+            ([str(external_id), str(vehicle_ext_id), start_time.isoformat(), end_time.isoformat(), str(duration)]
+             for external_id, vehicle_ext_id, start_time, end_time, duration in routes),
+        )
+
+        def point_rows():
+            # Самая длинная часть — точки; прогресс считаем по смене машины в отсортированном потоке
+            current_vehicle = None
+            for _, route_ext_id, ts, lon, lat, vehicle_id in _points(enterprise, start_utc, end_utc):
+                if vehicle_id != current_vehicle:
+                    if current_vehicle is not None and on_vehicle:
+                        on_vehicle()
+                    current_vehicle = vehicle_id
+                yield [str(route_ext_id), ts.isoformat(), lon, lat]
+
+        yield from _write_csv_member(
+            zf, sink, "gps_points.csv",
+            ["route_external_id", "timestamp", "lon", "lat"],
+            point_rows(),
+        )
+    # Центральный каталог архива
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    # format: (генератор, content_type, имя файла)
+    'json': (iter_export_json, 'application/json', 'export.json'),
+    'ndjson': (iter_export_ndjson, 'application/x-ndjson', 'export.ndjson'),
+    'csv': (iter_export_csv_zip, 'application/zip', 'enterprise_export.zip'),
+}
@@ -0,0 +1,443 @@
+"""
+Пакетный импорт данных предприятия (формат как у экспорта).
+Все upsert'ы идут пачками по external_id, точки — через COPY; транзакцией управляет вызывающий код.
+"""
+import csv
+import io
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.db import connection
+from django.utils.dateparse import parse_duration
+
+from ..models import Enterprise, Vehicle, Route
+from . import gps_ingest
+
+DEFAULT_CHUNK_SIZE = 5000
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 100000
+
+# В выгрузке у поездок нет координат начала/конца — берём их из первой и последней точки поездки
+ROUTE_ENDPOINTS_SQL = """
+    UPDATE vehicle_route r
+    SET start_location = COALESCE(r.start_location, (
+            SELECT p.location FROM vehicle_vehiclegpspoint p
+            WHERE p.vehicle_id = r.vehicle_id AND p."timestamp" >= r.start_time AND p."timestamp" <= r.end_time
+            ORDER BY p."timestamp" LIMIT 1)),
+        end_location = COALESCE(r.end_location, (
+            SELECT p.location FROM vehicle_vehiclegpspoint p
+            WHERE p.vehicle_id = r.vehicle_id AND p."timestamp" >= r.start_time AND p."timestamp" <= r.end_time
+            ORDER BY p."timestamp" DESC LIMIT 1))
+    WHERE r.id = ANY(%s)
+      AND (r.start_location IS NULL OR r.end_location IS NULL)
+"""
+
+VEHICLE_FIELDS = ['vin', 'price', 'release_year', 'mileage', 'enterprise']
+ROUTE_FIELDS = ['vehicle', 'start_time', 'end_time', 'duration']
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ImportValidationError(ValueError):
+    """Данные импорта не прошли проверку — в БД ничего не записано."""
+
+
+def parse_datetime(dt_str):
+    """Функция для преобразования строки в datetime (без зоны считаем UTC)"""
+    if not dt_str:
+        return None
+    value = datetime.fromisoformat(dt_str)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def parse_external_id(value, what) -> str:
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise ImportValidationError(f"Invalid {what} external_id: {value!r}")
+
+
+class StageTimer:
+    """Замеряет время этапов импорта, для отчёта в ответе API."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(self.timings.get(name, 0) + time.perf_counter() - started, 3)
+
+
+def validate_json_payload(data) -> dict:
+    """
+    Разбирает JSON в формате экспорта в плоские списки для пакетной записи:
+    {"enterprise": {...}, "vehicles": [...], "routes": [...], "points": [(vehicle_ext_id, ts, lon, lat)],
+     "skipped": {...}}.
+    Ошибки структуры — ImportValidationError; записи без external_id и точки без координат
+    пропускаются (как и раньше) и считаются в skipped.
+    """
+    if not isinstance(data, dict):
+        raise ImportValidationError("Expected JSON object")
+    enterprise_data = data.get("enterprise")
+    if not enterprise_data:
+        raise ImportValidationError("No 'enterprise' key found in JSON")
+    if not enterprise_data.get("external_id"):
+        raise ImportValidationError("Missing enterprise.external_id")
+
+    enterprise = {
+        "external_id": parse_external_id(enterprise_data["external_id"], "enterprise"),
+        "name": enterprise_data.get("name", "NoName"),
+        "city": enterprise_data.get("city", "NoCity"),
+        "local_timezone": enterprise_data.get("local_timezone", "UTC"),
+    }
+    vehicles, routes, points = [], [], []
+    skipped = {"vehicles": 0, "routes": 0, "gps_points": 0}
+
+    for vdict in data.get("vehicles", []):
+        if not vdict.get("external_id"):
+            skipped["vehicles"] += 1
+            continue
+        vehicle_ext_id = parse_external_id(vdict["external_id"], "vehicle")
+        vehicles.append({
+            "external_id": vehicle_ext_id,
+            "vin": vdict.get("vin", ""),
+            "price": vdict.get("price", "0"),
+            "release_year": vdict.get("release_year", 2000),
+            "mileage": vdict.get("mileage", 0),
+        })
+
+        for rdict in vdict.get("routes", []):
+            if not rdict.get("external_id"):
+                skipped["routes"] += 1
+                continue
+            try:
+                start_time = parse_datetime(rdict.get("start_time"))
+                end_time = parse_datetime(rdict.get("end_time"))
+            except ValueError:
+                raise ImportValidationError(f"Invalid route time: {rdict.get('external_id')}")
+            routes.append({
+                "external_id": parse_external_id(rdict["external_id"], "route"),
+                "vehicle_external_id": vehicle_ext_id,
+                "start_time": start_time,
+                "end_time": end_time,
+            })
+
+            for gpd in rdict.get("gps_points", []):
+                coords = gpd.get("location")  # [lon, lat]
+                if not coords or len(coords) != 2:
+                    skipped["gps_points"] += 1
+                    continue
+                try:
+                    _, ts, lon, lat = gps_ingest.make_row(0, gpd.get("timestamp"), coords[0], coords[1])
+                except gps_ingest.IngestError:
+                    skipped["gps_points"] += 1
+                    continue
+                points.append((vehicle_ext_id, ts, lon, lat))
+
+    return {"enterprise": enterprise, "vehicles": vehicles, "routes": routes, "points": points,
+            "skipped": skipped}
+
+
+def iter_csv_member(zf, name, columns):
+    """
+    Читает CSV-файл из zip построчно (распаковка идёт потоком, файл целиком в память не попадает).
+    Заголовок пропускается, строки с другим числом колонок, битый CSV и не-UTF-8 — ImportValidationError.
+    """
+    try:
+        member = zf.open(name)
+    except KeyError:
+        raise ImportValidationError(f"{name} not found in zip")
+    with member, io.TextIOWrapper(member, encoding='utf-8', newline='') as text:
+        reader = csv.reader(text)
+        try:
+            next(reader, None)
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != columns:
+                    raise ImportValidationError(f"{name}, line {reader.line_num}: expected {columns} columns")
+                yield row
+        except csv.Error as e:
+            raise ImportValidationError(f"{name}, line {reader.line_num}: {e}")
+        except UnicodeDecodeError:
+            raise ImportValidationError(f"{name}: file is not valid UTF-8")
+
+
+class _ExternalIdMap:
+    """
+    external_id -> значение для записей, созданных в этом импорте;
+    неизвестные id (объекты из прошлых импортов) дочитываются из БД одним запросом на пачку.
+    """
+
+    def __init__(self, queryset, value_fields):
+        self.known = {}
+        self._queryset = queryset
+        self._value_fields = value_fields
+
+    def resolve(self, external_ids):
+        missing = {ext_id for ext_id in external_ids if ext_id not in self.known}
+        if missing:
+            for ext_id, *values in self._queryset.filter(external_id__in=missing).values_list(
+                'external_id', *self._value_fields
+            ):
+                self.known[str(ext_id)] = values[0] if len(values) == 1 else tuple(values)
+            for ext_id in missing:
+                self.known.setdefault(ext_id, None)
+        return self.known
+
+
+def import_csv_zip(manager, zf, chunk_size=DEFAULT_CHUNK_SIZE, timer=None) -> dict:
+    """
+    Импорт zip из экспорта (enterprise.csv, vehicles.csv, routes.csv, gps_points.csv).
+    Каждый файл читается потоком и пишется пачками по chunk_size; в памяти — только карты
+    external_id -> id для машин и поездок. Вызывать внутри transaction.atomic().
+    """
+    timer = timer or StageTimer()
+
+    with timer.stage("enterprise"):
+        # external_id, name, city, local_timezone
+        row = next(iter_csv_member(zf, 'enterprise.csv', 4), None)
+        if row is None:
+            raise ImportValidationError("No enterprise data in csv")
+        ent_external_id, ent_name, ent_city, ent_tz = row
+        enterprise = upsert_enterprise(parse_external_id(ent_external_id, "enterprise"), ent_name, ent_city, ent_tz)
+        manager.enterprises.add(enterprise)
+
+    with timer.stage("vehicles"):
+        # vehicle_external_id, vin, price, release_year, mileage
+        vehicles = _ExternalIdMap(Vehicle.objects.all(), ['id'])
+        imported_vehicles = upsert_vehicles(enterprise, (
+            {
+                "external_id": parse_external_id(vehicle_external_id, "vehicle"),
+                "vin": vin,
+                "price": price,
+                "release_year": release_year,
+                "mileage": mileage,
+            }
+            for vehicle_external_id, vin, price, release_year, mileage
+            in iter_csv_member(zf, 'vehicles.csv', 5)
+        ), chunk_size)
+        vehicles.known.update(imported_vehicles)
+
+    with timer.stage("routes"):
+        # route_external_id, vehicle_external_id, start_time, end_time, duration
+        routes = _ExternalIdMap(Route.objects.all(), ['vehicle_id'])
+        route_count = 0
+        route_ids = []
+        for chunk in chunked(iter_csv_member(zf, 'routes.csv', 5), chunk_size):
+            vehicle_ids = vehicles.resolve({parse_external_id(row[1], "vehicle") for row in chunk})
+            rows = []
+            for route_external_id, veh_external_id, stime, etime, dur in chunk:
+                vehicle_id = vehicle_ids[parse_external_id(veh_external_id, "vehicle")]
+                if vehicle_id is None:
+                    raise ImportValidationError(f"No vehicle data for route: {route_external_id}")
+                try:
+                    rows.append({
+                        "external_id": parse_external_id(route_external_id, "route"),
+                        "vehicle_id": vehicle_id,
+                        "start_time": parse_datetime(stime),
+                        "end_time": parse_datetime(etime),
+                        "duration": parse_duration(dur) if dur else None,
+                    })
+                except ValueError:
+                    raise ImportValidationError(f"Invalid route time: {route_external_id}")
+            for ext_id, (route_id, vehicle_id) in upsert_routes(rows, chunk_size).items():
+                routes.known[ext_id] = vehicle_id
+                route_ids.append(route_id)
+            route_count += len(rows)
+
+    with timer.stage("gps_points"):
+        # route_external_id, timestamp, lon, lat
+        skipped = 0
+
+        def point_rows():
+            nonlocal skipped
+            for chunk in chunked(iter_csv_member(zf, 'gps_points.csv', 4), chunk_size):
+                ext_ids = {raw: parse_external_id(raw, "route") for raw in {row[0] for row in chunk}}
+                route_vehicles = routes.resolve(ext_ids.values())
+                for route_external_id, ts, lon, lat in chunk:
+                    vehicle_id = route_vehicles[ext_ids[route_external_id]]
+                    if vehicle_id is None:
+                        skipped += 1  # как и раньше, точки неизвестных поездок пропускаем
+                        continue
+                    try:
+                        yield gps_ingest.make_row(vehicle_id, ts, lon, lat)
+                    except gps_ingest.IngestError:
+                        skipped += 1
+
+        points = copy_points(point_rows(), chunk_size)
+
+    with timer.stage("route_endpoints"):
+        finish_routes(route_ids, chunk_size)
+
+    return {
+        "imported": {
+            "enterprise": str(enterprise.external_id),
+            "vehicles": len(imported_vehicles),
+            "routes": route_count,
+            "gps_points": points,
+        },
+        "skipped": {"gps_points": skipped},
+    }
+
+
+def import_payload(manager, payload, chunk_size=DEFAULT_CHUNK_SIZE, timer=None) -> dict:
+    """
+    Записывает проверенные данные (см. validate_json_payload) пакетами.
+    Вызывать внутри transaction.atomic(). Возвращает количество записанных объектов.
+    """
+    timer = timer or StageTimer()
+
+    with timer.stage("enterprise"):
+        enterprise = upsert_enterprise(**payload["enterprise"])
+        manager.enterprises.add(enterprise)
+
+    with timer.stage("vehicles"):
+        vehicle_ids = upsert_vehicles(enterprise, payload["vehicles"], chunk_size)
+
+    with timer.stage("routes"):
+        route_ids = [route_id for route_id, _ in upsert_routes(
+            ({**route, "vehicle_id": vehicle_ids[route["vehicle_external_id"]]} for route in payload["routes"]),
+            chunk_size,
+        ).values()]
+
+    with timer.stage("gps_points"):
+        points = copy_points(
+            ((vehicle_ids[vehicle_ext_id], ts, lon, lat) for vehicle_ext_id, ts, lon, lat in payload["points"]),
+            chunk_size,
+        )
+
+    with timer.stage("route_endpoints"):
+        finish_routes(route_ids, chunk_size)
+
+    return {
+        "enterprise": str(enterprise.external_id),
+        "vehicles": len(vehicle_ids),
+        "routes": len(payload["routes"]),
+        "gps_points": points,
+    }
+
+
+def upsert_enterprise(external_id, name, city, local_timezone) -> Enterprise:
+    obj = Enterprise(external_id=external_id, name=name, city=city, local_timezone=local_timezone)
+    Enterprise.objects.bulk_create(
+        [obj],
+        update_conflicts=True,
+        unique_fields=['external_id'],
+        update_fields=['name', 'city', 'local_timezone'],
+    )
+    return obj
+
+
+def _last_by_external_id(chunk):
+    """
+    Повторы external_id внутри пачки схлопываются, побеждает последняя строка (как при записи по очереди):
+    bulk_create создал бы дубликаты, а ON CONFLICT DO UPDATE не может дважды обновить одну строку.
+    """
+    return list({str(row['external_id']): row for row in chunk}.values())
+
+
+def upsert_vehicles(enterprise, rows, chunk_size=DEFAULT_CHUNK_SIZE) -> dict[str, int]:
+    """
+    rows: dict(external_id, vin, price, release_year, mileage).
+    Возвращает {external_id: id}.
+    Существующие машины обновляются bulk_update'ом, новые создаются bulk_create'ом:
+    ON CONFLICT здесь не подходит — в выгрузке нет обязательных полей (комплектация),
+    а PostgreSQL проверяет NOT NULL до разрешения конфликта.
+    """
+    ids = {}
+    for chunk in chunked(rows, chunk_size):
+        chunk = _last_by_external_id(chunk)
+        existing = {
+            str(ext_id): pk
+            for ext_id, pk in Vehicle.objects.filter(
+                external_id__in=[row['external_id'] for row in chunk]
+            ).values_list('external_id', 'id')
+        }
+        to_update, to_create = [], []
+        for row in chunk:
+            obj = Vehicle(
+                external_id=row['external_id'],
+                vin=row['vin'],
+                price=row['price'],
+                release_year=row['release_year'],
+                mileage=row['mileage'],
+                enterprise=enterprise,
+            )
+            pk = existing.get(str(row['external_id']))
+            if pk is not None:
+                obj.pk = pk
+                to_update.append(obj)
+            else:
+                to_create.append(obj)
+        if to_update:
+            Vehicle.objects.bulk_update(to_update, VEHICLE_FIELDS)
+        if to_create:
+            Vehicle.objects.bulk_create(to_create)
+        for obj in to_update + to_create:
+            ids[str(obj.external_id)] = obj.pk
+    return ids
+
+
+def upsert_routes(rows, chunk_size=DEFAULT_CHUNK_SIZE) -> dict[str, tuple[int, int]]:
+    """
+    rows: dict(external_id, vehicle_id, start_time, end_time[, duration]).
+    Возвращает {external_id: (route_id, vehicle_id)}.
+    """
+    ids = {}
+    for chunk in chunked(rows, chunk_size):
+        chunk = _last_by_external_id(chunk)
+        objs = []
+        for row in chunk:
+            duration = row.get('duration')
+            if duration is None and row['start_time'] and row['end_time']:
+                # bulk_create не вызывает Route.save(), считаем длительность сами
+                duration = row['end_time'] - row['start_time']
+            objs.append(Route(
+                external_id=row['external_id'],
+                vehicle_id=row['vehicle_id'],
+                start_time=row['start_time'],
+                end_time=row['end_time'],
+                duration=duration,
+            ))
+        Route.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=['external_id'],
+            update_fields=ROUTE_FIELDS,
+        )
+        for obj in objs:
+            ids[str(obj.external_id)] = (obj.pk, obj.vehicle_id)
+    return ids
+
+
+def copy_points(rows, chunk_size=DEFAULT_CHUNK_SIZE) -> int:
+    """rows: (vehicle_id, timestamp, lon, lat)."""
+    return gps_ingest.copy_gps_points(rows, chunk_size=chunk_size)
+
+
+def finish_routes(route_ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    После записи точек: координаты начала/конца импортированных поездок из их точек.
+    Адреса при импорте не определяются: тысячи запросов к провайдеру заняли бы общую фоновую очередь
+    (background) и пропали бы при перезапуске. Их заполняет команда backfill_route_addresses.
+    """
+    with connection.cursor() as cursor:
+        for chunk in chunked(route_ids, chunk_size):
+            cursor.execute(ROUTE_ENDPOINTS_SQL, [chunk])
@@ -0,0 +1,114 @@
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from ..models import ExportJob, Vehicle, Route, VehicleGPSPoint
+from . import background, enterprise_export
+
+EXTENSIONS = {'json': 'json', 'ndjson': 'ndjson', 'csv': 'zip'}
+PROGRESS_STEP = 1  # процентов между записями прогресса в БД
+
+
+def data_fingerprint(enterprise, start_utc, end_utc, out_format) -> str:
+    """
+    Отпечаток параметров выгрузки и состояния данных в окне:
+    новые/удалённые машины, поездки и точки меняют количество или максимальный id.
+    """
+    vehicles = Vehicle.objects.filter(enterprise=enterprise).aggregate(n=Count('id'), last=Max('id'))
+    routes = Route.objects.filter(
+        vehicle__enterprise=enterprise, start_time__gte=start_utc, end_time__lte=end_utc
+    ).aggregate(n=Count('id'), last=Max('id'))
+    points = VehicleGPSPoint.objects.filter(
+        vehicle__enterprise=enterprise, timestamp__gte=start_utc, timestamp__lte=end_utc
+    ).aggregate(n=Count('id'), last=Max('id'))
+    raw = '|'.join(str(part) for part in (
+        enterprise.pk, enterprise.name, enterprise.city, enterprise.local_timezone,
+        start_utc.isoformat(), end_utc.isoformat(), out_format,
+        vehicles['n'], vehicles['last'], routes['n'], routes['last'], points['n'], points['last'],
+    ))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def find_or_create_job(enterprise, start_utc, end_utc, out_format) -> tuple[ExportJob, bool]:
+    """
+    Возвращает (job, created). Готовый файл или уже идущая выгрузка с тем же отпечатком
+    переиспользуются; иначе создаётся новая задача и ставится в фоновую очередь.
+    """
+    fingerprint = data_fingerprint(enterprise, start_utc, end_utc, out_format)
+    for job in ExportJob.objects.filter(
+        fingerprint=fingerprint, status__in=[ExportJob.PENDING, ExportJob.RUNNING, ExportJob.DONE]
+    ):
+        if job.status != ExportJob.DONE or (job.file and default_storage.exists(job.file.name)):
+            return job, False
+
+    job = ExportJob.objects.create(
+        enterprise=enterprise,
+        start_time=start_utc,
+        end_time=end_utc,
+        format=out_format,
+        fingerprint=fingerprint,
+    )
+    background.submit(run_export_job, job.pk)
+    return job, True
+
+
+def _set_progress(job_id, progress):
+    ExportJob.objects.filter(pk=job_id).update(progress=progress, updated_at=timezone.now())
+
+
+def run_export_job(job_id):
+    """
+    Выполняет задачу, если её ещё никто не забрал: файл пишется кусками во временный *.part
+    и переименовывается только по завершении, поэтому по ссылке никогда не отдаётся недописанный файл.
+    """
+    claimed = ExportJob.objects.filter(pk=job_id, status=ExportJob.PENDING).update(
+        status=ExportJob.RUNNING, progress=0, updated_at=timezone.now()
+    )
+    if not claimed:
+        return
+    job = ExportJob.objects.select_related('enterprise').get(pk=job_id)
+
+    name = f"exports/{job.enterprise_id}_{job.pk}_{job.fingerprint[:12]}.{EXTENSIONS[job.format]}"
+    path = default_storage.path(name)
+    tmp_path = path + '.part'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    total = Vehicle.objects.filter(enterprise=job.enterprise).count() or 1
+    state = {'done': 0, 'reported': 0}
+
+    def on_vehicle():
+        state['done'] += 1
+        progress = min(99, state['done'] * 100 // total)
+        if progress - state['reported'] >= PROGRESS_STEP:
+            state['reported'] = progress
+            _set_progress(job_id, progress)
+
+    generator, _, _ = enterprise_export.EXPORT_FORMATS[job.format]
+    try:
+        with open(tmp_path, 'wb') as fh:
+            for chunk in generator(job.enterprise, job.start_time, job.end_time, on_vehicle=on_vehicle):
+                fh.write(chunk)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.FAILED, error=str(e), updated_at=timezone.now(), finished_at=timezone.now()
+        )
+        raise
+
+    now = timezone.now()
+    ExportJob.objects.filter(pk=job_id).update(
+        status=ExportJob.DONE, progress=100, file=name, size=os.path.getsize(path),
+        updated_at=now, finished_at=now,
+    )
+
+
+def requeue_stale_jobs(older_than) -> int:
+    """Возвращает в очередь задачи, «зависшие» в running (процесс, который их выполнял, умер)."""
+    return ExportJob.objects.filter(status=ExportJob.RUNNING, updated_at__lt=older_than).update(
+        status=ExportJob.PENDING, updated_at=timezone.now()
+    )
@@ -0,0 +1,248 @@
+"""
+Обратное геокодирование с кэшем: LRU в памяти процесса -> таблица GeocodeCache -> провайдер.
+Ключ — координаты, округлённые до settings.GEOCODING_PRECISION знаков
+(4 знака ≈ 11 м: точки одной стоянки получают один адрес и один запрос к провайдеру).
+Провайдер задаётся в settings.GEOCODER путём к классу с методом reverse(lat, lon) -> str | None.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from ..models import GeocodeCache, Route
+from . import background
+from .ors import reverse_geocode_ors, KEY
+
+DEFAULT_GEOCODER = 'vehicle.modules.geocoding.ORSGeocoder'
+DEFAULT_PRECISION = 4
+DEFAULT_TTL_DAYS = 180
+DEFAULT_LRU_SIZE = 4096
+DEFAULT_WORKERS = 8
+ROUTE_BATCH_SIZE = 500  # поездок в одной фоновой задаче заполнения адресов
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду (равномерно), общий для всех потоков процесса."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None) -> bool:
+        """Ждёт своей очереди; False, если очередь наступит позже deadline (time.monotonic())."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if deadline is not None and slot > deadline:
+                return False
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+
+class ORSGeocoder:
+    name = 'ors'
+    # Лимит бесплатного тарифа ORS на reverse geocoding — 100 запросов в минуту
+    rate_limit = 1.6
+
+    def __init__(self):
+        self.api_key = getattr(settings, 'ORS_API_KEY', None) or KEY
+        self.session = requests.Session()
+        pool = getattr(settings, 'GEOCODING_WORKERS', DEFAULT_WORKERS)
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool))
+
+    def reverse(self, lat, lon):
+        return reverse_geocode_ors(self.api_key, lat, lon, session=self.session)
+
+
+class StubGeocoder:
+    """Без сети: адрес — сами координаты. Для тестов и локальной разработки."""
+    name = 'stub'
+    rate_limit = None
+
+    def reverse(self, lat, lon):
+        return f"{lat:.5f}, {lon:.5f}"
+
+
+class _LRU:
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_lru = _LRU(getattr(settings, 'GEOCODING_LRU_SIZE', DEFAULT_LRU_SIZE))
+_geocoder = None
+_limiter = None
+_init_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder, _limiter
+    if _geocoder is None:
+        # Первыми вызывают потоки reverse_geocode_many одновременно: провайдер и RateLimiter
+        # должны быть одни на процесс, иначе лимит запросов делится между копиями
+        with _init_lock:
+            if _geocoder is None:
+                geocoder = import_string(getattr(settings, 'GEOCODER', DEFAULT_GEOCODER))()
+                rate = getattr(settings, 'GEOCODING_RATE_LIMIT', None) or getattr(geocoder, 'rate_limit', None)
+                _limiter = RateLimiter(rate) if rate else None
+                _geocoder = geocoder
+    return _geocoder
+
+
+def _limited_reverse(lat, lon, deadline=None):
+    geocoder = get_geocoder()
+    if _limiter is not None and not _limiter.acquire(deadline):
+        return None
+    return geocoder.reverse(lat, lon)
+
+
+def cache_key(lat, lon, precision=None) -> str:
+    precision = getattr(settings, 'GEOCODING_PRECISION', DEFAULT_PRECISION) if precision is None else precision
+    return f"{round(float(lat), precision):.{precision}f},{round(float(lon), precision):.{precision}f}"
+
+
+def _fresh_after():
+    return timezone.now() - timedelta(days=getattr(settings, 'GEOCODING_TTL_DAYS', DEFAULT_TTL_DAYS))
+
+
+def cached_addresses(keys) -> dict:
+    """Адреса из LRU и таблицы кэша (не старше TTL) для набора ключей; промахи не возвращаются."""
+    found, missing = {}, []
+    for key in keys:
+        address = _lru.get(key)
+        if address is not None:
+            found[key] = address
+        else:
+            missing.append(key)
+    if missing:
+        for key, address in GeocodeCache.objects.filter(
+            key__in=missing, updated_at__gte=_fresh_after()
+        ).values_list('key', 'address'):
+            _lru.put(key, address)
+            found[key] = address
+    return found
+
+
+def store_address(key, address):
+    """Запоминает адрес; пустые ответы (нет адреса или ошибка сети) не кэшируем, чтобы повторить позже."""
+    if address is None:
+        return
+    GeocodeCache.objects.update_or_create(
+        key=key,
+        defaults={'address': address, 'provider': get_geocoder().name, 'updated_at': timezone.now()},
+    )
+    _lru.put(key, address)
+
+
+def reverse_geocode(lat, lon):
+    """Адрес точки; сеть — только если адреса нет ни в памяти, ни в БД."""
+    key = cache_key(lat, lon)
+    address = cached_addresses([key]).get(key)
+    if address is None:
+        address = _limited_reverse(lat, lon)
+        store_address(key, address)
+    return address
+
+
+def reverse_geocode_many(coords, deadline=None, workers=None) -> dict:
+    """
+    Адреса для набора точек (lat, lon): кэш проверяется одним запросом на весь набор,
+    промахи запрашиваются у провайдера параллельно (с учётом его лимита запросов).
+    deadline — секунд на весь пакет: что не успело, возвращается как None и не кэшируется.
+    Возвращает {cache_key: адрес | None}.
+    """
+    by_key = {}
+    for lat, lon in coords:
+        by_key.setdefault(cache_key(lat, lon), (lat, lon))
+    if not by_key:
+        return {}
+    addresses = cached_addresses(by_key)
+    missing = [key for key in by_key if key not in addresses]
+    if not missing:
+        return addresses
+
+    workers = workers or getattr(settings, 'GEOCODING_WORKERS', DEFAULT_WORKERS)
+    until = None if deadline is None else time.monotonic() + deadline
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(missing)), thread_name_prefix='geocode')
+    try:
+        futures = {pool.submit(_limited_reverse, *by_key[key], until): key for key in missing}
+        done, _ = wait(futures, timeout=deadline)
+    finally:
+        # Не ждём зависшие запросы: их результат всё равно уже не попадёт в ответ
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    for future, key in futures.items():
+        address = future.result() if future in done and future.exception() is None else None
+        addresses[key] = address
+        # В БД пишем из текущего потока, рабочие потоки только ходят в сеть
+        store_address(key, address)
+    return addresses
+
+
+def fill_route_addresses(route_ids, deadline=None) -> int:
+    """
+    Записывает в Route.start_address/end_address адреса, которых там ещё нет.
+    Возвращает число обновлённых поездок; неразрешённые адреса останутся NULL до следующего прохода.
+    """
+    routes = list(Route.objects.filter(pk__in=route_ids).filter(
+        Q(start_address__isnull=True, start_location__isnull=False)
+        | Q(end_address__isnull=True, end_location__isnull=False)
+    ).only('id', 'start_location', 'end_location', 'start_address', 'end_address'))
+    if not routes:
+        return 0
+
+    addresses = reverse_geocode_many(
+        [(point.y, point.x) for route in routes for point in (route.start_location, route.end_location) if point],
+        deadline=deadline,
+    )
+    changed = []
+    for route in routes:
+        updated = False
+        if route.start_address is None and route.start_location:
+            route.start_address = addresses.get(cache_key(route.start_location.y, route.start_location.x))
+            updated |= route.start_address is not None
+        if route.end_address is None and route.end_location:
+            route.end_address = addresses.get(cache_key(route.end_location.y, route.end_location.x))
+            updated |= route.end_address is not None
+        if updated:
+            changed.append(route)
+    Route.objects.bulk_update(changed, ['start_address', 'end_address'], batch_size=ROUTE_BATCH_SIZE)
+    return len(changed)
+
+
+def schedule_route_addresses(route_ids):
+    """Ставит заполнение адресов поездок в фоновую очередь (после коммита), пачками по ROUTE_BATCH_SIZE."""
+    route_ids = list(route_ids)
+    for i in range(0, len(route_ids), ROUTE_BATCH_SIZE):
+        background.submit(fill_route_addresses, route_ids[i:i + ROUTE_BATCH_SIZE])
@@ -0,0 +1,95 @@
+"""
+Колоночное представление трека для выгрузки точек: параллельные массивы вместо объекта на точку.
+Трек читается в NumPy (gps_math.load_track) и кодируется целиком, без сериализаторов DRF на строку.
+
+Кодировки (encoding):
+- json     — {"timestamps": [epoch-секунды], "lon": [...], "lat": [...]}
+- polyline — координаты одной строкой encoded polyline (точность 1e-6, порядок lat,lon, как polyline6
+             у OSRM/Valhalla), метки времени — разности соседних, закодированные тем же способом
+- binary   — заголовок BINARY_HEADER (magic, число точек n), затем колонки подряд, little-endian:
+             int64 timestamps[n], float32 lon[n], float32 lat[n]
+"""
+import struct
+
+import numpy as np
+
+from . import gps_math
+
+ENCODING_JSON = 'json'
+ENCODING_POLYLINE = 'polyline'
+ENCODING_BINARY = 'binary'
+ENCODINGS = (ENCODING_JSON, ENCODING_POLYLINE, ENCODING_BINARY)
+
+POLYLINE_PRECISION = 6
+BINARY_MAGIC = b'GPC1'
+BINARY_HEADER = struct.Struct('<4sI')
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+# 64-битное значение после zigzag занимает не больше 13 пятибитных групп
+_MAX_CHUNKS = 13
+
+
+def load_columns(points_qs):
+    """(timestamps int64 epoch-секунды, lon, lat) трека; QuerySet уже отфильтрован и упорядочен по времени."""
+    ts, lon, lat = gps_math.load_track(points_qs)
+    return np.floor(ts).astype(np.int64), lon, lat
+
+
+def encode_varints(values) -> str:
+    """
+    Алгоритм encoded polyline для массива целых (уже разностей): zigzag, группы по 5 бит
+    от младших, бит продолжения 0x20, +63 — в ASCII. Считается на массивах целиком.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if len(values) == 0:
+        return ''
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    shifts = np.arange(_MAX_CHUNKS, dtype=np.uint64) * np.uint64(5)
+    rest = zigzag[:, None] >> shifts[None, :]  # n x _MAX_CHUNKS
+    chunks = (rest & np.uint64(0x1f)).astype(np.uint8)
+    more = (rest >> np.uint64(5)) > 0
+    chunks[more] |= 0x20
+    # Группа нужна, если в ней или старше что-то есть; нулевое значение — одна группа
+    present = rest > 0
+    present[:, 0] = True
+    return (chunks[present] + 63).tobytes().decode('ascii')
+
+
+def encode_polyline(lon, lat, precision=POLYLINE_PRECISION) -> str:
+    """Координаты трека encoded polyline (lat, lon попарно, разности от предыдущей точки)."""
+    factor = 10 ** precision
+    coords = np.empty((len(lat), 2), dtype=np.int64)
+    coords[:, 0] = np.round(np.asarray(lat) * factor)
+    coords[:, 1] = np.round(np.asarray(lon) * factor)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return encode_varints(deltas.ravel())
+
+
+def as_json(vehicle_id, ts, lon, lat):
+    return {
+        "vehicle_id": vehicle_id,
+        "count": len(ts),
+        "timestamps": ts.tolist(),
+        "lon": lon.tolist(),
+        "lat": lat.tolist(),
+    }
+
+
+def as_polyline(vehicle_id, ts, lon, lat):
+    return {
+        "vehicle_id": vehicle_id,
+        "count": len(ts),
+        "precision": POLYLINE_PRECISION,
+        # Первая метка — абсолютная, дальше разности с предыдущей
+        "timestamps": encode_varints(np.diff(ts, prepend=np.int64(0))),
+        "polyline": encode_polyline(lon, lat),
+    }
+
+
+def as_binary(ts, lon, lat) -> bytes:
+    return b''.join((
+        BINARY_HEADER.pack(BINARY_MAGIC, len(ts)),
+        ts.astype('<i8').tobytes(),
+        np.asarray(lon).astype('<f4').tobytes(),
+        np.asarray(lat).astype('<f4').tobytes(),
+    ))
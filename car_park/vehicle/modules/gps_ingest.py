@@ -0,0 +1,175 @@
+import io
+import json
+import math
+import struct
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.db import connection
+
+from . import mileage
+
+GPS_TABLE = 'vehicle_vehiclegpspoint'
+STAGE_TABLE = 'gps_ingest_stage'
+# Ключи точек, реально добавленных текущим вызовом copy_gps_points (для приращения суточных итогов)
+ADDED_TABLE = 'gps_ingest_added'
+COPY_CHUNK_SIZE = 10000
+
+# Компактный бинарный формат одной точки (little-endian, 28 байт):
+# vehicle_id (uint32), timestamp (float64, секунды epoch UTC), lon (float64), lat (float64)
+BINARY_RECORD = struct.Struct('<Iddd')
+
+
+class IngestError(ValueError):
+    """Некорректная запись в пакете телеметрии."""
+
+
+def _parse_timestamp(value) -> datetime:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    if isinstance(value, str):
+        ts = datetime.fromisoformat(value)
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=dt_timezone.utc)
+        return ts
+    raise IngestError('timestamp must be ISO 8601 string or epoch seconds')
+
+
+def make_row(vehicle_id, timestamp, lon, lat) -> tuple:
+    """
+    Нормализует одну точку в кортеж (vehicle_id, timestamp, lon, lat).
+    Бросает IngestError, если запись некорректна.
+    """
+    try:
+        vehicle_id = int(vehicle_id)
+        lon = float(lon)
+        lat = float(lat)
+    except (TypeError, ValueError):
+        raise IngestError('vehicle_id, lon and lat must be numbers')
+    if not (math.isfinite(lon) and math.isfinite(lat)) or not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise IngestError('coordinates out of range')
+    try:
+        timestamp = _parse_timestamp(timestamp)
+    except (ValueError, OverflowError, OSError):
+        raise IngestError('invalid timestamp')
+    return vehicle_id, timestamp, lon, lat
+
+
+def parse_json_record(record: dict) -> tuple:
+    """
+    {"vehicle_id": 1, "timestamp": "...", "lon": 37.6, "lat": 55.7}
+    Вместо lon/lat допускается "location": [lon, lat] (как в экспорте).
+    """
+    if not isinstance(record, dict):
+        raise IngestError('record must be an object')
+    location = record.get('location')
+    if location is not None:
+        if not isinstance(location, (list, tuple)) or len(location) != 2:
+            raise IngestError('location must be [lon, lat]')
+        lon, lat = location
+    else:
+        lon, lat = record.get('lon'), record.get('lat')
+    return make_row(record.get('vehicle_id'), record.get('timestamp'), lon, lat)
+
+
+def iter_ndjson(lines):
+    """
+    Построчно разбирает JSON Lines.
+    Отдаёт (номер_строки, row | None, ошибка | None), пустые строки пропускает.
+    """
+    for lineno, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield lineno, parse_json_record(json.loads(line)), None
+        except (IngestError, ValueError) as e:
+            yield lineno, None, str(e)
+
+
+def iter_binary(stream, chunk_records: int = 4096):
+    """
+    Читает поток записей BINARY_RECORD.
+    Хвост, не кратный размеру записи, считается одной ошибочной записью.
+    """
+    size = BINARY_RECORD.size
+    index = 0
+    tail = b''
+    while True:
+        data = stream.read(size * chunk_records)
+        if not data:
+            break
+        data = tail + data
+        usable = len(data) - len(data) % size
+        tail = data[usable:]
+        for vehicle_id, ts, lon, lat in BINARY_RECORD.iter_unpack(data[:usable]):
+            index += 1
+            try:
+                yield index, make_row(vehicle_id, ts, lon, lat), None
+            except IngestError as e:
+                yield index, None, str(e)
+    if tail:
+        yield index + 1, None, 'truncated binary record'
+
+
+def _copy_buffer(rows) -> io.StringIO:
+    buf = io.StringIO()
+    write = buf.write
+    for vehicle_id, timestamp, lon, lat in rows:
+        write(f"{vehicle_id}\t{timestamp.isoformat()}\tSRID=4326;POINT({lon!r} {lat!r})\n")
+    buf.seek(0)
+    return buf
+
+
+def _ensure_stage_table(cursor):
+    # Временная таблица живёт до конца соединения; её чистим перед каждой пачкой сами,
+    # а не ON COMMIT — в autocommit она опустела бы сразу после COPY.
+    cursor.execute(
+        f'CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} '
+        f'(vehicle_id integer, "timestamp" timestamptz, location geometry(Point, 4326))'
+    )
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {ADDED_TABLE} (vehicle_id integer, "timestamp" timestamptz)')
+
+
+def copy_gps_points(rows, chunk_size: int = COPY_CHUNK_SIZE, update_rollups: bool = True) -> int:
+    """
+    Пишет точки (vehicle_id, timestamp, lon, lat) пачками по chunk_size:
+    COPY во временную таблицу, затем INSERT ... ON CONFLICT (vehicle_id, timestamp) DO NOTHING.
+    Уже загруженные точки (повторный импорт, повтор пакета) пропускаются без ошибок.
+    Вклад добавленных точек прибавляется к суточным итогам пробега (mileage.add_to_daily_mileage).
+    Вызывать внутри transaction.atomic(): точки и приращение итогов должны коммититься вместе,
+    иначе параллельная пачка посчитает чужие точки старыми. Возвращает количество реально добавленных строк.
+    """
+    rows = iter(rows)
+    written = 0
+    windows = {}  # vehicle_id -> (первая, последняя) добавленная точка
+    with connection.cursor() as cursor:
+        _ensure_stage_table(cursor)
+        cursor.execute(f'TRUNCATE {ADDED_TABLE}')
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            cursor.execute(f'TRUNCATE {STAGE_TABLE}')
+            cursor.copy_expert(
+                f'COPY {STAGE_TABLE} (vehicle_id, "timestamp", location) FROM STDIN',
+                _copy_buffer(chunk),
+            )
+            cursor.execute(
+                f'WITH inserted AS ('
+                f'INSERT INTO {GPS_TABLE} (vehicle_id, "timestamp", location) '
+                f'SELECT vehicle_id, "timestamp", location FROM {STAGE_TABLE} '
+                f'ON CONFLICT (vehicle_id, "timestamp") DO NOTHING '
+                f'RETURNING vehicle_id, "timestamp"), '
+                f'logged AS (INSERT INTO {ADDED_TABLE} SELECT vehicle_id, "timestamp" FROM inserted) '
+                f'SELECT vehicle_id, COUNT(*), MIN("timestamp"), MAX("timestamp") FROM inserted GROUP BY vehicle_id'
+            )
+            for vehicle_id, count, first, last in cursor.fetchall():
+                written += count
+                if vehicle_id in windows:
+                    prev_first, prev_last = windows[vehicle_id]
+                    first, last = min(first, prev_first), max(last, prev_last)
+                windows[vehicle_id] = (first, last)
+    if update_rollups:
+        mileage.add_to_daily_mileage(windows, ADDED_TABLE)
+    return written
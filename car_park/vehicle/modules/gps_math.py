@@ -1,5 +1,29 @@
+"""
+Векторная математика треков: трек — это три массива NumPy одинаковой длины
+(ts — секунды epoch UTC, lon, lat в градусах), все расчёты — операции над массивами целиком.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.db import connections
+from django.db.models import F, FloatField, Func
+
+# Тот же средний радиус Земли, что и в пакете haversine
+EARTH_RADIUS_KM = 6371.0088
+
+# Точка трека в том виде, в каком её отдаёт TRACK_BYTES_SQL: три float8 в сетевом порядке байт
+TRACK_DTYPE = np.dtype([('ts', '>f8'), ('lon', '>f8'), ('lat', '>f8')])
+
+# Весь трек одним значением bytea: float8send каждого поля, записи подряд в порядке времени.
+# В Python приходит один буфер вместо кортежа на точку, массивы получаются через np.frombuffer.
+TRACK_BYTES_SQL = """
+    SELECT string_agg(float8send(_ts) || float8send(_lon) || float8send(_lat), ''::bytea ORDER BY _ts)
+    FROM ({points}) track
+"""
+
 
 def get_period_key(dt, period):
+    """Ключ периода по дате самого dt: для дня предприятия передавать локальное время (см. period_boundaries)."""
     if period == 'day':
         return str(dt.date())
     elif period == 'month':
@@ -9,3 +33,133 @@ def get_period_key(dt, period):
     else:
         return str(dt.date())
 
+
+def local_date_bounds(start_date: date, end_date: date, tz):
+    """
+    Диапазон локальных дат [start_date, end_date] (включительно) в таймзоне tz
+    как полуинтервал моментов [начало, конец): фильтр timestamp >= начало AND timestamp < конец
+    идёт по индексу, без приведения каждой строки к дате.
+    """
+    start = datetime(start_date.year, start_date.month, start_date.day, tzinfo=tz)
+    after_end = end_date + timedelta(days=1)
+    end = datetime(after_end.year, after_end.month, after_end.day, tzinfo=tz)
+    return start, end
+
+
+def load_track(points_qs):
+    """
+    Загружает точки (QuerySet VehicleGPSPoint, отфильтрованный) в массивы (ts, lon, lat), по времени.
+    Время и координаты достаются в БД скалярами и склеиваются там же в один буфер (TRACK_BYTES_SQL):
+    ни GEOS-объектов, ни строк ORM на точку.
+    """
+    points = points_qs.order_by().annotate(
+        _ts=Func(F('timestamp'), template='EXTRACT(EPOCH FROM %(expressions)s)::double precision',
+                 output_field=FloatField()),
+        _lon=Func(F('location'), function='ST_X', output_field=FloatField()),
+        _lat=Func(F('location'), function='ST_Y', output_field=FloatField()),
+    ).values_list('_ts', '_lon', '_lat')
+    sql, params = points.query.sql_with_params()
+    with connections[points.db].cursor() as cursor:
+        cursor.execute(TRACK_BYTES_SQL.format(points=sql), params)
+        data = cursor.fetchone()[0]
+    track = np.frombuffer(data or b'', dtype=TRACK_DTYPE)
+    # Копии в родном порядке байт: дальше векторные операции идут без преобразований
+    return track['ts'].astype(np.float64), track['lon'].astype(np.float64), track['lat'].astype(np.float64)
+
+
+def segment_distances(lon, lat):
+    """Длины отрезков между соседними точками, км (массив длиной n - 1)."""
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    # cos широты считается один раз на точку, промежуточные массивы переиспользуются (out=)
+    cos_lat = np.cos(lat)
+    a = np.sin(np.diff(lat) / 2)
+    np.square(a, out=a)
+    b = np.sin(np.diff(lon) / 2)
+    np.square(b, out=b)
+    b *= cos_lat[:-1]
+    b *= cos_lat[1:]
+    a += b
+    np.minimum(a, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_KM
+    return a
+
+
+def cumulative_distance(lon, lat):
+    """Пройденное к каждой точке расстояние, км (массив длиной n, первый элемент 0)."""
+    dist = np.zeros(len(lon), dtype=np.float64)
+    if len(dist) > 1:
+        np.cumsum(segment_distances(lon, lat), out=dist[1:])
+    return dist
+
+
+def speeds(ts, lon, lat):
+    """Скорость на каждом отрезке, км/ч; для отрезков с нулевой длительностью — nan."""
+    hours = np.diff(np.asarray(ts, dtype=np.float64)) / 3600.0
+    dist = segment_distances(lon, lat)
+    return np.divide(dist, hours, out=np.full_like(dist, np.nan), where=hours > 0)
+
+
+def bounding_box(lon, lat):
+    """(min_lon, min_lat, max_lon, max_lat) или None для пустого трека."""
+    if len(lon) == 0:
+        return None
+    return float(np.min(lon)), float(np.min(lat)), float(np.max(lon)), float(np.max(lat))
+
+
+def _period_start(day: date, period):
+    if period == 'year':
+        return date(day.year, 1, 1)
+    if period == 'month':
+        return date(day.year, day.month, 1)
+    return day
+
+
+def _next_period(day: date, period):
+    if period == 'year':
+        return date(day.year + 1, 1, 1)
+    if period == 'month':
+        return date(day.year + (day.month == 12), day.month % 12 + 1, 1)
+    return date.fromordinal(day.toordinal() + 1)
+
+
+def period_boundaries(first_ts, last_ts, period, tz):
+    """
+    Начала периодов (локальная полночь в tz, в секундах epoch), покрывающие [first_ts, last_ts],
+    и ключи периодов в формате get_period_key.
+    """
+    day = _period_start(datetime.fromtimestamp(first_ts, tz).date(), period)
+    last_day = datetime.fromtimestamp(last_ts, tz).date()
+    bounds, keys = [], []
+    while day <= last_day:
+        local_start = datetime(day.year, day.month, day.day, tzinfo=tz)
+        bounds.append(local_start.timestamp())
+        keys.append(get_period_key(local_start, period))
+        day = _next_period(day, period)
+    return np.array(bounds, dtype=np.float64), keys
+
+
+def bucket_sums(ts, values, period, tz):
+    """
+    Суммы values по периодам (day/month/year) локального времени tz.
+    Значение относится к периоду своей метки времени ts. Периоды без значений не возвращаются.
+    Для упорядоченных ts (трек) границы периодов ищутся в ts и суммы берутся срезами (np.add.reduceat),
+    иначе — номер периода для каждого значения и np.bincount.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    if len(ts) == 0:
+        return {}
+    values = np.asarray(values, dtype=np.float64)
+    bounds, keys = period_boundaries(float(ts.min()), float(ts.max()), period, tz)
+    if np.all(ts[1:] >= ts[:-1]):
+        starts = np.searchsorted(ts, bounds, side='left')
+        ends = np.append(starts[1:], len(ts))
+        present = np.flatnonzero(ends > starts)
+        sums = np.add.reduceat(values, starts[present])
+        return {keys[i]: float(total) for i, total in zip(present, sums)}
+    idx = np.searchsorted(bounds, ts, side='right') - 1
+    sums = np.bincount(idx, weights=values, minlength=len(keys))
+    counts = np.bincount(idx, minlength=len(keys))
+    return {keys[i]: float(sums[i]) for i in np.flatnonzero(counts)}
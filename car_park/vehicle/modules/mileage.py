@@ -0,0 +1,388 @@
+"""
+Расчёт пробега по GPS-точкам с разбивкой по периодам (день/месяц/год).
+Основной движок суммирует суточные итоги (VehicleDailyMileage), которые поддерживаются
+при записи точек; sql считает по сырым точкам в PostGIS, python — то же на NumPy, для сверки.
+"""
+import multiprocessing
+import zoneinfo
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connection, transaction
+
+from . import gps_math
+
+ENGINE_ROLLUP = 'rollup'
+ENGINE_SQL = 'sql'
+ENGINE_PYTHON = 'python'
+ENGINES = (ENGINE_ROLLUP, ENGINE_SQL, ENGINE_PYTHON)
+# Отчёт по парку на python считается пулом процессов — только из отдельного процесса
+# (команда fleet_mileage_report), не из веб-сервера
+FLEET_WEB_ENGINES = (ENGINE_ROLLUP, ENGINE_SQL)
+DEFAULT_ENGINE = ENGINE_ROLLUP
+
+ROLLUP_TABLE = 'vehicle_vehicledailymileage'
+# Номера изменений суточных итогов (VehicleDailyMileage.version); создаётся миграцией 0026
+ROLLUP_VERSION_SEQUENCE = 'vehicle_dailymileage_version_seq'
+
+# Ключи периодов в том же виде, что отдаёт gps_math.get_period_key
+PERIOD_FORMATS = {
+    'day': 'YYYY-MM-DD',
+    'month': 'YYYY-MM',
+    'year': 'YYYY',
+}
+
+# Правило для всех движков (как в суточных итогах): отрезок между соседними точками относится
+# к периоду своей конечной точки. Первый отрезок диапазона начинается в последней точке до него,
+# поэтому LAG стартует с неё, а сама она в суммы не входит.
+VEHICLE_MILEAGE_SQL = """
+    SELECT to_char(bucket, %(key_format)s) AS period_key, SUM(dist) / 1000.0 AS mileage
+    FROM (
+        SELECT p."timestamp" AS ts,
+               date_trunc(%(period)s, p."timestamp" AT TIME ZONE %(tz)s) AS bucket,
+               ST_DistanceSphere(p.location, LAG(p.location) OVER (ORDER BY p."timestamp")) AS dist
+        FROM vehicle_vehiclegpspoint p
+        WHERE p.vehicle_id = %(vehicle_id)s
+          AND p."timestamp" >= COALESCE(
+              (SELECT MAX("timestamp") FROM vehicle_vehiclegpspoint
+               WHERE vehicle_id = %(vehicle_id)s AND "timestamp" < %(start_utc)s),
+              %(start_utc)s)
+          AND p."timestamp" < %(end_utc)s
+    ) segments
+    WHERE dist IS NOT NULL
+      AND ts >= %(start_utc)s
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+PREVIOUS_POINT_SQL = """
+    SELECT MAX("timestamp") FROM vehicle_vehiclegpspoint
+    WHERE vehicle_id = %s AND "timestamp" < %s
+"""
+
+
+def _period(period):
+    return period if period in PERIOD_FORMATS else 'day'
+
+
+def vehicle_mileage_sql(vehicle_id, start_date, end_date, period, tz) -> list[dict]:
+    """
+    Пробег (км) машины по периодам, посчитанный в БД: [{"date": ключ периода, "mileage": км}, ...]
+    start_date/end_date — локальные даты предприятия (включительно).
+    """
+    period = _period(period)
+    start_utc, end_utc = gps_math.local_date_bounds(start_date, end_date, tz)
+    with connection.cursor() as cursor:
+        cursor.execute(VEHICLE_MILEAGE_SQL, {
+            'key_format': PERIOD_FORMATS[period],
+            'period': period,
+            'tz': str(tz),
+            'vehicle_id': vehicle_id,
+            'start_utc': start_utc,
+            'end_utc': end_utc,
+        })
+        return [{"date": key, "mileage": float(mileage)} for key, mileage in cursor.fetchall()]
+
+
+def track_window(vehicle_id, start_date, end_date, tz):
+    """
+    Моменты UTC [с, до) точек, нужных для пробега за локальные даты start_date..end_date:
+    с последней точки до начала диапазона (начало первого отрезка), иначе — с локальной полуночи.
+    """
+    start_utc, end_utc = gps_math.local_date_bounds(start_date, end_date, tz)
+    with connection.cursor() as cursor:
+        cursor.execute(PREVIOUS_POINT_SQL, [vehicle_id, start_utc])
+        previous = cursor.fetchone()[0]
+    return previous or start_utc, end_utc
+
+
+def vehicle_mileage_python(ts, lon, lat, period, tz) -> list[dict]:
+    """
+    То же самое в Python на массивах трека (см. gps_math.load_track, окно — track_window):
+    длина каждого отрезка приписывается периоду его конечной точки.
+    """
+    sums = gps_math.bucket_sums(ts[1:], gps_math.segment_distances(lon, lat), _period(period), tz)
+    return [{"date": k, "mileage": v} for k, v in sums.items()]
+
+
+ROLLUP_MILEAGE_SQL = """
+    SELECT to_char(date_trunc(%(period)s, day::timestamp), %(key_format)s) AS period_key,
+           SUM(distance_km) AS mileage
+    FROM vehicle_vehicledailymileage
+    WHERE vehicle_id = %(vehicle_id)s
+      AND day >= %(start_date)s
+      AND day <= %(end_date)s
+    GROUP BY period_key
+    ORDER BY period_key
+"""
+
+# Полный пересчёт суточных итогов машины в окне [lo, hi) (rebuild_daily_mileage). LAG берётся
+# и от последней точки до окна, чтобы отрезок, начавшийся накануне, попал в первый день окна.
+REFRESH_ROLLUP_SQL = """
+    WITH segments AS (
+        SELECT p."timestamp" AS ts,
+               (p."timestamp" AT TIME ZONE %(tz)s)::date AS day,
+               ST_DistanceSphere(p.location, LAG(p.location) OVER (ORDER BY p."timestamp")) AS dist
+        FROM vehicle_vehiclegpspoint p
+        WHERE p.vehicle_id = %(vehicle_id)s
+          AND p."timestamp" >= COALESCE(
+              (SELECT MAX("timestamp") FROM vehicle_vehiclegpspoint
+               WHERE vehicle_id = %(vehicle_id)s AND "timestamp" < %(lo)s),
+              %(lo)s)
+          AND p."timestamp" < %(hi)s
+    )
+    INSERT INTO vehicle_vehicledailymileage
+        (vehicle_id, day, distance_km, points_count, first_timestamp, last_timestamp, updated_at, version)
+    SELECT %(vehicle_id)s, day, COALESCE(SUM(dist), 0) / 1000.0, COUNT(*), MIN(ts), MAX(ts), clock_timestamp(),
+           nextval('{seq}')
+    FROM segments
+    WHERE ts >= %(lo)s
+    GROUP BY day
+    ON CONFLICT (vehicle_id, day) DO UPDATE SET
+        distance_km = EXCLUDED.distance_km,
+        points_count = EXCLUDED.points_count,
+        first_timestamp = EXCLUDED.first_timestamp,
+        last_timestamp = EXCLUDED.last_timestamp,
+        updated_at = EXCLUDED.updated_at,
+        version = EXCLUDED.version
+"""
+
+# Приращение суточных итогов от только что добавленных точек (их ключи — во временной таблице %(added)s).
+# Читаются только точки между ближайшими старыми соседями пачки, а не весь день:
+# + отрезки, у которых хотя бы один конец новый; − старый отрезок между соседними старыми точками,
+# в который вклинились новые. Каждый отрезок относится ко дню своей конечной точки.
+INCREMENT_ROLLUP_SQL = """
+    WITH bounds AS (
+        SELECT COALESCE((SELECT MAX("timestamp") FROM vehicle_vehiclegpspoint
+                         WHERE vehicle_id = %(vehicle_id)s AND "timestamp" < %(lo)s), %(lo)s) AS lo,
+               COALESCE((SELECT MIN("timestamp") FROM vehicle_vehiclegpspoint
+                         WHERE vehicle_id = %(vehicle_id)s AND "timestamp" > %(hi)s), %(hi)s) AS hi
+    ), pts AS (
+        SELECT p."timestamp" AS ts, p.location, a."timestamp" IS NOT NULL AS is_new
+        FROM bounds b
+        JOIN vehicle_vehiclegpspoint p
+          ON p.vehicle_id = %(vehicle_id)s AND p."timestamp" >= b.lo AND p."timestamp" <= b.hi
+        LEFT JOIN {added} a ON a.vehicle_id = p.vehicle_id AND a."timestamp" = p."timestamp"
+    ), seq AS (
+        SELECT ts, is_new,
+               ST_DistanceSphere(location, LAG(location) OVER w) AS dist,
+               LAG(is_new) OVER w AS prev_is_new
+        FROM pts
+        WINDOW w AS (ORDER BY ts)
+    ), old AS (
+        SELECT ts, ST_DistanceSphere(location, LAG(location) OVER (ORDER BY ts)) AS dist
+        FROM pts
+        WHERE NOT is_new
+    ), delta AS (
+        SELECT s.ts, s.is_new,
+               (s.ts AT TIME ZONE %(tz)s)::date AS day,
+               COALESCE(s.dist, 0)
+               - CASE WHEN s.is_new THEN 0 ELSE COALESCE(o.dist, 0) END AS dist
+        FROM seq s
+        LEFT JOIN old o ON o.ts = s.ts
+        WHERE s.is_new OR s.prev_is_new
+    )
+    INSERT INTO vehicle_vehicledailymileage AS d
+        (vehicle_id, day, distance_km, points_count, first_timestamp, last_timestamp, updated_at, version)
+    SELECT %(vehicle_id)s, day, SUM(dist) / 1000.0, COUNT(*) FILTER (WHERE is_new), MIN(ts), MAX(ts),
+           clock_timestamp(), nextval('{seq}')
+    FROM delta
+    GROUP BY day
+    ON CONFLICT (vehicle_id, day) DO UPDATE SET
+        distance_km = d.distance_km + EXCLUDED.distance_km,
+        points_count = d.points_count + EXCLUDED.points_count,
+        first_timestamp = LEAST(d.first_timestamp, EXCLUDED.first_timestamp),
+        last_timestamp = GREATEST(d.last_timestamp, EXCLUDED.last_timestamp),
+        updated_at = EXCLUDED.updated_at,
+        version = EXCLUDED.version
+"""
+
+# Класс advisory-блокировок суточных итогов: (ROLLUP_LOCK_CLASS, vehicle_id)
+ROLLUP_LOCK_CLASS = 1001
+
+
+def vehicle_mileage_rollup(vehicle_id, start_date, end_date, period) -> list[dict]:
+    """Пробег (км) по периодам как сумма суточных итогов: сотни строк вместо миллионов точек."""
+    period = _period(period)
+    with connection.cursor() as cursor:
+        cursor.execute(ROLLUP_MILEAGE_SQL, {
+            'key_format': PERIOD_FORMATS[period],
+            'period': period,
+            'vehicle_id': vehicle_id,
+            'start_date': start_date,
+            'end_date': end_date,
+        })
+        return [{"date": key, "mileage": float(mileage)} for key, mileage in cursor.fetchall()]
+
+
+def _vehicle_timezones(cursor, vehicle_ids) -> dict:
+    cursor.execute(
+        "SELECT v.id, e.local_timezone FROM vehicle_vehicle v "
+        "JOIN vehicle_enterprise e ON e.id = v.enterprise_id WHERE v.id = ANY(%s)",
+        [list(vehicle_ids)],
+    )
+    return {vehicle_id: zoneinfo.ZoneInfo(tz_name) for vehicle_id, tz_name in cursor.fetchall()}
+
+
+def _lock_vehicles(cursor, vehicle_ids):
+    """
+    Блокировка суточных итогов машин до конца транзакции. Пачки одной машины считают приращение
+    по очереди, и вторая видит закоммиченные точки первой. Порядок id — защита от взаимоблокировок.
+    """
+    for vehicle_id in sorted(vehicle_ids):
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [ROLLUP_LOCK_CLASS, vehicle_id])
+
+
+def add_to_daily_mileage(windows, added_table) -> int:
+    """
+    Добавляет к суточным итогам вклад новых точек.
+    windows: {vehicle_id: (первая добавленная точка, последняя добавленная точка)},
+    added_table: временная таблица (vehicle_id, "timestamp") с ключами добавленных точек.
+    Вызывается в той же транзакции, что и вставка точек. Стоимость зависит от размера пачки,
+    а не от числа точек, уже лежащих в этих днях.
+    Возвращает число обновлённых строк.
+    """
+    if not windows:
+        return 0
+    updated = 0
+    sql = INCREMENT_ROLLUP_SQL.format(added=added_table, seq=ROLLUP_VERSION_SEQUENCE)
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock_vehicles(cursor, windows)
+        zones = _vehicle_timezones(cursor, windows)
+        for vehicle_id, (first, last) in windows.items():
+            cursor.execute(sql, {
+                'tz': str(zones[vehicle_id]),
+                'vehicle_id': vehicle_id,
+                'lo': first,
+                'hi': last,
+            })
+            updated += cursor.rowcount
+    return updated
+
+
+def rebuild_daily_mileage(vehicle_id) -> int:
+    """Полностью пересчитывает суточные итоги машины (например, после смены таймзоны предприятия)."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock_vehicles(cursor, [vehicle_id])
+        cursor.execute(f'DELETE FROM {ROLLUP_TABLE} WHERE vehicle_id = %s', [vehicle_id])
+        cursor.execute(
+            'SELECT MIN("timestamp"), MAX("timestamp") FROM vehicle_vehiclegpspoint WHERE vehicle_id = %s',
+            [vehicle_id],
+        )
+        first, last = cursor.fetchone()
+        if first is None:
+            return 0
+        tz = _vehicle_timezones(cursor, [vehicle_id])[vehicle_id]
+        lo, hi = gps_math.local_date_bounds(first.astimezone(tz).date(), last.astimezone(tz).date(), tz)
+        cursor.execute(REFRESH_ROLLUP_SQL.format(seq=ROLLUP_VERSION_SEQUENCE), {
+            'tz': str(tz),
+            'vehicle_id': vehicle_id,
+            'lo': lo,
+            'hi': hi,
+        })
+        return cursor.rowcount
+
+
+# --- Отчёт по всему парку предприятия ---
+
+FLEET_ROLLUP_INSERT_SQL = """
+    INSERT INTO vehicle_enterprisemileagereportrow (report_id, vehicle_id, period_key, mileage)
+    SELECT %(report_id)s, d.vehicle_id,
+           to_char(date_trunc(%(period)s, d.day::timestamp), %(key_format)s) AS period_key,
+           SUM(d.distance_km)
+    FROM vehicle_vehicledailymileage d
+    JOIN vehicle_vehicle v ON v.id = d.vehicle_id
+    WHERE v.enterprise_id = %(enterprise_id)s
+      AND d.day >= %(start_date)s
+      AND d.day <= %(end_date)s
+    GROUP BY d.vehicle_id, period_key
+"""
+
+FLEET_SQL_INSERT_SQL = """
+    INSERT INTO vehicle_enterprisemileagereportrow (report_id, vehicle_id, period_key, mileage)
+    SELECT %(report_id)s, vehicle_id, to_char(bucket, %(key_format)s), SUM(dist) / 1000.0
+    FROM (
+        SELECT p.vehicle_id,
+               p."timestamp" AS ts,
+               date_trunc(%(period)s, p."timestamp" AT TIME ZONE %(tz)s) AS bucket,
+               ST_DistanceSphere(
+                   p.location,
+                   LAG(p.location) OVER (PARTITION BY p.vehicle_id ORDER BY p."timestamp")
+               ) AS dist
+        FROM vehicle_vehicle v
+        -- Последняя точка машины до начала диапазона: с неё начинается первый отрезок (VEHICLE_MILEAGE_SQL)
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(MAX("timestamp"), %(start_utc)s) AS since
+            FROM vehicle_vehiclegpspoint
+            WHERE vehicle_id = v.id AND "timestamp" < %(start_utc)s
+        ) b
+        JOIN vehicle_vehiclegpspoint p
+          ON p.vehicle_id = v.id AND p."timestamp" >= b.since AND p."timestamp" < %(end_utc)s
+        WHERE v.enterprise_id = %(enterprise_id)s
+    ) segments
+    WHERE dist IS NOT NULL
+      AND ts >= %(start_utc)s
+    GROUP BY vehicle_id, bucket
+"""
+
+
+def fleet_mileage_into(report_id, enterprise_id, start_date, end_date, period, tz, engine) -> int:
+    """
+    Пишет пробег всех машин предприятия по периодам в строки отчёта одним INSERT ... SELECT
+    (engine rollup или sql). Возвращает число строк.
+    """
+    period = _period(period)
+    sql = FLEET_SQL_INSERT_SQL if engine == ENGINE_SQL else FLEET_ROLLUP_INSERT_SQL
+    start_utc, end_utc = gps_math.local_date_bounds(start_date, end_date, tz)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'report_id': report_id,
+            'enterprise_id': enterprise_id,
+            'key_format': PERIOD_FORMATS[period],
+            'period': period,
+            'tz': str(tz),
+            'start_date': start_date,
+            'end_date': end_date,
+            'start_utc': start_utc,
+            'end_utc': end_utc,
+        })
+        return cursor.rowcount
+
+
+def _init_worker():
+    """Процесс пула запускается через spawn с чистым интерпретатором: настраиваем Django заново."""
+    import django
+
+    django.setup()
+
+
+def _vehicle_mileage_worker(args):
+    """Выполняется в дочернем процессе: своё соединение с БД, один трек в памяти."""
+    from ..models import VehicleGPSPoint
+
+    vehicle_id, start_date, end_date, period, tz = args
+    since, end_utc = track_window(vehicle_id, start_date, end_date, tz)
+    points = VehicleGPSPoint.objects.filter(
+        vehicle_id=vehicle_id,
+        timestamp__gte=since,
+        timestamp__lt=end_utc,
+    ).order_by('timestamp')
+    ts, lon, lat = gps_math.load_track(points)
+    return vehicle_id, gps_math.bucket_sums(ts[1:], gps_math.segment_distances(lon, lat), period, tz)
+
+
+def fleet_mileage_python(vehicle_ids, start_date, end_date, period, tz, workers=None, on_vehicle=None):
+    """
+    Пробег машин по периодам на NumPy, машины считаются параллельно в пуле процессов.
+    Отдаёт (vehicle_id, period_key, km). Процессы запускаются через spawn и открывают свои соединения,
+    соединение и транзакция вызывающего кода не трогаются. Из веб-процессов не вызывать
+    (см. FLEET_WEB_ENGINES). on_vehicle вызывается после каждой посчитанной машины.
+    """
+    period = _period(period)
+    tasks = [(vehicle_id, start_date, end_date, period, tz) for vehicle_id in vehicle_ids]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker) as pool:
+        for vehicle_id, sums in pool.map(_vehicle_mileage_worker, tasks, chunksize=8):
+            for key, km in sums.items():
+                yield vehicle_id, key, km
+            if on_vehicle:
+                on_vehicle()
@@ -3,10 +3,11 @@ import requests
 KEY = "5b3ce3597851110001cf62489efd2bfc610f4a348f0719877a5d6a56"
 
 
-def reverse_geocode_ors(api_key: str, lat: str, lng: str):
+def reverse_geocode_ors(api_key: str, lat: str, lng: str, session=None, timeout=5):
     """
     Обратное геокодирование через ORS /geocode/reverse
     https://openrouteservice.org/dev/#/api-docs/geocode/reverse
+    session — общий requests.Session, чтобы переиспользовать соединения между запросами.
     """
     if not api_key:
         return None
@@ -20,7 +21,7 @@ def reverse_geocode_ors(api_key: str, lat: str, lng: str):
         'sources': 'osm'
     }
     try:
-        r = requests.get(url, params=params, timeout=5)
+        r = (session or requests).get(url, params=params, timeout=timeout)
         r.raise_for_status()
         data = r.json()
         # например, data['features'][0]['properties']['label']
@@ -0,0 +1,90 @@
+from datetime import date
+
+from django.db import connection
+
+PARENT_TABLE = 'vehicle_vehiclegpspoint'
+PARTITION_PREFIX = PARENT_TABLE + '_p'
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+
+def list_partitions() -> list[tuple[str, date]]:
+    """
+    Месячные секции GPS-точек: [(имя, первый день месяца), ...] по возрастанию.
+    DEFAULT-секция сюда не входит.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [PARENT_TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    result = []
+    for name in names:
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        year, month = name[len(PARTITION_PREFIX):].split('_')
+        result.append((name, date(int(year), int(month), 1)))
+    return sorted(result, key=lambda item: item[1])
+
+
+def ensure_partitions(start: date, months_ahead: int) -> list[str]:
+    """
+    Создаёт недостающие секции с месяца start до start + months_ahead включительно.
+    Строки, успевшие попасть в DEFAULT-секцию, переносятся в новую секцию.
+    """
+    created = []
+    existing = {name for name, _ in list_partitions()}
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = add_months(month_start(start), offset)
+            if partition_name(month) in existing:
+                continue
+            cursor.execute("SELECT vehicle_gps_create_partition(%s)", [month])
+            created.append(cursor.fetchone()[0])
+    return created
+
+
+def detach_partitions_before(cutoff: date, archive_schema: str | None = None, drop: bool = False) -> list[str]:
+    """
+    Отсоединяет секции, целиком лежащие раньше месяца cutoff.
+    archive_schema — перенести отсоединённые таблицы в эту схему,
+    drop — удалить их совсем. Без этих параметров таблица остаётся рядом как обычная.
+    """
+    detached = []
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if archive_schema:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote(archive_schema)}")
+        for name, month in list_partitions():
+            if month >= month_start(cutoff):
+                break
+            cursor.execute(f"ALTER TABLE {quote(PARENT_TABLE)} DETACH PARTITION {quote(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {quote(name)}")
+            elif archive_schema:
+                cursor.execute(f"ALTER TABLE {quote(name)} SET SCHEMA {quote(archive_schema)}")
+            detached.append(name)
+    return detached
+
+
+def default_partition_rows() -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {PARENT_TABLE}_default")
+        return cursor.fetchone()[0]
@@ -0,0 +1,123 @@
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from ..models import Report, VehicleMileageReport, EnterpriseMileageReport, VehicleDailyMileage
+from . import background, mileage
+
+PROGRESS_STEP = 1  # процентов между записями прогресса в БД
+
+
+def _rollups_for(report):
+    if isinstance(report, EnterpriseMileageReport):
+        rollups = VehicleDailyMileage.objects.filter(vehicle__enterprise_id=report.enterprise_id)
+    else:
+        rollups = VehicleDailyMileage.objects.filter(vehicle_id=report.vehicle_id)
+    return rollups.filter(day__gte=report.start_date, day__lte=report.end_date)
+
+
+def rollup_fingerprint(report) -> str:
+    """
+    Отпечаток суточных итогов в диапазоне отчёта: число строк и сумма их версий.
+    Любая запись строки берёт новый номер из последовательности (mileage.ROLLUP_VERSION_SEQUENCE),
+    поэтому отпечаток меняется и от изменений, закоммиченных после того, как отчёт начал считаться.
+    """
+    stamp = _rollups_for(report).aggregate(count=Count('pk'), versions=Sum('version'))
+    return f"{stamp['count']}:{stamp['versions'] or 0}"
+
+
+def is_fresh(report) -> bool:
+    """Готовый отчёт актуален, если суточные итоги в его диапазоне не менялись с начала расчёта."""
+    if report.status != Report.DONE or not report.rollup_fingerprint:
+        return False
+    return rollup_fingerprint(report) == report.rollup_fingerprint
+
+
+def _find_or_create(model, name, **params) -> tuple[Report, bool]:
+    for report in model.objects.filter(
+        status__in=[Report.PENDING, Report.RUNNING, Report.DONE], **params
+    ).order_by('-created_at'):
+        if report.status != Report.DONE or is_fresh(report):
+            return report, False
+
+    report = model.objects.create(name=name, **params)
+    background.submit(run_report, report.pk)
+    return report, True
+
+
+def find_or_create_vehicle_report(vehicle, start_date, end_date, period) -> tuple[VehicleMileageReport, bool]:
+    """
+    Возвращает (report, created). Такой же актуальный или ещё считающийся отчёт переиспользуется,
+    иначе создаётся новый и ставится в фоновую очередь.
+    """
+    return _find_or_create(
+        VehicleMileageReport, f"Отчёт о пробеге {vehicle.vin}",
+        vehicle=vehicle, start_date=start_date, end_date=end_date, period=period,
+    )
+
+
+def find_or_create_enterprise_report(enterprise, start_date, end_date, period,
+                                     engine=mileage.DEFAULT_ENGINE) -> tuple[EnterpriseMileageReport, bool]:
+    return _find_or_create(
+        EnterpriseMileageReport, f"Пробег парка {enterprise.name}",
+        enterprise=enterprise, start_date=start_date, end_date=end_date, period=period, engine=engine,
+    )
+
+
+def _concrete_report(report_id):
+    for model in (VehicleMileageReport, EnterpriseMileageReport):
+        report = model.objects.filter(pk=report_id).first()
+        if report is not None:
+            return report
+    return Report.objects.get(pk=report_id)
+
+
+def _set_progress(report_id, progress):
+    Report.objects.filter(pk=report_id).update(progress=progress, updated_at=timezone.now())
+
+
+def run_report(report_id):
+    """Считает отчёт, если его ещё никто не забрал из очереди."""
+    now = timezone.now()
+    claimed = Report.objects.filter(pk=report_id, status=Report.PENDING).update(
+        status=Report.RUNNING, progress=0, started_at=now, updated_at=now
+    )
+    if not claimed:
+        return
+    report = _concrete_report(report_id)
+    # До расчёта: изменения, которые он мог не увидеть, сделают отчёт неактуальным
+    fingerprint = rollup_fingerprint(report)
+
+    try:
+        if isinstance(report, EnterpriseMileageReport):
+            total = report.enterprise.vehicles.count() or 1
+            state = {'done': 0, 'reported': 0}
+
+            def on_vehicle():
+                state['done'] += 1
+                progress = min(99, state['done'] * 100 // total)
+                if progress - state['reported'] >= PROGRESS_STEP:
+                    state['reported'] = progress
+                    _set_progress(report_id, progress)
+
+            report.calculate_report(on_vehicle=on_vehicle)
+        else:
+            report.calculate_report()
+    except Exception as e:
+        now = timezone.now()
+        Report.objects.filter(pk=report_id).update(
+            status=Report.FAILED, error=str(e), updated_at=now, finished_at=now
+        )
+        raise
+
+    now = timezone.now()
+    Report.objects.filter(pk=report_id).update(
+        result=report.result, rollup_fingerprint=fingerprint, status=Report.DONE, progress=100,
+        updated_at=now, finished_at=now,
+    )
+
+
+def requeue_stale_reports(older_than) -> int:
+    """Возвращает в очередь отчёты, «зависшие» в running (процесс, который их считал, умер)."""
+    return Report.objects.filter(status=Report.RUNNING, updated_at__lt=older_than).update(
+        status=Report.PENDING, updated_at=timezone.now()
+    )
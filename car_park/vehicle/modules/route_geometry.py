@@ -0,0 +1,110 @@
+"""
+Геометрия поездки для карты: линия трека собирается и упрощается в PostGIS
+(ST_MakeLine + ST_SimplifyPreserveTopology), там же считаются рамка и центр.
+В Python приходит одна строка — размер ответа не зависит от числа точек.
+"""
+import json
+
+from django.db import connection
+
+# Сторона тайла веб-карты в пикселях и допуск упрощения в пикселях экрана
+TILE_SIZE = 256
+PIXEL_TOLERANCE = 1.0
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+
+# Ширина карты на странице машины: без zoom допуск подбирается так,
+# чтобы весь трек помещался в столько пикселей
+MAP_WIDTH_PX = 600
+
+# tolerance в градусах; NULL — считать от размеров трека (наибольшая сторона / pixels)
+ROUTE_GEOMETRY_SQL = """
+    WITH pts AS (
+        SELECT p.location, p."timestamp"
+        FROM vehicle_vehiclegpspoint p
+        WHERE p.vehicle_id = %(vehicle_id)s
+          AND p."timestamp" >= %(start_time)s
+          AND p."timestamp" <= %(end_time)s
+    ), track AS (
+        SELECT ST_MakeLine(location ORDER BY "timestamp") AS line,
+               ST_Extent(location) AS box,
+               ST_Centroid(ST_Collect(location)) AS center,
+               COUNT(*) AS points_count
+        FROM pts
+    ), simple AS (
+        SELECT track.*,
+               COALESCE(
+                   %(tolerance)s::double precision,
+                   GREATEST(ST_XMax(box) - ST_XMin(box), ST_YMax(box) - ST_YMin(box)) / %(pixels)s
+               ) AS tolerance
+        FROM track
+    )
+    SELECT points_count,
+           tolerance,
+           CASE WHEN points_count > 1
+                THEN ST_AsGeoJSON(ST_SimplifyPreserveTopology(line, tolerance), %(precision)s)
+           END,
+           ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box),
+           ST_X(center), ST_Y(center)
+    FROM simple
+"""
+
+# Знаков после запятой в координатах ответа (~10 см)
+PRECISION = 6
+
+
+def tolerance_for_zoom(zoom: int) -> float:
+    """Допуск упрощения (градусы) для уровня масштаба: PIXEL_TOLERANCE пикселей на этом zoom."""
+    return 360.0 / (TILE_SIZE * 2 ** zoom) * PIXEL_TOLERANCE
+
+
+def route_geometry(route, zoom=None, pixels=MAP_WIDTH_PX):
+    """
+    Упрощённая линия поездки: {"points_count", "tolerance", "coordinates": [[lon, lat], ...],
+    "bbox": [min_lon, min_lat, max_lon, max_lat], "center": [lon, lat]}.
+    zoom — уровень масштаба карты; без него допуск считается по размеру трека и ширине карты pixels.
+    Для поездки без точек — None.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(ROUTE_GEOMETRY_SQL, {
+            'vehicle_id': route.vehicle_id,
+            'start_time': route.start_time,
+            'end_time': route.end_time,
+            'tolerance': None if zoom is None else tolerance_for_zoom(zoom),
+            'pixels': pixels,
+            'precision': PRECISION,
+        })
+        (points_count, tolerance, geojson,
+         min_lon, min_lat, max_lon, max_lat, center_lon, center_lat) = cursor.fetchone()
+
+    if not points_count:
+        return None
+    center = [center_lon, center_lat]
+    # Из одной точки линия не строится — отдаём её саму
+    coordinates = json.loads(geojson)['coordinates'] if geojson else [center]
+    return {
+        "points_count": points_count,
+        "tolerance": tolerance,
+        "coordinates": coordinates,
+        "bbox": [min_lon, min_lat, max_lon, max_lat],
+        "center": center,
+    }
+
+
+def as_feature(route, geometry):
+    """GeoJSON Feature для API."""
+    return {
+        "type": "Feature",
+        "id": route.id,
+        "bbox": geometry["bbox"],
+        "geometry": {"type": "LineString", "coordinates": geometry["coordinates"]},
+        "properties": {
+            "route_id": route.id,
+            "start_time": route.start_time.isoformat(),
+            "end_time": route.end_time.isoformat(),
+            "center": geometry["center"],
+            "points_count": geometry["points_count"],
+            "vertices": len(geometry["coordinates"]),
+            "tolerance": geometry["tolerance"],
+        },
+    }
@@ -0,0 +1,80 @@
+"""
+Готовые HTML-карты поездок (folium) в отдельном кэше Django (CACHES['route_maps']).
+Ключ — id поездки, её границы и «версия» точек в окне поездки (число точек + последняя метка),
+поэтому дописанные/удалённые точки сами делают старую запись недостижимой.
+"""
+import folium
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max
+
+from ..models import VehicleGPSPoint
+from . import route_geometry
+
+CACHE_PREFIX = 'route-map'
+CACHE_ALIAS = 'route_maps'
+
+
+def points_version(route):
+    """
+    (число точек, метка последней) в окне поездки — дешёвый агрегат по индексу (vehicle, timestamp),
+    без чтения самих точек.
+    """
+    stamp = VehicleGPSPoint.objects.filter(
+        vehicle_id=route.vehicle_id,
+        timestamp__gte=route.start_time,
+        timestamp__lte=route.end_time,
+    ).aggregate(count=Count('timestamp'), last=Max('timestamp'))
+    return stamp['count'], stamp['last']
+
+
+def cache_key(route, version):
+    count, last = version
+    return (f'{CACHE_PREFIX}:{route.id}:{route.start_time.timestamp():.0f}:{route.end_time.timestamp():.0f}'
+            f':{count}:{last.timestamp() if last else 0:.6f}')
+
+
+def render_map(route):
+    """HTML карты (iframe folium) с упрощённым треком поездки или None, если точек нет."""
+    geometry = route_geometry.route_geometry(route)
+    if geometry is None:
+        return None
+
+    # 1) Центр карты и рамка трека
+    center_lon, center_lat = geometry["center"]
+    min_lon, min_lat, max_lon, max_lat = geometry["bbox"]
+
+    # 2) Создадим Folium map
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=8, width='600px', height='380px')
+    m.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
+
+    # 3) Соберём координаты в формате [[lat, lon], [lat, lon], ...]
+    coords = [[lat, lon] for lon, lat in geometry["coordinates"]]
+
+    # 4) Добавим линию
+    folium.PolyLine(coords, color='blue', weight=4, opacity=0.7).add_to(m)
+
+    # 5) Добавим маркеры начала/конца (упрощение концы линии не трогает)
+    folium.Marker(coords[0], tooltip="Начало маршрута").add_to(m)
+    folium.Marker(coords[-1], tooltip="Конец маршрута").add_to(m)
+
+    # 6) Получаем HTML
+    return m._repr_html_()  # Folium генерирует iframe HTML
+
+
+def route_map_html(route):
+    """
+    HTML карты поездки из кэша; при промахе карта строится и кладётся в кэш.
+    None — в окне поездки нет точек (такое не кэшируется).
+    """
+    version = points_version(route)
+    if not version[0]:
+        return None
+    key = cache_key(route, version)
+    cache = caches[CACHE_ALIAS]
+    map_html = cache.get(key)
+    if map_html is None:
+        map_html = render_map(route)
+        if map_html is not None:
+            cache.set(key, map_html, settings.ROUTE_MAP_CACHE_TIMEOUT)
+    return map_html
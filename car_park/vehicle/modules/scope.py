@@ -0,0 +1,89 @@
+"""
+Область доступа менеджера: id менеджера и множество id его предприятий.
+Загружается один раз на запрос, между запросами лежит в кэше Django по id пользователя
+и сбрасывается сигналами (vehicle/signals.py), когда меняются Manager или Manager.enterprises.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+
+from ..models import Manager, Enterprise
+
+CACHE_PREFIX = 'manager-scope'
+
+
+class ManagerScope:
+    def __init__(self, manager_id, enterprise_ids):
+        self.manager_id = manager_id
+        self.enterprise_ids = frozenset(enterprise_ids)
+
+    def allows(self, enterprise) -> bool:
+        """Доступно ли предприятие (объект или id) — проверка по множеству, без запроса."""
+        if enterprise is None:
+            return False
+        return getattr(enterprise, 'pk', enterprise) in self.enterprise_ids
+
+    def get_enterprise(self, pk):
+        """Предприятие менеджера по pk; чужое, несуществующее или некорректный pk — 404."""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise Http404
+        if pk not in self.enterprise_ids:
+            raise Http404
+        return get_object_or_404(Enterprise, pk=pk)
+
+    def enterprises(self):
+        return Enterprise.objects.filter(pk__in=self.enterprise_ids)
+
+
+def cache_key(user_id):
+    return f'{CACHE_PREFIX}:{user_id}'
+
+
+def _load(user_id):
+    manager_id = Manager.objects.filter(user_id=user_id).values_list('pk', flat=True).first()
+    if manager_id is None:
+        return None, ()
+    enterprise_ids = Manager.enterprises.through.objects.filter(
+        manager_id=manager_id
+    ).values_list('enterprise_id', flat=True)
+    return manager_id, tuple(enterprise_ids)
+
+
+def get_manager_scope(request) -> ManagerScope:
+    """
+    Область доступа текущего пользователя; у пользователя без профиля менеджера — 404
+    (как прежний get_object_or_404(Manager, user=...)).
+    """
+    scope = getattr(request, '_manager_scope', None)
+    if scope is None:
+        key = cache_key(request.user.pk)
+        cached = cache.get(key)
+        if cached is None:
+            cached = _load(request.user.pk)
+            cache.set(key, cached, settings.MANAGER_SCOPE_CACHE_TIMEOUT)
+        manager_id, enterprise_ids = cached
+        if manager_id is None:
+            raise Http404("Manager not found.")
+        scope = ManagerScope(manager_id, enterprise_ids)
+        request._manager_scope = scope
+    return scope
+
+
+def invalidate(user_ids):
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
+
+
+def invalidate_managers(manager_ids):
+    invalidate(Manager.objects.filter(pk__in=manager_ids).values_list('user_id', flat=True))
+
+
+class ManagerScopeMixin:
+    """Для DRF-представлений: self.scope — область доступа менеджера текущего запроса."""
+
+    @cached_property
+    def scope(self) -> ManagerScope:
+        return get_manager_scope(self.request)
@@ -0,0 +1,43 @@
+from django.db import connection
+
+FETCH_SIZE = 2000
+# Отдаём клиенту куски примерно такого размера, а не по байту на точку
+FLUSH_SIZE = 64 * 1024
+
+
+def iter_rows(sql: str, params=None, fetch_size: int = FETCH_SIZE):
+    """
+    Выполняет запрос через серверный курсор (как QuerySet.iterator())
+    и отдаёт строки по одной, не держа весь результат в памяти.
+    """
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def isoformat(dt) -> str:
+    """Как DateTimeField в DRF: UTC записывается с суффиксом Z."""
+    value = dt.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def buffered(chunks, flush_size: int = FLUSH_SIZE):
+    """Склеивает мелкие строки в байтовые куски ~flush_size для StreamingHttpResponse."""
+    buf, size = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= flush_size:
+            yield ''.join(buf).encode('utf-8')
+            buf, size = [], 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
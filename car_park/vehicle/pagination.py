@@ -1,5 +1,139 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'page_size'  # Позволяет задавать размер страницы через параметр запроса
     max_page_size = 50  # Максимальный размер страницы
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничная выдача по ключу (keyset): следующая страница — строки с ключом больше последнего
+    на текущей, WHERE a >= .. AND (a > .. OR a = .. AND b > ..) вместо OFFSET, без COUNT(*).
+    Скорость не зависит от глубины.
+    Курсор непрозрачный: base64 от значений ключа последней строки.
+    Включается параметром ?pagination=keyset (дальше клиент просто идёт по ссылке next).
+    """
+    ordering = ('id',)  # уникальный в сумме набор полей, по возрастанию
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000  # выше, чем у постраничной выдачи: для клиентов, выкачивающих историю
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    mode = 'keyset'
+
+    @classmethod
+    def requested(cls, request):
+        params = request.query_params
+        return params.get(cls.mode_query_param) == cls.mode or cls.cursor_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _fields(self, queryset):
+        return [queryset.model._meta.get_field(name) for name in self.ordering]
+
+    def encode_cursor(self, fields, obj):
+        values = [field.value_to_string(obj) for field in fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, fields, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except Exception:
+            raise NotFound("Invalid cursor.")
+
+    def _after(self, values):
+        """
+        (f1, f2, ...) > (v1, v2, ...) в виде OR-цепочки. Саму цепочку PostgreSQL в диапазон индекса
+        не превращает, поэтому к ней добавлено избыточное f1 >= v1: по нему и идёт Index Cond.
+        """
+        first_name = self.ordering[0]
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            step = Q(**{f'{name}__gt': values[i]})
+            for prev_name, prev_value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        if len(self.ordering) > 1:
+            condition = Q(**{f'{first_name}__gte': values[0]}) & condition
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        fields = self._fields(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(fields, cursor)))
+
+        # Одна лишняя строка — признак следующей страницы
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(fields, page[-1])
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, self.mode)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class GPSPointKeysetPagination(KeysetPagination):
+    # Только для точек одной машины (view требует vehicle_id): timestamp уникален внутри машины
+    # (gps_vehicle_ts_uniq), и страница — диапазон этого индекса (vehicle, timestamp) без сортировки.
+    # По всем машинам менеджера подходящего btree-индекса нет — пришлось бы сортировать все точки.
+    ordering = ('timestamp',)
+    max_page_size = 10000
+
+
+class KeysetPaginationMixin:
+    """
+    Для generic-представлений: при ?pagination=keyset (или с cursor) вместо обычной
+    постраничной выдачи используется keyset_pagination_class.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.keyset_pagination_class.requested(self.request):
+                self._paginator = self.keyset_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
@@ -0,0 +1,18 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Нужен, чтобы DRF принимал ?format=ndjson при согласовании формата.
+    Сами выгрузки отдаются потоком мимо рендерера; сюда попадают только ответы с ошибками.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(data, ensure_ascii=False) + '\n').encode(self.charset)
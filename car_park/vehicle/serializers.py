@@ -1,7 +1,9 @@
 # serializers.py
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.urls import reverse
 from rest_framework import serializers
-from .models import VehicleDriverAssignment, Vehicle, Driver, Enterprise, VehicleGPSPoint, Route
-from .modules.ors import reverse_geocode_ors
+from .models import VehicleDriverAssignment, Vehicle, Driver, Enterprise, VehicleGPSPoint, Route, ExportJob
+from .modules import geocoding
 
 
 class VehicleSerializer(serializers.ModelSerializer):
@@ -27,11 +29,26 @@ class VehicleSerializer(serializers.ModelSerializer):
             'purchase_datetime_local',  # Конвертированная в tz предприятия
         ]
 
+    @staticmethod
+    def setup_queryset(queryset):
+        """
+        Всё, что нужно сериализатору, одним запросом на страницу (+1 на водителей):
+        id активного водителя — подзапросом, предприятие (для таймзоны) — JOIN-ом.
+        """
+        active_driver = VehicleDriverAssignment.objects.filter(
+            vehicle=OuterRef('pk'), is_active=True
+        ).order_by('pk').values('driver_id')[:1]
+        return queryset.select_related('enterprise').prefetch_related(
+            Prefetch('drivers', queryset=Driver.objects.only('id'))
+        ).annotate(active_driver_pk=Subquery(active_driver)).order_by('id')
+
     def get_active_driver_id(self, obj):
-        assignment = VehicleDriverAssignment.objects.filter(vehicle=obj, is_active=True).first()
-        if assignment:
-            return assignment.driver.id
-        return None
+        if hasattr(obj, 'active_driver_pk'):
+            return obj.active_driver_pk
+        # Объект получен без setup_queryset (вложенные сериализаторы, только что созданная машина)
+        return VehicleDriverAssignment.objects.filter(
+            vehicle=obj, is_active=True
+        ).order_by('pk').values_list('driver_id', flat=True).first()
 
     def get_purchase_datetime_local(self, obj):
         # берем tzinfo из enterprise
@@ -51,26 +68,83 @@ class EnterpriseSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class DriverSerializer(serializers.ModelSerializer):
-    vehicles = VehicleSerializer(many=True, read_only=True)
+class ExpandableFieldsMixin:
+    """
+    Связанные объекты по умолчанию отдаются id-шниками; вложенное представление —
+    только по запросу: ?expand=vehicles или ?expand=vehicle,driver.
+    expandable_fields = {имя поля: класс вложенного сериализатора}.
+    Вложенные сериализаторы сами ничего не раскрывают, поэтому глубина ограничена одним уровнем.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if expand is None:
+            expand = self.get_expand(self.context.get('request'))
+        for name in expand:
+            if name in self.expandable_fields:
+                serializer_class = self.expandable_fields[name]
+                nested_kwargs = {'expand': ()} if issubclass(serializer_class, ExpandableFieldsMixin) else {}
+                self.fields[name] = serializer_class(
+                    many=isinstance(self.fields[name], serializers.ManyRelatedField),
+                    read_only=True,
+                    **nested_kwargs,
+                )
+
+    @classmethod
+    def get_expand(cls, request):
+        """Имена раскрываемых полей из ?expand= (неизвестные игнорируются)."""
+        if request is None:
+            return ()
+        names = request.query_params.get('expand', '')
+        return tuple(name for name in (n.strip() for n in names.split(',')) if name in cls.expandable_fields)
+
+
+class DriverSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    vehicles = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    expandable_fields = {
+        'vehicles': VehicleSerializer,
+    }
 
     class Meta:
         model = Driver
         fields = ['id', 'name', 'salary', 'enterprise', 'vehicles']
 
-    def get_vehicles(self, obj):
-        assignments = VehicleDriverAssignment.objects.filter(driver=obj)
-        return VehicleDriverAssignmentSerializer(assignments, many=True).data
+    @classmethod
+    def setup_queryset(cls, queryset, expand=()):
+        """Водители и их машины фиксированным числом запросов (раскрытые машины — через VehicleSerializer)."""
+        if 'vehicles' in expand:
+            vehicles = VehicleSerializer.setup_queryset(Vehicle.objects.all())
+        else:
+            vehicles = Vehicle.objects.only('id').order_by('id')
+        return queryset.prefetch_related(Prefetch('vehicles', queryset=vehicles)).order_by('id')
 
 
-class VehicleDriverAssignmentSerializer(serializers.ModelSerializer):
-    vehicle = VehicleSerializer()
-    driver = DriverSerializer()
+class VehicleDriverAssignmentSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'vehicle': VehicleSerializer,
+        'driver': DriverSerializer,
+    }
 
     class Meta:
         model = VehicleDriverAssignment
         fields = ['id', 'vehicle', 'driver', 'is_active']
 
+    @classmethod
+    def setup_queryset(cls, queryset, expand=()):
+        """Назначения с раскрытыми по запросу машиной и водителем — без запросов на каждую строку."""
+        if 'vehicle' in expand:
+            queryset = queryset.prefetch_related(
+                Prefetch('vehicle', queryset=VehicleSerializer.setup_queryset(Vehicle.objects.all()))
+            )
+        if 'driver' in expand:
+            # Вложенный водитель отдаёт свои машины id-шниками
+            queryset = queryset.prefetch_related(
+                Prefetch('driver', queryset=DriverSerializer.setup_queryset(Driver.objects.all()))
+            )
+        return queryset.order_by('id')
+
 
 class VehicleGPSPointSerializer(serializers.ModelSerializer):
     # Координаты как список [lng, lat] или [lat, lng] - на ваше усмотрение
@@ -147,25 +221,52 @@ class RouteSerializer(serializers.ModelSerializer):
             'end_address'
         ]
 
-    def get_start_address(self, obj):
+    def _address(self, stored, point):
+        # Адрес сохраняется в поездке после её создания; геокодируем только ещё не заполненные
+        if stored is not None or not point:
+            return stored
         request = self.context.get('request')
-        if not obj.start_location:
-            return None
         # Если в URL ?geocode=true, тогда делаем геокодирование
         geocode = request.query_params.get('geocode') if request else None
-        if geocode == 'true':
-            api_key = self.context.get('ors_api_key')  # Передадим в view
-            return reverse_geocode_ors(api_key, obj.start_location.y, obj.start_location.x)
-        return None
+        if geocode != 'true':
+            return None
+        # View заранее получает адреса для всей выборки пачкой (geocoding.reverse_geocode_many);
+        # по одной точке провайдер при сериализации не вызывается
+        addresses = self.context.get('addresses') or {}
+        return addresses.get(geocoding.cache_key(point.y, point.x))
+
+    def get_start_address(self, obj):
+        return self._address(obj.start_address, obj.start_location)
 
     def get_end_address(self, obj):
-        request = self.context.get('request')
-        if not obj.end_location:
-            return None
-        geocode = request.query_params.get('geocode') if request else None
-        if geocode == 'true':
-            api_key = self.context.get('ors_api_key')  # Передадим в view
-            return reverse_geocode_ors(api_key, obj.end_location.y, obj.end_location.x)
-        return None
+        return self._address(obj.end_address, obj.end_location)
+
+
+
 
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = [
+            'id',
+            'enterprise',
+            'start_time',
+            'end_time',
+            'format',
+            'status',
+            'progress',
+            'error',
+            'size',
+            'created_at',
+            'finished_at',
+            'download_url',
+        ]
 
+    def get_download_url(self, obj):
+        if obj.status != ExportJob.DONE:
+            return None
+        url = reverse('export-job-download', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -9,3 +9,50 @@
 # def create_manager_profile(sender, instance, created, **kwargs):
 #     if created:
 #         Manager.objects.create(user=instance)
+
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Route, Manager, Enterprise
+from .modules import geocoding, scope
+
+
+@receiver(post_save, sender=Route)
+def resolve_route_addresses(sender, instance, created, **kwargs):
+    """Адреса начала/конца новой поездки определяются в фоне после коммита."""
+    if created and (instance.start_location or instance.end_location):
+        geocoding.schedule_route_addresses([instance.pk])
+
+
+def _invalidate_scope(user_ids):
+    # Сразу — для текущего процесса, и после коммита — чтобы параллельный запрос
+    # не успел закэшировать ещё не закоммиченное старое состояние
+    user_ids = list(user_ids)
+    scope.invalidate(user_ids)
+    transaction.on_commit(lambda: scope.invalidate(user_ids))
+
+
+@receiver(post_save, sender=Manager)
+@receiver(post_delete, sender=Manager)
+def reset_manager_scope(sender, instance, **kwargs):
+    _invalidate_scope([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Manager.enterprises.through)
+def reset_manager_scope_on_enterprises(sender, instance, action, reverse, pk_set, **kwargs):
+    """Состав предприятий менеджера поменялся — с любой стороны связи."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _invalidate_scope([instance.user_id])
+    elif action in ('post_add', 'post_remove'):
+        _invalidate_scope(Manager.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+    elif action == 'pre_clear':
+        _invalidate_scope(instance.managers.values_list('user_id', flat=True))
+
+
+@receiver(pre_delete, sender=Enterprise)
+def reset_scope_on_enterprise_delete(sender, instance, **kwargs):
+    # Строки связи удаляются каскадом, без m2m_changed
+    _invalidate_scope(instance.managers.values_list('user_id', flat=True))
@@ -1,3 +1,432 @@
-from django.test import TestCase
+import io
+import math
+import zoneinfo
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .models import Brand, Model, Configuration, Enterprise, Driver, Vehicle, VehicleDriverAssignment, Manager, \
+    VehicleMileageReport, EnterpriseMileageReport
+from .modules import downloads, gps_columnar, gps_ingest, gps_math, mileage
+
+MOSCOW = zoneinfo.ZoneInfo('Europe/Moscow')
+
+
+class FleetTestCase(TestCase):
+    """
+    30 машин одного предприятия, у каждой активный водитель и сменщик.
+    Запросы считаются при уже закэшированной области доступа менеджера (modules/scope.py).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='manager', password='secret')
+        manager = Manager.objects.create(user=user)
+        enterprise = Enterprise.objects.create(name='Парк', city='Москва', local_timezone='Europe/Moscow')
+        manager.enterprises.add(enterprise)
+
+        brand = Brand.objects.create(name='Лада', country='Россия')
+        model = Model.objects.create(name='Веста', brand=brand, vehicle_type='Passenger')
+        configuration = Configuration.objects.create(model=model, name='Базовая', tank_capacity=Decimal('50.0'),
+                                                     payload=400, seats_number=5)
+
+        for i in range(30):
+            vehicle = Vehicle.objects.create(vin=f'VIN{i:014d}', price=Decimal('1000000.00'), release_year=2020,
+                                             mileage=1000 * i, color='Белый', configuration=configuration,
+                                             enterprise=enterprise)
+            active = Driver.objects.create(name=f'Водитель {i}', salary=Decimal('50000.00'), enterprise=enterprise)
+            spare = Driver.objects.create(name=f'Сменщик {i}', salary=Decimal('40000.00'), enterprise=enterprise)
+            VehicleDriverAssignment.objects.create(vehicle=vehicle, driver=active, is_active=True)
+            VehicleDriverAssignment.objects.create(vehicle=vehicle, driver=spare, is_active=False)
+        cls.user = user
+        cls.manager = manager
+        cls.enterprise = enterprise
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Первый запрос загружает область доступа в кэш
+        self.client.get(reverse('enterprise-list-create'))
+
+
+class VehicleListQueryCountTest(FleetTestCase):
+    """Список машин не должен делать запросы на каждую строку (активный водитель, таймзона, водители)."""
+
+    # count + страница машин + водители страницы
+    EXPECTED_QUERIES = 3
+
+    def _get_page(self, page_size, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('vehicle-list-create'), {'page_size': page_size, **params})
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        _, small = self._get_page(2)
+        _, large = self._get_page(25)
+        self.assertEqual(small, large)
+        self.assertEqual(large, self.EXPECTED_QUERIES)
+
+    def test_active_only_uses_annotation(self):
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get(reverse('vehicle-list-create'), {'page_size': 25, 'active_only': 'true'})
+        self.assertEqual(response.data['count'], 30)
+
+    def test_rows_keep_driver_fields(self):
+        response, _ = self._get_page(25)
+        row = response.data['results'][0]
+        vehicle = Vehicle.objects.order_by('id').first()
+        active = VehicleDriverAssignment.objects.get(vehicle=vehicle, is_active=True)
+        self.assertEqual(row['active_driver_id'], active.driver_id)
+        self.assertCountEqual(row['drivers'], list(vehicle.drivers.values_list('id', flat=True)))
+        self.assertTrue(row['purchase_datetime_local'].endswith('+03:00'))
+
+
+class VehicleKeysetPaginationTest(FleetTestCase):
+    """?pagination=keyset: страницы по id без COUNT(*), обход по ссылкам next."""
+
+    def test_walk_all_pages(self):
+        url, params, seen = reverse('vehicle-list-create'), {'pagination': 'keyset', 'page_size': 7}, []
+        while url:
+            # страница + водители страницы
+            with self.assertNumQueries(2):
+                response = self.client.get(url, params)
+            self.assertNotIn('count', response.data)
+            seen += [row['id'] for row in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(seen, list(Vehicle.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('vehicle-list-create'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_gps_points_require_vehicle(self):
+        # Ключ точек — timestamp, уникальный только внутри машины
+        response = self.client.get(reverse('gps-points-list'), {'pagination': 'keyset'})
+        self.assertEqual(response.status_code, 400)
+        vehicle = Vehicle.objects.order_by('id').first()
+        response = self.client.get(reverse('gps-point-list-specific', kwargs={'vehicle_id': vehicle.pk}),
+                                   {'pagination': 'keyset'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertIsNone(response.data['next'])
+
+
+class ExpandQueryCountTest(FleetTestCase):
+    """Водители и активные назначения: связанные объекты id-шниками, ?expand= — без запросов на строку."""
+
+    def test_drivers_flat(self):
+        # count + страница + машины водителей
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('driver-list-create'))
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIsInstance(response.data['results'][0]['vehicles'][0], int)
+
+    def test_drivers_expanded(self):
+        # + водители раскрытых машин
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('driver-list-create'), {'expand': 'vehicles'})
+        vehicle = response.data['results'][0]['vehicles'][0]
+        self.assertIn('active_driver_id', vehicle)
+
+    def test_active_assignments_flat(self):
+        # count + страница
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('active-vehicles'))
+        row = response.data['results'][0]
+        self.assertIsInstance(row['vehicle'], int)
+        self.assertIsInstance(row['driver'], int)
+
+    def test_active_assignments_expanded(self):
+        # + машины, их водители, водители назначений, их машины
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('active-vehicles'), {'expand': 'vehicle,driver'})
+        row = response.data['results'][0]
+        self.assertEqual(row['vehicle']['active_driver_id'], row['driver']['id'])
+        # Вложенный водитель дальше не раскрывается
+        self.assertEqual(row['driver']['vehicles'], [row['vehicle']['id']])
+
+
+class ManagerScopeTest(FleetTestCase):
+    """Область доступа берётся из кэша и сбрасывается при изменении Manager.enterprises."""
+
+    def test_scope_is_cached(self):
+        # Только сама выборка предприятий, без Manager и связи manager-enterprise
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('enterprise-detail', kwargs={'pk': self.enterprise.pk}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_removed_enterprise_is_not_visible(self):
+        self.manager.enterprises.remove(self.enterprise)
+        response = self.client.get(reverse('vehicle-list-create'))
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get(reverse('enterprise-detail', kwargs={'pk': self.enterprise.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_added_enterprise_from_reverse_side(self):
+        other = Enterprise.objects.create(name='Второй парк', city='Казань')
+        other.managers.add(self.manager)
+        response = self.client.get(reverse('enterprise-detail', kwargs={'pk': other.pk}))
+        self.assertEqual(response.status_code, 200)
+
+
+class MileageEnginesParityTest(TestCase):
+    """
+    Один и тот же трек через границу локальных суток: rollup, sql и python (и отчёт по парку) дают
+    одинаковый пробег, в том числе когда трек начинается до диапазона отчёта.
+    Трек пишется двумя пачками, вторая вклинивается между точками первой (приращение суточных итогов).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        enterprise = Enterprise.objects.create(name='Парк', city='Москва', local_timezone='Europe/Moscow')
+        brand = Brand.objects.create(name='Лада', country='Россия')
+        model = Model.objects.create(name='Веста', brand=brand, vehicle_type='Passenger')
+        configuration = Configuration.objects.create(model=model, name='Базовая', tank_capacity=Decimal('50.0'),
+                                                     payload=400, seats_number=5)
+        cls.vehicle = Vehicle.objects.create(vin='VIN00000000000001', price=Decimal('1000000.00'),
+                                             release_year=2020, mileage=0, color='Белый',
+                                             configuration=configuration, enterprise=enterprise)
+
+    def _track(self, start=datetime(2025, 1, 1, 20, 0, tzinfo=dt_timezone.utc), count=24):
+        # По умолчанию 20:00 UTC 1 января = 23:00 по Москве; шаг 10 минут, трек заходит во 2 января
+        return [
+            (self.vehicle.pk, start + timedelta(minutes=10 * i), 37.60 + 0.01 * i, 55.75 + 0.005 * (i % 3))
+            for i in range(count)
+        ]
+
+    def _results(self, period, start_date=date(2025, 1, 1), end_date=date(2025, 1, 2)):
+        """Результаты отчёта за диапазон всеми движками — так же, как их считают отчёты."""
+        results = {}
+        for engine in mileage.ENGINES:
+            report = VehicleMileageReport(name='Пробег', vehicle=self.vehicle, start_date=start_date,
+                                          end_date=end_date, period=period)
+            report.calculate_report(engine=engine)
+            results[engine] = report.result
+        # Отчёт по парку из одной машины; python-движок парка запускает процессы — не в тестах
+        for engine in mileage.FLEET_WEB_ENGINES:
+            report = EnterpriseMileageReport.objects.create(
+                name='Пробег парка', enterprise=self.vehicle.enterprise, start_date=start_date,
+                end_date=end_date, period=period, engine=engine,
+            )
+            report.calculate_report()
+            results[f'fleet_{engine}'] = report.result
+        return results
+
+    def assertParity(self, period, keys, start_date=date(2025, 1, 1), end_date=date(2025, 1, 2)):
+        results = self._results(period, start_date, end_date)
+        for engine, rows in results.items():
+            self.assertEqual([row['date'] for row in rows], keys, engine)
+        for engine, rows in results.items():
+            for expected, actual in zip(results[mileage.ENGINE_PYTHON], rows):
+                # ST_DistanceSphere и haversine берут немного разные радиусы Земли
+                self.assertAlmostEqual(expected['mileage'], actual['mileage'], places=3, msg=engine)
+        return results
+
+    @staticmethod
+    def _distance_after(track, since):
+        """Сумма отрезков трека, конечная точка которых не раньше since (правило всех движков)."""
+        dist = gps_math.segment_distances([row[2] for row in track], [row[3] for row in track])
+        return sum(d for d, row in zip(dist, track[1:]) if row[1] >= since)
+
+    def test_engines_agree(self):
+        track = self._track()
+        gps_ingest.copy_gps_points(track[::2])
+        gps_ingest.copy_gps_points(track[1::2])
+        expected = sum(gps_math.segment_distances([row[2] for row in track], [row[3] for row in track]))
+
+        self.assertParity('day', ['2025-01-01', '2025-01-02'])
+        total = self.assertParity('month', ['2025-01'])[mileage.ENGINE_ROLLUP]
+        self.assertAlmostEqual(total[0]['mileage'], expected, places=3)
+
+    def test_track_starts_before_range(self):
+        # 20:00 UTC 31 декабря = 23:00 по Москве: первые точки — до начала диапазона
+        track = self._track(start=datetime(2024, 12, 31, 20, 0, tzinfo=dt_timezone.utc))
+        gps_ingest.copy_gps_points(track)
+        start_utc, _ = gps_math.local_date_bounds(date(2025, 1, 1), date(2025, 1, 2), MOSCOW)
+
+        # Отрезок от последней декабрьской точки к первой январской — в первом дне диапазона у всех движков
+        results = self.assertParity('day', ['2025-01-01'])
+        self.assertAlmostEqual(results[mileage.ENGINE_PYTHON][0]['mileage'],
+                               self._distance_after(track, start_utc), places=6)
+        self.assertParity('month', ['2025-01'])
+
+    def test_track_ends_after_range(self):
+        # 20:00 UTC 2 января = 23:00 по Москве: хвост трека — уже 3 января, за концом диапазона
+        track = self._track(start=datetime(2025, 1, 2, 20, 0, tzinfo=dt_timezone.utc))
+        gps_ingest.copy_gps_points(track)
+        start_utc, end_utc = gps_math.local_date_bounds(date(2025, 1, 1), date(2025, 1, 2), MOSCOW)
+
+        results = self.assertParity('day', ['2025-01-02'])
+        inside = [row for row in track if row[1] < end_utc]
+        self.assertAlmostEqual(results[mileage.ENGINE_PYTHON][0]['mileage'],
+                               self._distance_after(inside, start_utc), places=6)
+        # Сам хвост виден в диапазоне, который его включает
+        self.assertParity('day', ['2025-01-02', '2025-01-03'], end_date=date(2025, 1, 3))
+
+    def test_track_covers_range_from_both_sides(self):
+        # С 23:00 31 декабря до 00:50 3 января по Москве, шаг 10 минут
+        track = self._track(start=datetime(2024, 12, 31, 20, 0, tzinfo=dt_timezone.utc), count=300)
+        gps_ingest.copy_gps_points(track[1::2])
+        gps_ingest.copy_gps_points(track[::2])
+        start_utc, end_utc = gps_math.local_date_bounds(date(2025, 1, 1), date(2025, 1, 2), MOSCOW)
+
+        self.assertParity('day', ['2025-01-01', '2025-01-02'])
+        results = self.assertParity('month', ['2025-01'])
+        inside = [row for row in track if row[1] < end_utc]
+        self.assertAlmostEqual(results[mileage.ENGINE_PYTHON][0]['mileage'],
+                               self._distance_after(inside, start_utc), places=6)
+
+    def test_rebuild_matches_incremental(self):
+        track = self._track()
+        gps_ingest.copy_gps_points(track[::3])
+        gps_ingest.copy_gps_points(track)
+        incremental = mileage.vehicle_mileage_rollup(self.vehicle.pk, date(2025, 1, 1), date(2025, 1, 2), 'day')
+        mileage.rebuild_daily_mileage(self.vehicle.pk)
+        rebuilt = mileage.vehicle_mileage_rollup(self.vehicle.pk, date(2025, 1, 1), date(2025, 1, 2), 'day')
+        self.assertEqual([row['date'] for row in incremental], [row['date'] for row in rebuilt])
+        for a, b in zip(incremental, rebuilt):
+            self.assertAlmostEqual(a['mileage'], b['mileage'], places=6)
+
+
+class GPSIngestParsingTest(SimpleTestCase):
+    """Разбор точек телеметрии: make_row, JSON Lines и бинарный поток."""
+
+    def test_make_row(self):
+        row = gps_ingest.make_row('7', '2025-01-01T12:00:00', '37.5', 55.7)
+        self.assertEqual(row, (7, datetime(2025, 1, 1, 12, tzinfo=dt_timezone.utc), 37.5, 55.7))
+        row = gps_ingest.make_row(7, 0, 0, 0)
+        self.assertEqual(row[1], datetime(1970, 1, 1, tzinfo=dt_timezone.utc))
+
+    def test_make_row_rejects_bad_values(self):
+        for args in [
+            ('x', 0, 0, 0),
+            (1, 0, 181, 0),
+            (1, 0, 0, -91),
+            (1, 0, math.nan, 0),
+            (1, 'not a date', 0, 0),
+            (1, True, 0, 0),
+        ]:
+            with self.subTest(args=args), self.assertRaises(gps_ingest.IngestError):
+                gps_ingest.make_row(*args)
+
+    def test_iter_ndjson(self):
+        lines = [
+            '{"vehicle_id": 1, "timestamp": 60, "lon": 37.6, "lat": 55.7}',
+            '',
+            '{"vehicle_id": 1, "timestamp": 120, "location": [37.7, 55.8]}',
+            '{not json',
+            '{"vehicle_id": 1, "timestamp": 180, "lon": 37.6}',
+        ]
+        result = list(gps_ingest.iter_ndjson(lines))
+        self.assertEqual([lineno for lineno, _, _ in result], [1, 3, 4, 5])
+        self.assertEqual(result[0][1][2:], (37.6, 55.7))
+        self.assertEqual(result[1][1][2:], (37.7, 55.8))
+        self.assertIsNone(result[2][1])
+        self.assertIsNotNone(result[2][2])
+        self.assertIsNone(result[3][1])
+
+    def test_iter_binary(self):
+        data = (gps_ingest.BINARY_RECORD.pack(1, 60.0, 37.6, 55.7)
+                + gps_ingest.BINARY_RECORD.pack(2, 120.0, 200.0, 55.7)
+                + gps_ingest.BINARY_RECORD.pack(3, 180.0, 37.8, 55.9)
+                + b'\x01\x02\x03')
+        # Маленькие куски: записи разрезаются на границах чтения
+        result = list(gps_ingest.iter_binary(io.BytesIO(data), chunk_records=2))
+        self.assertEqual([index for index, _, _ in result], [1, 2, 3, 4])
+        self.assertEqual(result[0][1], (1, datetime(1970, 1, 1, 0, 1, tzinfo=dt_timezone.utc), 37.6, 55.7))
+        self.assertEqual(result[1][2], 'coordinates out of range')
+        self.assertEqual(result[2][1][0], 3)
+        self.assertEqual(result[3], (4, None, 'truncated binary record'))
+
+
+class ParseRangeTest(SimpleTestCase):
+    def test_ranges(self):
+        cases = {
+            'bytes=0-99': (0, 99),
+            'bytes=100-': (100, 999),
+            'bytes=-100': (900, 999),
+            'bytes=-5000': (0, 999),
+            'bytes=900-5000': (900, 999),
+            ' bytes=1-1 ': (1, 1),
+            'bytes=1000-': False,
+            'bytes=-0': False,
+            'bytes=5-1': None,
+            'bytes=-': None,
+            'bytes=0-1,5-6': None,
+            'items=0-1': None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(downloads._parse_range(header, 1000), expected)
+
+
+class GPSMathTest(SimpleTestCase):
+    def test_segment_distances(self):
+        # Градус меридиана и градус экватора
+        dist = gps_math.segment_distances([0, 0, 1], [0, 1, 1])
+        self.assertEqual(len(dist), 2)
+        self.assertAlmostEqual(dist[0], 2 * math.pi * gps_math.EARTH_RADIUS_KM / 360, places=6)
+        self.assertLess(dist[1], dist[0])
+        self.assertEqual(len(gps_math.segment_distances([37.6], [55.7])), 0)
+        self.assertEqual(gps_math.segment_distances([37.6, 37.6], [55.7, 55.7])[0], 0)
+
+    def test_bucket_sums_uses_local_time(self):
+        ts = [
+            datetime(2025, 1, 1, 20, 0, tzinfo=dt_timezone.utc).timestamp(),  # 23:00 по Москве
+            datetime(2025, 1, 1, 22, 0, tzinfo=dt_timezone.utc).timestamp(),  # 01:00 2 января
+            datetime(2025, 1, 3, 12, 0, tzinfo=dt_timezone.utc).timestamp(),
+        ]
+        sums = gps_math.bucket_sums(ts, [1.0, 2.0, 4.0], 'day', MOSCOW)
+        # В UTC первые две точки попали бы в один день
+        self.assertEqual(sums, {'2025-01-01': 1.0, '2025-01-02': 2.0, '2025-01-03': 4.0})
+        self.assertEqual(gps_math.bucket_sums(ts, [1.0, 2.0, 4.0], 'month', MOSCOW), {'2025-01': 7.0})
+        # 31 декабря 22:00 UTC — уже новый год по Москве
+        new_year = datetime(2024, 12, 31, 22, 0, tzinfo=dt_timezone.utc).timestamp()
+        self.assertEqual(gps_math.bucket_sums([new_year], [1.0], 'year', MOSCOW), {'2025': 1.0})
+        self.assertEqual(gps_math.bucket_sums([], [], 'day', MOSCOW), {})
+
+    def test_bucket_sums_skips_empty_periods(self):
+        ts = [
+            datetime(2025, 1, 1, 12, tzinfo=dt_timezone.utc).timestamp(),
+            datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc).timestamp(),
+        ]
+        self.assertEqual(gps_math.bucket_sums(ts, [1.0, 1.0], 'month', MOSCOW), {'2025-01': 1.0, '2025-03': 1.0})
+
+    def test_bucket_sums_unordered(self):
+        ts = [
+            datetime(2025, 1, 3, 12, tzinfo=dt_timezone.utc).timestamp(),
+            datetime(2025, 1, 1, 12, tzinfo=dt_timezone.utc).timestamp(),
+            datetime(2025, 1, 3, 13, tzinfo=dt_timezone.utc).timestamp(),
+        ]
+        self.assertEqual(gps_math.bucket_sums(ts, [1.0, 2.0, 4.0], 'day', MOSCOW),
+                         {'2025-01-01': 2.0, '2025-01-03': 5.0})
+
+    def test_local_date_bounds(self):
+        start, end = gps_math.local_date_bounds(date(2025, 1, 1), date(2025, 1, 31), MOSCOW)
+        self.assertEqual(start, datetime(2024, 12, 31, 21, tzinfo=dt_timezone.utc))
+        self.assertEqual(end, datetime(2025, 1, 31, 21, tzinfo=dt_timezone.utc))
+
+
+class GPSColumnarEncodingTest(SimpleTestCase):
+    def test_encode_varints(self):
+        self.assertEqual(gps_columnar.encode_varints([]), '')
+        self.assertEqual(gps_columnar.encode_varints([0, -1, 1, 16]), '?@A_@')
+        # Самое длинное значение — 13 групп
+        encoded = gps_columnar.encode_varints([-2 ** 63])
+        self.assertEqual(len(encoded), 13)
+
+    def test_encode_polyline(self):
+        # Пример из описания формата Google (точность 1e-5)
+        lon = [-120.2, -120.95, -126.453]
+        lat = [38.5, 40.7, 43.252]
+        self.assertEqual(gps_columnar.encode_polyline(lon, lat, precision=5), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(gps_columnar.encode_polyline([], []), '')
@@ -17,9 +17,12 @@ from .views import (
     vehicle_add_view,
     vehicle_edit_view,
     vehicle_delete_view,
-    VehicleGPSPointListView, VehiclePointsByRoutesView, RouteListView, vehicle_detail_view, vehicle_map_view,
+    VehicleGPSPointListView, GPSPointIngestView, VehiclePointsByRoutesView, RouteListView, RouteGeometryAPIView,
+    vehicle_detail_view, vehicle_map_view,
     ExportEnterpriseListView, ImportEnterpriseDataJSONView, ImportEnterpriseDataCSVView, report_list_view,
-    create_mileage_report_view, report_detail_view, MileageReportAPIView, upload_trip_view,
+    create_mileage_report_view, report_detail_view, MileageReportAPIView, EnterpriseMileageReportAPIView,
+    upload_trip_view,
+    ExportJobListCreateView, ExportJobDetailView, ExportJobDownloadView,
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -57,15 +60,20 @@ urlpatterns = [
 
     path('api/gps-points/', VehicleGPSPointListView.as_view(), name='gps-points-list'),
     path('api/gps-points/<int:vehicle_id>/', VehicleGPSPointListView.as_view(), name='gps-point-list-specific'),
+    path('api/gps-points/ingest/', GPSPointIngestView.as_view(), name='gps-points-ingest'),
 
     path('api/routes/points/', VehiclePointsByRoutesView.as_view(), name='routes-points-list'),
 
     path('api/routes/', RouteListView.as_view(), name='route-list'),
+    path('api/routes/<int:pk>/geometry/', RouteGeometryAPIView.as_view(), name='route-geometry'),
 
     path('enterprises/<int:pk>/vehicles/<int:vehicle_id>/', vehicle_detail_view, name='vehicle-detail'),
     path('enterprises/<int:pk>/vehicles/<int:vehicle_id>/map/', vehicle_map_view, name='vehicle-map'),
 
     path('api/export-enterprise-data/', ExportEnterpriseListView.as_view(), name='export_enterprise_data'),
+    path('api/export-jobs/', ExportJobListCreateView.as_view(), name='export-job-list'),
+    path('api/export-jobs/<int:pk>/', ExportJobDetailView.as_view(), name='export-job-detail'),
+    path('api/export-jobs/<int:pk>/download/', ExportJobDownloadView.as_view(), name='export-job-download'),
 
     path('api/import-enterprise-data-json/', ImportEnterpriseDataJSONView.as_view(), name='import-enterprise-json'),
     path('api/import-enterprise-data-csv/', ImportEnterpriseDataCSVView.as_view(), name='import-enterprise-csv'),
@@ -79,6 +87,8 @@ urlpatterns = [
     # 2. REST API для отчётов
     path('api/reports/mileage/', MileageReportAPIView.as_view(), name='mileage-report-api'),
     # API для пробега автомобиля
+    path('api/reports/enterprise-mileage/', EnterpriseMileageReportAPIView.as_view(), name='enterprise-mileage-report-api'),
+    # API для пробега всего парка предприятия
 
     path('vehicles/upload_trip/', upload_trip_view, name='upload_trip'),
 
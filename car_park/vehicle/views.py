@@ -1,11 +1,12 @@
 # views.py
-import csv
-import io
 import zipfile
+from itertools import islice
 
-import folium
 import gpxpy
 from django.contrib.gis.geos import Point
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.loader import render_to_string
 from django.urls import reverse
@@ -20,17 +21,22 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.settings import api_settings
 
 from .forms import EnterpriseForm, VehicleForm, TripUploadForm
-from .models import Vehicle, Enterprise, Driver, VehicleDriverAssignment, Manager, VehicleGPSPoint, Route, \
-    VehicleMileageReport
-from .modules.ors import reverse_geocode_ors, KEY
-from .pagination import CustomPageNumberPagination
+from .models import Vehicle, Driver, VehicleDriverAssignment, Manager, VehicleGPSPoint, Route, \
+    VehicleMileageReport, EnterpriseMileageReport, ExportJob
+from .modules import gps_ingest, streaming, enterprise_export, export_jobs, downloads, enterprise_import, \
+    mileage, report_jobs, geocoding, route_geometry, route_map, gps_columnar
+from .modules.scope import ManagerScopeMixin, get_manager_scope
+from .pagination import CustomPageNumberPagination, KeysetPaginationMixin, KeysetPagination, \
+    GPSPointKeysetPagination
+from .renderers import NDJSONRenderer
 from .serializers import VehicleSerializer, EnterpriseSerializer, DriverSerializer, VehicleDriverAssignmentSerializer, \
-    VehicleGPSPointSerializer, VehicleGPSPointGeoSerializer, RouteSerializer
+    VehicleGPSPointSerializer, VehicleGPSPointGeoSerializer, RouteSerializer, ExportJobSerializer
 
 from django.contrib.auth import authenticate, login
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
 
@@ -44,167 +50,155 @@ import uuid
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class ActiveVehicleDriverListAPIView(generics.ListAPIView):
+class ActiveVehicleDriverListAPIView(ManagerScopeMixin, generics.ListAPIView):
     serializer_class = VehicleDriverAssignmentSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprises = manager.enterprises.all()
-
-        return VehicleDriverAssignment.objects.filter(
+        queryset = VehicleDriverAssignment.objects.filter(
             is_active=True,
-            vehicle__enterprise__in=enterprises
+            vehicle__enterprise_id__in=self.scope.enterprise_ids
         )
+        # ?expand=vehicle,driver — вложенные объекты, иначе только id
+        expand = VehicleDriverAssignmentSerializer.get_expand(self.request)
+        return VehicleDriverAssignmentSerializer.setup_queryset(queryset, expand)
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class VehicleListCreateAPIView(generics.ListCreateAPIView):
+class VehicleListCreateAPIView(ManagerScopeMixin, KeysetPaginationMixin, generics.ListCreateAPIView):
     serializer_class = VehicleSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CustomPageNumberPagination  # Указываем кастомный пагинатор
+    keyset_pagination_class = KeysetPagination  # ?pagination=keyset — по id, без COUNT(*) и OFFSET
 
     def get_queryset(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprises = manager.enterprises.all()
-
-        queryset = Vehicle.objects.filter(enterprise__in=enterprises)
+        queryset = VehicleSerializer.setup_queryset(
+            Vehicle.objects.filter(enterprise_id__in=self.scope.enterprise_ids)
+        )
 
         # Фильтр активных транспортных средств
         active_only = self.request.query_params.get('active_only')
         if active_only == 'true':
-            queryset = queryset.filter(vehicledriverassignment__is_active=True).distinct()
+            queryset = queryset.filter(active_driver_pk__isnull=False)
         return queryset
 
     def perform_create(self, serializer):
-        manager = get_object_or_404(Manager, user=self.request.user)
         enterprise = serializer.validated_data.get('enterprise')
-        if enterprise in manager.enterprises.all():
+        if self.scope.allows(enterprise):
             serializer.save()
         else:
             raise PermissionDenied("Вы не можете создавать транспортные средства для этого предприятия.")
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class VehicleRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class VehicleRetrieveUpdateDestroyAPIView(ManagerScopeMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = VehicleSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        vehicle = get_object_or_404(Vehicle, pk=self.kwargs['pk'], enterprise__in=manager.enterprises.all())
+        vehicle = get_object_or_404(VehicleSerializer.setup_queryset(Vehicle.objects.all()),
+                                    pk=self.kwargs['pk'], enterprise_id__in=self.scope.enterprise_ids)
         return vehicle
 
     def perform_update(self, serializer):
-        manager = get_object_or_404(Manager, user=self.request.user)
         enterprise = serializer.validated_data.get('enterprise', serializer.instance.enterprise)
-        if enterprise in manager.enterprises.all():
+        if self.scope.allows(enterprise):
             serializer.save()
         else:
             raise PermissionDenied("Вы не можете обновлять транспортные средства этого предприятия.")
 
     def perform_destroy(self, instance):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        if instance.enterprise in manager.enterprises.all():
+        if self.scope.allows(instance.enterprise_id):
             instance.delete()
         else:
             raise PermissionDenied("Вы не можете удалять транспортные средства этого предприятия.")
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class EnterpriseListCreateAPIView(generics.ListCreateAPIView):
+class EnterpriseListCreateAPIView(ManagerScopeMixin, generics.ListCreateAPIView):
     serializer_class = EnterpriseSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        return manager.enterprises.all()
+        return self.scope.enterprises().order_by('id')
 
     def perform_create(self, serializer):
         # Если вы хотите ограничить создание предприятий только менеджерами
         serializer.save()
         # Если требуется добавить созданное предприятие к списку предприятий менеджера
-        manager = get_object_or_404(Manager, user=self.request.user)
+        manager = get_object_or_404(Manager, pk=self.scope.manager_id)
         manager.enterprises.add(serializer.instance)
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class EnterpriseRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class EnterpriseRetrieveUpdateDestroyAPIView(ManagerScopeMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = EnterpriseSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprise = get_object_or_404(Enterprise, pk=self.kwargs['pk'], managers=manager)
-        return enterprise
+        return self.scope.get_enterprise(self.kwargs['pk'])
 
     def perform_update(self, serializer):
         # Проверка прав доступа не требуется, так как get_object уже фильтрует доступные предприятия
         serializer.save()
 
     def perform_destroy(self, instance):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        if instance in manager.enterprises.all():
+        if self.scope.allows(instance):
             instance.delete()
         else:
             raise PermissionDenied("Вы не можете удалять это предприятие.")
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class DriverListCreateAPIView(generics.ListCreateAPIView):
+class DriverListCreateAPIView(ManagerScopeMixin, generics.ListCreateAPIView):
     serializer_class = DriverSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprises = manager.enterprises.all()
-        return Driver.objects.filter(enterprise__in=enterprises)
+        # ?expand=vehicles — машины водителя целиком, иначе только id
+        expand = DriverSerializer.get_expand(self.request)
+        return DriverSerializer.setup_queryset(Driver.objects.filter(enterprise_id__in=self.scope.enterprise_ids),
+                                               expand)
 
     def perform_create(self, serializer):
-        manager = get_object_or_404(Manager, user=self.request.user)
         enterprise = serializer.validated_data.get('enterprise')
-        if enterprise in manager.enterprises.all():
+        if self.scope.allows(enterprise):
             serializer.save()
         else:
             raise PermissionDenied("Вы не можете создавать водителей для этого предприятия.")
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class DriverRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class DriverRetrieveUpdateDestroyAPIView(ManagerScopeMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = DriverSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        driver = get_object_or_404(Driver, pk=self.kwargs['pk'], enterprise__in=manager.enterprises.all())
+        queryset = DriverSerializer.setup_queryset(Driver.objects.all(), DriverSerializer.get_expand(self.request))
+        driver = get_object_or_404(queryset, pk=self.kwargs['pk'], enterprise_id__in=self.scope.enterprise_ids)
         return driver
 
     def perform_update(self, serializer):
-        manager = get_object_or_404(Manager, user=self.request.user)
         enterprise = serializer.validated_data.get('enterprise', serializer.instance.enterprise)
-        if enterprise in manager.enterprises.all():
+        if self.scope.allows(enterprise):
             serializer.save()
         else:
             raise PermissionDenied("Вы не можете обновлять водителей этого предприятия.")
 
     def perform_destroy(self, instance):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        if instance.enterprise in manager.enterprises.all():
+        if self.scope.allows(instance.enterprise_id):
             instance.delete()
         else:
             raise PermissionDenied("Вы не можете удалять водителей этого предприятия.")
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class ActiveDriverAPIView(APIView):
+class ActiveDriverAPIView(ManagerScopeMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, vehicle_id):
-        manager = get_object_or_404(Manager, user=request.user)
-        enterprises = manager.enterprises.all()
-
         try:
-            vehicle = Vehicle.objects.get(id=vehicle_id, enterprise__in=enterprises)
+            vehicle = Vehicle.objects.get(id=vehicle_id, enterprise_id__in=self.scope.enterprise_ids)
             assignment = VehicleDriverAssignment.objects.filter(vehicle=vehicle, is_active=True).first()
             if assignment:
                 serializer = DriverSerializer(assignment.driver)
@@ -254,14 +248,13 @@ def login_view(request):
 
 @login_required
 def enterprise_list_view(request):
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprises = manager.enterprises.all()
+    enterprises = get_manager_scope(request).enterprises()
     return render(request, 'enterprise_list.html', {'enterprises': enterprises})
 
 
 @login_required
 def enterprise_edit_view(request, pk):
-    enterprise = get_object_or_404(Enterprise, pk=pk)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
     if request.method == 'POST':
         form = EnterpriseForm(request.POST, instance=enterprise)
         if form.is_valid():
@@ -276,8 +269,7 @@ def enterprise_edit_view(request, pk):
 @login_required
 def enterprise_vehicles_list_view(request, pk):
     # Проверяем, что предприятие доступно этому менеджеру
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprise = get_object_or_404(Enterprise, pk=pk, managers=manager)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
 
     vehicles = Vehicle.objects.filter(enterprise=enterprise)
 
@@ -289,8 +281,7 @@ def enterprise_vehicles_list_view(request, pk):
 
 @login_required
 def vehicle_add_view(request, pk):
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprise = get_object_or_404(Enterprise, pk=pk, managers=manager)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
 
     if request.method == 'POST':
         form = VehicleForm(request.POST)
@@ -312,8 +303,7 @@ def vehicle_add_view(request, pk):
 
 @login_required
 def vehicle_edit_view(request, pk, vehicle_id):
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprise = get_object_or_404(Enterprise, pk=pk, managers=manager)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
 
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise=enterprise)
 
@@ -335,8 +325,7 @@ def vehicle_edit_view(request, pk, vehicle_id):
 
 @login_required
 def vehicle_delete_view(request, pk, vehicle_id):
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprise = get_object_or_404(Enterprise, pk=pk, managers=manager)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
 
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise=enterprise)
 
@@ -352,24 +341,28 @@ def vehicle_delete_view(request, pk, vehicle_id):
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class VehicleGPSPointListView(generics.ListAPIView):
+class VehicleGPSPointListView(ManagerScopeMixin, KeysetPaginationMixin, generics.ListAPIView):
     """
     GET /api/gps-points/?vehicle_id=...&start_time=...&end_time=...&format=geojson
+    ?pagination=keyset&page_size=10000 — выгрузка истории одной машины (vehicle_id обязателен) по timestamp:
+    страницы без COUNT(*) и OFFSET, дальше — по ссылке next с непрозрачным курсором.
+    ?layout=columnar&encoding=json|polyline|binary — весь трек одной машины (vehicle_id обязателен)
+    параллельными массивами, без постраничной выдачи и сериализатора на точку (см. modules/gps_columnar.py).
     """
     permission_classes = [IsAuthenticated]
     serializer_class = VehicleGPSPointSerializer  # Обычный JSON по умолчанию
+    keyset_pagination_class = GPSPointKeysetPagination
 
     def get_queryset(self):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprises = manager.enterprises.all()
+        enterprise_ids = self.scope.enterprise_ids
 
-        queryset = VehicleGPSPoint.objects.all()
+        queryset = VehicleGPSPoint.objects.filter(vehicle__enterprise_id__in=enterprise_ids)
 
         # Получение vehicle_id из пути или параметров
         vehicle_id = self.kwargs.get('vehicle_id') or self.request.query_params.get('vehicle_id')
         if vehicle_id:
             # Проверяем принадлежность
-            vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise__in=enterprises)
+            vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise_id__in=enterprise_ids)
             queryset = queryset.filter(vehicle=vehicle)
 
         start_local_str = self.request.query_params.get('start_time')
@@ -396,26 +389,116 @@ class VehicleGPSPointListView(generics.ListAPIView):
         return queryset
 
     def list(self, request, *args, **kwargs):
+        if request.query_params.get('layout') == 'columnar':
+            return self.columnar(request)
+        vehicle_id = self.kwargs.get('vehicle_id') or request.query_params.get('vehicle_id')
+        if self.keyset_pagination_class.requested(request) and not vehicle_id:
+            return Response({"detail": "vehicle_id is required for pagination=keyset."},
+                            status=status.HTTP_400_BAD_REQUEST)
         geojson_param = request.query_params.get('geojson', 'false')
         if geojson_param == 'true':
             self.serializer_class = VehicleGPSPointGeoSerializer
         return super().list(request, *args, **kwargs)
 
+    def columnar(self, request):
+        vehicle_id = self.kwargs.get('vehicle_id') or request.query_params.get('vehicle_id')
+        if not vehicle_id:
+            return Response({"detail": "vehicle_id is required for layout=columnar."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        encoding = request.query_params.get('encoding', gps_columnar.ENCODING_JSON)
+        if encoding not in gps_columnar.ENCODINGS:
+            return Response({"detail": f"encoding must be one of {', '.join(gps_columnar.ENCODINGS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        ts, lon, lat = gps_columnar.load_columns(self.get_queryset().order_by('timestamp'))
+        if encoding == gps_columnar.ENCODING_BINARY:
+            return HttpResponse(gps_columnar.as_binary(ts, lon, lat), content_type=gps_columnar.BINARY_CONTENT_TYPE)
+        if encoding == gps_columnar.ENCODING_POLYLINE:
+            return Response(gps_columnar.as_polyline(int(vehicle_id), ts, lon, lat))
+        return Response(gps_columnar.as_json(int(vehicle_id), ts, lon, lat))
+
 
 @method_decorator(csrf_protect, name='dispatch')
-class VehiclePointsByRoutesView(APIView):
+class GPSPointIngestView(ManagerScopeMixin, APIView):
+    """
+    POST /api/gps-points/ingest/
+    Пакетная загрузка телеметрии по многим машинам сразу.
+    - application/x-ndjson (по умолчанию): одна точка на строку
+      {"vehicle_id": 1, "timestamp": "2025-01-01T10:00:00Z", "lon": 37.61, "lat": 55.75}
+    - application/octet-stream: записи gps_ingest.BINARY_RECORD (28 байт)
+    Принадлежность машин менеджеру проверяется один раз на машину за пакет,
+    запись идёт через COPY в одной транзакции. Точки, которые уже есть (та же машина и время),
+    не дублируются и считаются в duplicates — пакет можно безопасно отправить повторно.
+    """
+    permission_classes = [IsAuthenticated]
+    max_reported_errors = 100
+
+    def post(self, request):
+        enterprise_ids = self.scope.enterprise_ids
+
+        stream = request.stream
+        if stream is None:
+            return Response({"detail": "Empty body."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.content_type.startswith('application/octet-stream'):
+            records = gps_ingest.iter_binary(stream)
+        else:
+            records = gps_ingest.iter_ndjson(stream)
+
+        allowed, denied = set(), set()
+        accepted, duplicates, rejected = 0, 0, 0
+        errors = []
+
+        def reject(index, detail):
+            nonlocal rejected
+            rejected += 1
+            if len(errors) < self.max_reported_errors:
+                errors.append({"record": index, "detail": detail})
+
+        with transaction.atomic():
+            while True:
+                chunk = list(islice(records, gps_ingest.COPY_CHUNK_SIZE))
+                if not chunk:
+                    break
+
+                # Проверяем принадлежность только машин, которых ещё не видели в этом пакете
+                unseen = {row[0] for _, row, _ in chunk if row} - allowed - denied
+                if unseen:
+                    owned = set(Vehicle.objects.filter(
+                        pk__in=unseen, enterprise_id__in=enterprise_ids
+                    ).values_list('id', flat=True))
+                    allowed |= owned
+                    denied |= unseen - owned
+
+                rows = []
+                for index, row, error in chunk:
+                    if error:
+                        reject(index, error)
+                    elif row[0] not in allowed:
+                        reject(index, "Vehicle not found or access denied.")
+                    else:
+                        rows.append(row)
+                inserted = gps_ingest.copy_gps_points(rows)
+                accepted += inserted
+                duplicates += len(rows) - inserted
+
+        return Response({"accepted": accepted, "duplicates": duplicates, "rejected": rejected, "errors": errors},
+                        status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_protect, name='dispatch')
+class VehiclePointsByRoutesView(ManagerScopeMixin, APIView):
     """
     GET /api/routes/points/?vehicle_id=...&start_time=...&end_time=...
     start_time/end_time считаем локальными (таймзона предприятия). Переводим в UTC.
     Фильтруем маршруты, которые строго внутри [start_utc, end_utc].
-    Собираем их точки.
+    Точки всех маршрутов достаём одним запросом (join по окну маршрута) и отдаём потоком,
+    сгруппированными по маршрутам:
+    [{"route_id": ..., "start_time": ..., "end_time": ..., "points": [{id, timestamp, coordinates}, ...]}, ...]
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprises = manager.enterprises.all()
-
         vehicle_id = request.query_params.get('vehicle_id')
         start_local_str = request.query_params.get('start_time')
         end_local_str = request.query_params.get('end_time')
@@ -424,7 +507,7 @@ class VehiclePointsByRoutesView(APIView):
             return Response({"detail": "vehicle_id, start_time, end_time are required."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise__in=enterprises)
+        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise_id__in=self.scope.enterprise_ids)
 
         # Предположим, enterprise.local_timezone:
         # Но, не зная enterprise, можно взять 'Europe/Moscow' или UTC.
@@ -449,40 +532,67 @@ class VehiclePointsByRoutesView(APIView):
 
         # Находим Routes.
         # Условие: route.start_time >= start_utc  AND route.end_time <= end_utc
-        routes = Route.objects.filter(
-            vehicle_id=vehicle_id,
+        routes = list(Route.objects.filter(
+            vehicle_id=vehicle.id,
             start_time__gte=start_utc,
             end_time__lte=end_utc
-        )
-
-        # теперь собираем точки, которые лежат внутри каждого route
-        # вариант 1: общий список
-        all_points = []
-        for route in routes:
-            points = VehicleGPSPoint.objects.filter(
-                vehicle_id=vehicle_id,
-                timestamp__gte=route.start_time,
-                timestamp__lte=route.end_time
-            )
-            all_points.extend(points)
+        ).order_by('start_time', 'id').values('id', 'start_time', 'end_time'))
 
-        if not all_points:
+        if not routes:
             return Response({"detail": "No Routes matches the given query."},
                             status=status.HTTP_200_OK)
 
-        # сериализуем
-        serializer = VehicleGPSPointSerializer(all_points, many=True, context={'exclude_fields': ['vehicle']})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Точки всех маршрутов одним запросом, в том же порядке, что и маршруты
+        rows = streaming.iter_rows(ROUTE_POINTS_SQL, [vehicle.id, start_utc, end_utc, start_utc, end_utc])
+        return StreamingHttpResponse(streaming.buffered(_iter_route_points_json(routes, rows)),
+                                     content_type='application/json')
+
+
+ROUTE_POINTS_SQL = """
+    SELECT r.id, p.id, p."timestamp", ST_X(p.location), ST_Y(p.location)
+    FROM vehicle_route r
+    JOIN vehicle_vehiclegpspoint p
+      ON p.vehicle_id = r.vehicle_id
+     AND p."timestamp" >= r.start_time
+     AND p."timestamp" <= r.end_time
+    WHERE r.vehicle_id = %s
+      AND r.start_time >= %s
+      AND r.end_time <= %s
+      AND p."timestamp" >= %s
+      AND p."timestamp" <= %s
+    ORDER BY r.start_time, r.id, p."timestamp"
+"""
+
+
+def _iter_route_points_json(routes, rows):
+    """
+    Сливает отсортированные маршруты и точки в JSON-массив групп.
+    rows: (route_id, point_id, timestamp, lon, lat) в порядке маршрутов.
+    """
+    rows = iter(rows)
+    row = next(rows, None)
+    yield '['
+    for index, route in enumerate(routes):
+        yield ',' if index else ''
+        yield (f'{{"route_id":{route["id"]},'
+               f'"start_time":"{streaming.isoformat(route["start_time"])}",'
+               f'"end_time":"{streaming.isoformat(route["end_time"])}","points":[')
+        first = True
+        while row is not None and row[0] == route['id']:
+            _, point_id, ts, lon, lat = row
+            yield (f'{"" if first else ","}{{"id":{point_id},"timestamp":"{streaming.isoformat(ts)}",'
+                   f'"coordinates":[{lon!r},{lat!r}]}}')
+            first = False
+            row = next(rows, None)
+        yield ']}'
+    yield ']'
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class RouteListView(APIView):
+class RouteListView(ManagerScopeMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        manager = get_object_or_404(Manager, user=self.request.user)
-        enterprises = manager.enterprises.all()
-
         vehicle_id = request.query_params.get('vehicle_id')
         start_local_str = request.query_params.get('start_time')
         end_local_str = request.query_params.get('end_time')
@@ -491,7 +601,7 @@ class RouteListView(APIView):
             return Response({"detail": "vehicle_id, start_time, end_time are required."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise__in=enterprises)
+        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise_id__in=self.scope.enterprise_ids)
 
         # 2) Локальная таймзона
         enterprise_tz = zoneinfo.ZoneInfo(vehicle.enterprise.local_timezone.key)
@@ -520,25 +630,63 @@ class RouteListView(APIView):
             end_time__lte=end_utc
         )
 
-        # 4) Сериализация
-        # Передаём context={'request': ..., 'ors_api_key': '...'}
-        # Это нужно для reverse geocode
+        # 4) Адреса хранятся в поездках. При ?geocode=true недостающие (поездка только что создана)
+        #    берутся разом: кэш одним запросом, остальное параллельно у провайдера;
+        #    не успевшие к дедлайну адреса будут null
+        context = {'request': request}
+        if request.query_params.get('geocode') == 'true':
+            routes = list(routes)
+            context['addresses'] = geocoding.reverse_geocode_many(
+                [(point.y, point.x) for route in routes
+                 for address, point in ((route.start_address, route.start_location),
+                                        (route.end_address, route.end_location))
+                 if address is None and point],
+                deadline=settings.GEOCODING_DEADLINE,
+            )
+
+        # 5) Сериализация
         serializer = RouteSerializer(
             routes,
             many=True,
-            context={
-                'request': request,
-                'ors_api_key': "5b3ce3597851110001cf62489efd2bfc610f4a348f0719877a5d6a56"
-            }
+            context=context
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+@method_decorator(csrf_protect, name='dispatch')
+class RouteGeometryAPIView(ManagerScopeMixin, APIView):
+    """
+    GET /api/routes/<id>/geometry/?zoom=12
+    Трек поездки одной упрощённой линией (GeoJSON Feature) с рамкой и центром.
+    Допуск упрощения зависит от zoom (1 пиксель на этом масштабе);
+    без zoom — подбирается так, чтобы трек целиком помещался в карту шириной ~600px.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        route = get_object_or_404(Route, pk=pk, vehicle__enterprise_id__in=self.scope.enterprise_ids)
+
+        zoom = request.query_params.get('zoom')
+        if zoom is not None:
+            try:
+                zoom = int(zoom)
+            except ValueError:
+                zoom = None
+            if zoom is None or not route_geometry.MIN_ZOOM <= zoom <= route_geometry.MAX_ZOOM:
+                return Response(
+                    {"detail": f"zoom must be an integer {route_geometry.MIN_ZOOM}..{route_geometry.MAX_ZOOM}."},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        geometry = route_geometry.route_geometry(route, zoom=zoom)
+        if geometry is None:
+            return Response({"detail": "Route has no GPS points."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(route_geometry.as_feature(route, geometry))
+
+
 @login_required
 def vehicle_detail_view(request, pk, vehicle_id):
     # 1) Проверить, что enterprise принадлежит менеджеру
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprise = get_object_or_404(Enterprise, pk=pk, managers=manager)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
 
     # 2) Получить машину
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise=enterprise)
@@ -581,16 +729,26 @@ def vehicle_detail_view(request, pk, vehicle_id):
                 end_time__lte=end_utc
             ).order_by('start_time')
 
-            # Обогащаем данные адресами через API
-            for route in routes:
-                if route.start_location:
-                    route.start_address = reverse_geocode_ors(
-                        KEY, route.start_location.y, route.start_location.x
-                    )
-                if route.end_location:
-                    route.end_address = reverse_geocode_ors(
-                        KEY, route.end_location.y, route.end_location.x
-                    )
+            # Адреса хранятся в поездках. Ещё не заполненные — только при ?geocode=true:
+            # через кэш, новые места — параллельно у провайдера, с дедлайном
+            routes = list(routes)
+            if request.GET.get('geocode') == 'true':
+                addresses = geocoding.reverse_geocode_many(
+                    [(point.y, point.x) for route in routes
+                     for address, point in ((route.start_address, route.start_location),
+                                            (route.end_address, route.end_location))
+                     if address is None and point],
+                    deadline=settings.GEOCODING_DEADLINE,
+                )
+                for route in routes:
+                    if route.start_address is None and route.start_location:
+                        route.start_address = addresses.get(
+                            geocoding.cache_key(route.start_location.y, route.start_location.x)
+                        )
+                    if route.end_address is None and route.end_location:
+                        route.end_address = addresses.get(
+                            geocoding.cache_key(route.end_location.y, route.end_location.x)
+                        )
 
 
         except ValueError:
@@ -604,8 +762,7 @@ def vehicle_detail_view(request, pk, vehicle_id):
 
 @login_required
 def vehicle_map_view(request, pk, vehicle_id):
-    manager = get_object_or_404(Manager, user=request.user)
-    enterprise = get_object_or_404(Enterprise, pk=pk, managers=manager)
+    enterprise = get_manager_scope(request).get_enterprise(pk)
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise=enterprise)
 
     route_id = request.GET.get('route_id')
@@ -613,39 +770,13 @@ def vehicle_map_view(request, pk, vehicle_id):
         return HttpResponse("Не указан route_id")
 
     route = get_object_or_404(Route, pk=route_id, vehicle=vehicle)
-    # Получаем точки для этого Route (между route.start_time и route.end_time)
-    points = VehicleGPSPoint.objects.filter(
-        vehicle=vehicle,
-        timestamp__gte=route.start_time,
-        timestamp__lte=route.end_time
-    ).order_by('timestamp')
+    # Готовая карта из кэша: перестраивается, только если в окне поездки поменялись точки
+    map_html = route_map.route_map_html(route)
 
     # Если нет точек, просто сообщаем
-    if not points.exists():
+    if map_html is None:
         return HttpResponse("Нет точек для выбранной поездки")
 
-    # 1) Найдём среднюю точку для центра карты
-    avg_lat = sum(p.location.y for p in points) / len(points)
-    avg_lon = sum(p.location.x for p in points) / len(points)
-
-    # 2) Создадим Folium map
-    m = folium.Map(location=[avg_lat, avg_lon], zoom_start=8, width='600px', height='380px')
-
-    # 3) Соберём координаты в формате [[lat, lon], [lat, lon], ...]
-    coords = [[p.location.y, p.location.x] for p in points]
-
-    # 4) Добавим линию
-    folium.PolyLine(coords, color='blue', weight=4, opacity=0.7).add_to(m)
-
-    # 5) Добавим маркеры начала/конца
-    first = coords[0]
-    last = coords[-1]
-    folium.Marker(first, tooltip="Начало маршрута").add_to(m)
-    folium.Marker(last, tooltip="Конец маршрута").add_to(m)
-
-    # 6) Получаем HTML
-    map_html = m._repr_html_()  # Folium генерирует iframe HTML
-
     # Если запрос AJAX (например, из fetch), возвращаем только фрагмент
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         html_fragment = render_to_string('partials/vehicle_map.html', {
@@ -662,8 +793,13 @@ def vehicle_map_view(request, pk, vehicle_id):
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class ExportEnterpriseListView(APIView):
+class ExportEnterpriseListView(ManagerScopeMixin, APIView):
+    """
+    GET /api/export-enterprise-data/?enterprise_id=...&start_time=...&end_time=...&format=json|ndjson|csv
+    Выгрузка идёт потоком (см. modules/enterprise_export.py): память не зависит от размера предприятия.
+    """
     permission_classes = [IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
     def get(self, request):
         """
@@ -675,21 +811,21 @@ class ExportEnterpriseListView(APIView):
         out_format = request.query_params.get('format', 'json')
 
         # 1) Проверка доступа
-        manager = get_object_or_404(Manager, user=request.user)
-        enterprise = get_object_or_404(Enterprise, pk=enterprise_id, managers=manager)
+        enterprise = self.scope.get_enterprise(enterprise_id)
+
+        if out_format not in enterprise_export.EXPORT_FORMATS:
+            return Response({"detail": "Unsupported format"}, status=status.HTTP_400_BAD_REQUEST)
 
         # 2) Локальная таймзона
-        local_tz = zoneinfo.ZoneInfo(enterprise.local_timezone.key)
+        enterprise_tz = zoneinfo.ZoneInfo(enterprise.local_timezone.key)
 
         # 3) Конверсия дат
         # Допустим формат "YYYY-MM-DDTHH:MM"
-        enterprise_tz = zoneinfo.ZoneInfo(enterprise.local_timezone.key)
-
         fmt = "%Y-%m-%dT%H:%M"
         try:
             start_local = datetime.strptime(start_str, fmt)
             end_local = datetime.strptime(end_str, fmt)
-        except ValueError:
+        except (TypeError, ValueError):
             return Response({"detail": "Invalid time format. Use YYYY-MM-DDTHH:MM"},
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -701,196 +837,86 @@ class ExportEnterpriseListView(APIView):
         start_utc = start_local_aware.astimezone(timezone.timezone.utc)
         end_utc = end_local_aware.astimezone(timezone.timezone.utc)
 
-        # 4) Собираем данные:
-        #   a) enterprise info
-        #   b) vehicles of this enterprise
-        vehicles = Vehicle.objects.filter(enterprise=enterprise)
-        #   c) routes (поездки) за диапазон, для каждой машины
-        routes_data = {}
-
-        for v in vehicles:
-            v_routes = list(Route.objects.filter(
-                vehicle=v,
-                start_time__gte=start_utc,
-                end_time__lte=end_utc
-            ))  # Преобразуем QuerySet в список сразу
-            routes_data[v.id] = v_routes  # Храним маршруты в словаре
-
-        # 5) Формируем структуру Python (для JSON) или CSV
-        if out_format == 'json':
-            return _export_json(enterprise, vehicles, routes_data)
-        elif out_format == 'csv':
-            return _export_csv(enterprise, vehicles, routes_data)
-        else:
-            return Response({"detail": "Unsupported format"}, status=status.HTTP_400_BAD_REQUEST)
+        # 4) Отдаём поток: машины -> поездки -> точки, без накопления в памяти
+        generator, content_type, filename = enterprise_export.EXPORT_FORMATS[out_format]
+        response = StreamingHttpResponse(generator(enterprise, start_utc, end_utc), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 
-def _export_json(enterprise: Enterprise,
-                 vehicles: list[Vehicle],
-                 routes_data: dict[str, list[Route]]):
+@method_decorator(csrf_protect, name='dispatch')
+class ExportJobListCreateView(ManagerScopeMixin, APIView):
     """
-    Пример JSON структуры:
-    {
-      "enterprise": {
-         "external_id": ...,
-         "name": ...,
-         "city": ...
-      },
-      "vehicles": [
-        {
-          "external_id": ...,
-          "vin": ...,
-          "price": ...,
-          "release_year": ...,
-          "mileage": ...,
-          ...
-          "routes": [
-            {
-              "external_id": ...,
-              "start_time": ...,
-              "end_time": ...,
-              "gps_points": [ {timestamp, lat, lon}, ... ]
-            },
-            ...
-          ]
-        },
-        ...
-      ]
-    }
+    POST /api/export-jobs/  {"enterprise_id": ..., "start_time": "YYYY-MM-DDTHH:MM", "end_time": ..., "format": "json"}
+    Ставит выгрузку в фоновую очередь (202) или возвращает существующую задачу
+    с тем же отпечатком данных (200). GET — последние задачи менеджера.
     """
-    data = {
-        "enterprise": {
-            "external_id": str(enterprise.external_id),
-            "name": enterprise.name,
-            "city": enterprise.city,
-            "local_timezone": str(enterprise.local_timezone),
-        },
-        "vehicles": []
-    }
-    for item in vehicles:
-        vehicle_dict = {
-            "external_id": str(item.external_id),
-            "vin": item.vin,
-            "price": str(item.price),
-            "release_year": item.release_year,
-            "mileage": item.mileage,
-            "routes": []
-        }
-
-        # Достаём маршруты по ID без `next()`
-        route_info = routes_data.get(item.id, [])
+    permission_classes = [IsAuthenticated]
 
-        for r in route_info:
-            gps_points_qs = VehicleGPSPoint.objects.filter(
-                vehicle=item,
-                timestamp__gte=r.start_time,
-                timestamp__lte=r.end_time
-            ).order_by('timestamp')
+    def get(self, request):
+        jobs = ExportJob.objects.filter(enterprise_id__in=self.scope.enterprise_ids)[:50]
+        return Response(ExportJobSerializer(jobs, many=True, context={'request': request}).data)
 
-            gps_points = [
-                {"timestamp": gp.timestamp.isoformat(), "location": [gp.location.x, gp.location.y]}
-                for gp in gps_points_qs
-            ]
+    def post(self, request):
+        enterprise = self.scope.get_enterprise(request.data.get('enterprise_id'))
 
-            vehicle_dict["routes"].append({
-                "external_id": str(r.external_id),
-                "start_time": r.start_time.isoformat(),
-                "end_time": r.end_time.isoformat(),
-                "duration": str(r.duration),
-                "gps_points": gps_points,
-            })
+        out_format = request.data.get('format', 'json')
+        if out_format not in enterprise_export.EXPORT_FORMATS:
+            return Response({"detail": "Unsupported format"}, status=status.HTTP_400_BAD_REQUEST)
 
-        data["vehicles"].append(vehicle_dict)
+        enterprise_tz = zoneinfo.ZoneInfo(enterprise.local_timezone.key)
+        fmt = "%Y-%m-%dT%H:%M"
+        try:
+            start_local = datetime.strptime(request.data.get('start_time'), fmt)
+            end_local = datetime.strptime(request.data.get('end_time'), fmt)
+        except (TypeError, ValueError):
+            return Response({"detail": "Invalid time format. Use YYYY-MM-DDTHH:MM"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-    response = Response(data)
-    response["Content-Disposition"] = 'attachment; filename="export.json"'
+        start_utc = start_local.replace(tzinfo=enterprise_tz).astimezone(timezone.timezone.utc)
+        end_utc = end_local.replace(tzinfo=enterprise_tz).astimezone(timezone.timezone.utc)
 
-    return response
+        job, created = export_jobs.find_or_create_job(enterprise, start_utc, end_utc, out_format)
+        serializer = ExportJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
 
 
-def _export_csv(enterprise: Enterprise,
-                vehicles: list[Vehicle],
-                routes_data: dict[str, list[Route]]):
+@method_decorator(csrf_protect, name='dispatch')
+class ExportJobDetailView(ManagerScopeMixin, APIView):
+    """
+    GET /api/export-jobs/<id>/ — статус и прогресс выгрузки.
     """
-    Пример CSV: несколько CSV файлов в одном zip —
-    (1) enterprise.csv, (2) vehicles.csv, (3) routes.csv, (4) gps_points.csv.
-    Или всё в одном — на ваше усмотрение.
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(ExportJob, pk=pk, enterprise_id__in=self.scope.enterprise_ids)
+        return Response(ExportJobSerializer(job, context={'request': request}).data)
+
 
-    Здесь пример 'многий CSV -> один HttpResponse' c zip.
+@method_decorator(csrf_protect, name='dispatch')
+class ExportJobDownloadView(ManagerScopeMixin, APIView):
     """
-    import csv
-    import io
-    import zipfile
-
-    # Создадим BytesIO для ZIP
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-
-        # 1) enterprise.csv
-        csvfile = io.StringIO()
-        writer = csv.writer(csvfile)
-        writer.writerow(["external_id", "name", "city", "local_timezone"])
-        writer.writerow([str(enterprise.external_id), enterprise.name, enterprise.city, enterprise.local_timezone])
-        zf.writestr("enterprise.csv", csvfile.getvalue())
-
-        # 2) vehicles.csv
-        csvfile = io.StringIO()
-        writer = csv.writer(csvfile)
-        writer.writerow(["vehicle_external_id", "vin", "price", "release_year", "mileage"])
-
-        # 3) routes.csv
-        csvfile_routes = io.StringIO()
-        writer_routes = csv.writer(csvfile_routes)
-        writer_routes.writerow(["route_external_id", "vehicle_external_id", "start_time", "end_time", "duration"])
-
-        # 4) gps_points.csv
-        csvfile_gps_points = io.StringIO()
-        writer_gps_points = csv.writer(csvfile_gps_points)
-        writer_gps_points.writerow(["route_external_id", "timestamp", "lon", "lat"])
-
-        for vehicle in vehicles:
-            # 2) vehicles.csv
-            writer.writerow([str(vehicle.external_id), vehicle.vin, str(vehicle.price), vehicle.release_year, vehicle.mileage])
-
-            # 3) routes.csv
-            route_info = routes_data.get(vehicle.id, [])
-            for r in route_info:
-                writer_routes.writerow(
-                    [str(r.external_id), str(vehicle.external_id), r.start_time.isoformat(), r.end_time.isoformat(),
-                     str(r.duration)])
-
-                # 4) gps_points.csv
-                gps_points_qs = VehicleGPSPoint.objects.filter(
-                    vehicle=vehicle,
-                    timestamp__gte=r.start_time,
-                    timestamp__lte=r.end_time
-                ).order_by('timestamp')
-                for gp in gps_points_qs:
-                    writer_gps_points.writerow([
-                        str(r.external_id),
-                        gp.timestamp.isoformat(),
-                        gp.location.x,
-                        gp.location.y
-                    ])
-
-        # 2) vehicles.csv
-        zf.writestr("vehicles.csv", csvfile.getvalue())
-        # 3) routes.csv
-        zf.writestr("routes.csv", csvfile_routes.getvalue())
-        # 4) gps_points.csv
-        zf.writestr("gps_points.csv", csvfile_gps_points.getvalue())
-
-    # Вернём zip
-    response = HttpResponse(buffer.getvalue(), content_type='application/zip')
-    response['Content-Disposition'] = 'attachment; filename="enterprise_export.zip"'
-    return response
+    GET /api/export-jobs/<id>/download/ — готовый файл, с поддержкой Range для докачки.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(ExportJob, pk=pk, enterprise_id__in=self.scope.enterprise_ids, status=ExportJob.DONE)
+        if not job.file or not default_storage.exists(job.file.name):
+            return Response({"detail": "Export file is no longer available."}, status=status.HTTP_410_GONE)
+
+        _, content_type, filename = enterprise_export.EXPORT_FORMATS[job.format]
+        return downloads.ranged_file_response(request, default_storage.path(job.file.name), content_type,
+                                              filename, etag=job.fingerprint)
 
 
 @method_decorator(csrf_protect, name='dispatch')
 class ImportEnterpriseDataJSONView(APIView):
     """
-    POST /api/import-enterprise-data-json/
+    POST /api/import-enterprise-data-json/?chunk_size=5000
     JSON-структура (как при экспорте).
+    Этапы: разбор -> проверка -> пакетный upsert предприятия, машин и поездок -> COPY точек,
+    всё в одной транзакции. В ответе — количество записей и время каждого этапа.
     """
     permission_classes = [IsAuthenticated]
 
@@ -898,90 +924,42 @@ class ImportEnterpriseDataJSONView(APIView):
         manager = get_object_or_404(Manager, user=request.user)
 
         try:
-            data = request.data  # уже dict (DRF автоматически JSON->dict)
+            chunk_size = int(request.query_params.get('chunk_size', enterprise_import.DEFAULT_CHUNK_SIZE))
+        except ValueError:
+            return Response({"detail": "chunk_size must be an integer"}, status=400)
+        chunk_size = max(enterprise_import.MIN_CHUNK_SIZE, min(chunk_size, enterprise_import.MAX_CHUNK_SIZE))
+
+        timer = enterprise_import.StageTimer()
+        try:
+            with timer.stage("parse"):
+                data = request.data  # DRF разбирает тело лениво, при первом обращении
         except Exception as e:
             return Response({"detail": f"Invalid JSON: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # print(data)
-
-        enterprise_data = data.get("enterprise")
-        if not enterprise_data:
-            return Response({"detail": "No 'enterprise' key found in JSON"}, status=400)
-
-        # 1) Импорт/обновление Enterprise
-        enterprise_extid = enterprise_data.get("external_id")
-        if not enterprise_extid:
-            return Response({"detail": "Missing enterprise.external_id"}, status=400)
-        enterprise_obj, _ = Enterprise.objects.update_or_create(
-            external_id=enterprise_extid,
-            defaults={
-                "name": enterprise_data.get("name", "NoName"),
-                "city": enterprise_data.get("city", "NoCity"),
-                "local_timezone": enterprise_data.get("local_timezone", "UTC"),
-            }
-        )
-        # привязываем к менеджеру, если нужно
-        manager.enterprises.add(enterprise_obj)
-
-
-        # 2) Импорт vehicles
-        vehicles_list = data.get("vehicles", [])
-        for vdict in vehicles_list:
-            vextid = vdict.get("external_id")
-            if not vextid:
-                continue  # Или выдать ошибку
-
-            vehicle_obj, _ = Vehicle.objects.update_or_create(
-                external_id=vextid,
-                defaults={
-                    "vin": vdict.get("vin", ""),
-                    "price": vdict.get("price", "0"),
-                    "release_year": vdict.get("release_year", 2000),
-                    "mileage": vdict.get("mileage", 0),
-                    "enterprise": enterprise_obj,
-                    # color, configuration, etc. можно добавить
-                }
-            )
-            # 3) Импорт routes
-            routes = vdict.get("routes", [])
-            for rdict in routes:
-                rextid = rdict.get("external_id")
-                if not rextid:
-                    continue
-
-                start_time = parse_datetime(rdict.get("start_time"))
-                end_time = parse_datetime(rdict.get("end_time"))
-
-                route_obj, _ = Route.objects.update_or_create(
-                    external_id=rextid,
-                    defaults={
-                        "vehicle": vehicle_obj,
-                        "start_time": start_time,
-                        "end_time": end_time
-                    }
-                )
-                # 4) Импорт gps_points
-                gps_points = rdict.get("gps_points", [])
-                for gpd in gps_points:
-                    ts = gpd.get("timestamp")
-                    coords = gpd.get("location")  # [lon, lat]
-                    if not coords:
-                        continue
-                    VehicleGPSPoint.objects.create(
-                        vehicle=vehicle_obj,
-                        timestamp=ts,
-                        location=Point(coords[0], coords[1], srid=4326)
-                    )
-
-        return Response({"detail": "Import (JSON) successful"}, status=200)
+        try:
+            with timer.stage("validate"):
+                payload = enterprise_import.validate_json_payload(data)
+        except enterprise_import.ImportValidationError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        with transaction.atomic():
+            counts = enterprise_import.import_payload(manager, payload, chunk_size, timer)
+
+        return Response({
+            "detail": "Import (JSON) successful",
+            "imported": counts,
+            "skipped": payload["skipped"],
+            "timings": timer.timings,
+        }, status=200)
 
 
 @method_decorator(csrf_protect, name='dispatch')
 class ImportEnterpriseDataCSVView(APIView):
     """
-    POST /api/import-enterprise-data-csv/
+    POST /api/import-enterprise-data-csv/?chunk_size=5000
     Принимает multipart/form-data
     - file: zip-архив с enterprise.csv, vehicles.csv, routes.csv, gps_points.csv
+    Файлы читаются из архива построчно и пишутся пачками, память не растёт с размером архива.
     """
     permission_classes = [IsAuthenticated]
 
@@ -992,105 +970,23 @@ class ImportEnterpriseDataCSVView(APIView):
         if not file:
             return Response({"detail": "No file uploaded (expecting zip)."}, status=400)
 
-        # Открываем как zip
         try:
-            with zipfile.ZipFile(file, 'r') as zf:
-                # Ищем внутри 'enterprise.csv', 'vehicles.csv', etc.
-                enterprise_csv = zf.read('enterprise.csv').decode('utf-8')
-                vehicles_csv = zf.read('vehicles.csv').decode('utf-8')
-                routes_csv = zf.read('routes.csv').decode('utf-8')
-                gps_csv = zf.read('gps_points.csv').decode('utf-8')
-        except Exception as e:
-            return Response({"detail": f"Error reading zip: {e}"}, status=400)
-
-        # 1) Парсим enterprise.csv
-        #    Пример: id, name, city, local_timezone
-        enterprise_reader = csv.reader(io.StringIO(enterprise_csv))
-        header = next(enterprise_reader)  # ['external_id','name','city','local_timezone']
-        enterprise_data = next(enterprise_reader, None)
-        if not enterprise_data:
-            return Response({"detail":"No enterprise data in csv"}, status=400)
-        ent_external_id, ent_name, ent_city, ent_tz = enterprise_data
-
-        enterprise_obj, _ = Enterprise.objects.update_or_create(
-            external_id=ent_external_id,
-            defaults={
-                'name': ent_name,
-                'city': ent_city,
-                'local_timezone': ent_tz
-            }
-        )
-        manager.enterprises.add(enterprise_obj)
-
-        # 2) vehicles.csv
-        #    vehicle_external_id, vin, price, release_year, mileage
-        vehicle_reader = csv.reader(io.StringIO(vehicles_csv))
-        header = next(vehicle_reader)
-        for row in vehicle_reader:
-            vehicle_external_id, vin, price, release_year, mileage = row
-            Vehicle.objects.update_or_create(
-                external_id=vehicle_external_id,
-                defaults={
-                    'vin': vin,
-                    'price': price,
-                    'release_year': release_year,
-                    'mileage': mileage,
-                    'enterprise': enterprise_obj
-                }
-            )
-
-        # 3) routes.csv
-        #    route_external_id, vehicle_external_id, start_time, end_time, duration
-        route_reader = csv.reader(io.StringIO(routes_csv))
-        header = next(route_reader)
-        for row in route_reader:
-            route_external_id, veh_external_id, stime, etime, dur = row
-
-            start_time = parse_datetime(stime)
-            end_time = parse_datetime(etime)
-
-            try:
-                vehicle_obj = Vehicle.objects.get(external_id=veh_external_id)
-            except Vehicle.DoesNotExist:
-                return Response({"detail": f"No vehicle data for route: {row}"}, status=400)
-            
-            # dur может быть '2:30:00', optional
-            # parse stime, etime isoformat
-            Route.objects.update_or_create(
-                external_id=route_external_id,
-                defaults={
-                    'vehicle_id': vehicle_obj.id,
-                    'start_time': start_time,
-                    'end_time': end_time,
-                    'duration': dur if dur else None
-                }
-            )
-
-        # 4) gps_points.csv
-        #    route_external_id, timestamp, lon, lat
-        gps_reader = csv.reader(io.StringIO(gps_csv))
-        header = next(gps_reader)
-        for row in gps_reader:
-            route_external_id, ts, lon, lat = row
-            # найдём Route
-            try:
-                r_obj = Route.objects.get(external_id=route_external_id)
-            except Route.DoesNotExist:
-                continue
-            # А vehicle?
-            v_obj = r_obj.vehicle
-            # Cоздаём точку
-            VehicleGPSPoint.objects.create(
-                vehicle=v_obj,
-                timestamp=ts,
-                location=Point(float(lon), float(lat), srid=4326)
-            )
+            chunk_size = int(request.query_params.get('chunk_size', enterprise_import.DEFAULT_CHUNK_SIZE))
+        except ValueError:
+            return Response({"detail": "chunk_size must be an integer"}, status=400)
+        chunk_size = max(enterprise_import.MIN_CHUNK_SIZE, min(chunk_size, enterprise_import.MAX_CHUNK_SIZE))
 
-        return Response({"detail": "CSV Import successful"}, status=200)
+        timer = enterprise_import.StageTimer()
+        try:
+            # Большие загрузки Django держит во временном файле, zipfile читает его с диска
+            with zipfile.ZipFile(file, 'r') as zf, transaction.atomic():
+                result = enterprise_import.import_csv_zip(manager, zf, chunk_size, timer)
+        except zipfile.BadZipFile as e:
+            return Response({"detail": f"Error reading zip: {e}"}, status=400)
+        except enterprise_import.ImportValidationError as e:
+            return Response({"detail": str(e)}, status=400)
 
-def parse_datetime(dt_str):
-    """Функция для преобразования строки в datetime"""
-    return datetime.fromisoformat(dt_str) if dt_str else None
+        return Response({"detail": "CSV Import successful", **result, "timings": timer.timings}, status=200)
 
 
 
@@ -1098,19 +994,19 @@ def parse_datetime(dt_str):
 
 @login_required
 def report_list_view(request):
-    manager = get_object_or_404(Manager, user=request.user)
+    scope = get_manager_scope(request)
     # Вывести все отчёты, где manager имеет доступ (например, все VehicleMileageReport для enterprise in manager.enterprises).
     # Либо все Report, если user=...
     # В упрощенном случае:
     reports = VehicleMileageReport.objects.filter(
-        vehicle__enterprise__in=manager.enterprises.all()
+        vehicle__enterprise_id__in=scope.enterprise_ids
     )
     return render(request, 'report_list.html', {'reports': reports})
 
 
 @login_required
 def create_mileage_report_view(request):
-    manager = get_object_or_404(Manager, user=request.user)
+    scope = get_manager_scope(request)
     # Если POST -> собираем данные, создаём VehicleMileageReport
     if request.method == 'POST':
         vehicle_id = request.POST.get('vehicle_id')
@@ -1119,33 +1015,25 @@ def create_mileage_report_view(request):
         period = request.POST.get('period')  # day/month/year
 
         # Находим vehicle:
-        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise__in=manager.enterprises.all())
+        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise_id__in=scope.enterprise_ids)
 
         # Преобразуем start/end в date
         start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
         end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
 
-        # Создаём
-        rep = VehicleMileageReport.objects.create(
-            name=f"Отчёт о пробеге {vehicle.vin}",
-            start_date=start_date,
-            end_date=end_date,
-            period=period,
-            vehicle=vehicle
-        )
-        rep.calculate_report()
-        rep.save()
+        # Считается в фоне; такой же актуальный отчёт отдаём сразу
+        rep, _ = report_jobs.find_or_create_vehicle_report(vehicle, start_date, end_date, period)
         return redirect('report-detail', pk=rep.pk)
 
     # GET -> показать форму
-    vehicles = Vehicle.objects.filter(enterprise__in=manager.enterprises.all())
+    vehicles = Vehicle.objects.filter(enterprise_id__in=scope.enterprise_ids)
     return render(request, 'create_mileage_report.html', {'vehicles': vehicles})
 
 @login_required
 def report_detail_view(request, pk):
-    manager = get_object_or_404(Manager, user=request.user)
+    scope = get_manager_scope(request)
     # Сначала находим Report (или VehicleMileageReport)
-    report = get_object_or_404(VehicleMileageReport, pk=pk, vehicle__enterprise__in=manager.enterprises.all())
+    report = get_object_or_404(VehicleMileageReport, pk=pk, vehicle__enterprise_id__in=scope.enterprise_ids)
 
     # Преобразуем JSONField в список Python-объектов
     try:
@@ -1157,25 +1045,44 @@ def report_detail_view(request, pk):
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class MileageReportAPIView(APIView):
+class MileageReportAPIView(ManagerScopeMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        manager = get_object_or_404(Manager, user=request.user)
         vehicle_id = request.query_params.get('vehicle_id')
         start_date_str = request.query_params.get('start_date')
         end_date_str = request.query_params.get('end_date')
         period = request.query_params.get('period', 'day')
+        # engine=sql|python — расчёт по сырым точкам, для сверки с суточными итогами (rollup)
+        engine = request.query_params.get('engine', mileage.DEFAULT_ENGINE)
+        if engine not in mileage.ENGINES:
+            return Response({"detail": f"engine must be one of {', '.join(mileage.ENGINES)}"}, status=400)
 
         # 1) Ищем vehicle
-        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise__in=manager.enterprises.all())
+        vehicle = get_object_or_404(Vehicle, pk=vehicle_id, enterprise_id__in=self.scope.enterprise_ids)
 
         # 2) Парсим даты
         start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
         end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
 
-        # 3) Создаём объект отчёта (в памяти, не обязательно в БД)
-        # Или можно create/save
+        # 3) Готовый актуальный отчёт с теми же параметрами отдаём без пересчёта
+        if engine == mileage.DEFAULT_ENGINE:
+            cached = VehicleMileageReport.objects.filter(
+                vehicle=vehicle, start_date=start_date, end_date=end_date, period=period,
+                status=VehicleMileageReport.DONE,
+            ).order_by('-finished_at').first()
+            if cached and report_jobs.is_fresh(cached):
+                return Response({
+                    "type": "mileage",
+                    "vehicle": vehicle.vin,
+                    "start_date": str(start_date),
+                    "end_date": str(end_date),
+                    "period": period,
+                    "result": cached.result,
+                    "report_id": cached.pk,
+                }, status=200)
+
+        # Иначе считаем в памяти, не сохраняя в БД
         rep = VehicleMileageReport(
             name=f"Милетж {vehicle.vin}",
             start_date=start_date,
@@ -1183,7 +1090,7 @@ class MileageReportAPIView(APIView):
             period=period,
             vehicle=vehicle
         )
-        rep.calculate_report()  # внутри заполнит rep.result
+        rep.calculate_report(engine=engine)  # внутри заполнит rep.result
 
         data = {
             "type": "mileage",
@@ -1195,6 +1102,60 @@ class MileageReportAPIView(APIView):
         }
         return Response(data, status=200)
 
+
+@method_decorator(csrf_protect, name='dispatch')
+class EnterpriseMileageReportAPIView(ManagerScopeMixin, APIView):
+    """
+    GET /api/reports/enterprise-mileage/?enterprise_id=...&start_date=2025-01-01&end_date=2025-12-31&period=month
+        [&engine=rollup|sql]  (python — только командой fleet_mileage_report)
+    Пробег всего парка: итоги по периодам и компактная таблица по машинам
+    (ключи периодов один раз, у машин — только значения в том же порядке).
+    Отчёт считается в фоне: пока он не готов, ответ 202 со status/progress,
+    повторный такой же запрос вернёт готовый результат.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        enterprise_id = request.query_params.get('enterprise_id')
+        start_date_str = request.query_params.get('start_date')
+        end_date_str = request.query_params.get('end_date')
+        period = request.query_params.get('period', 'day')
+        engine = request.query_params.get('engine', mileage.DEFAULT_ENGINE)
+        if engine not in mileage.ENGINES:
+            return Response({"detail": f"engine must be one of {', '.join(mileage.ENGINES)}"}, status=400)
+        if engine not in mileage.FLEET_WEB_ENGINES:
+            return Response({"detail": f"engine={engine} is available only via manage.py fleet_mileage_report"},
+                            status=400)
+        periods = dict(EnterpriseMileageReport.PERIOD_CHOICES)
+        if period not in periods:
+            return Response({"detail": f"period must be one of {', '.join(periods)}"}, status=400)
+
+        enterprise = self.scope.get_enterprise(enterprise_id)
+
+        try:
+            start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return Response({"detail": "Invalid date format. Use YYYY-MM-DD."}, status=400)
+
+        rep, _ = report_jobs.find_or_create_enterprise_report(enterprise, start_date, end_date, period, engine)
+
+        data = {
+            "type": "enterprise_mileage",
+            "report_id": rep.pk,
+            "enterprise": enterprise.name,
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+            "period": period,
+            "engine": rep.engine,
+            "status": rep.status,
+            "progress": rep.progress,
+        }
+        if rep.status != EnterpriseMileageReport.DONE:
+            # Считается в фоне: повторите тот же запрос позже
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+        return Response({**data, "result": rep.result, **rep.vehicle_table()}, status=200)
+
 @login_required
 def upload_trip_view(request):
     if request.method == 'POST':
@@ -1255,21 +1216,19 @@ def upload_trip_view(request):
             else:
                 form.add_error('gpx_file', 'GPX файл не содержит данных о треке или путевых точках.')
                 return render(request, 'upload_trip.html', {'form': form})
-            # Создаем маршрут
-            route = Route.objects.create(
-                vehicle=vehicle,
-                start_time=start_time,
-                end_time=end_time,
-                start_location=track_points[0]['point'] if track_points else None,
-                end_location=track_points[-1]['point'] if track_points else None
-            )
-
-            # Сохраняем точки маршрута
-            for tp in track_points:
-                VehicleGPSPoint.objects.create(
+            with transaction.atomic():
+                # Создаем маршрут
+                route = Route.objects.create(
                     vehicle=vehicle,
-                    timestamp=tp['time'],
-                    location=tp['point']
+                    start_time=start_time,
+                    end_time=end_time,
+                    start_location=track_points[0]['point'] if track_points else None,
+                    end_location=track_points[-1]['point'] if track_points else None
+                )
+
+                # Сохраняем точки маршрута одной пачкой
+                gps_ingest.copy_gps_points(
+                    (vehicle.id, tp['time'], tp['point'].x, tp['point'].y) for tp in track_points
                 )
 
             # Форматирование дат (должно совпадать с тем, что обрабатывает vehicle_detail_view)